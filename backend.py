@@ -1,9 +1,13 @@
+import errno
 import os
+import select
 import signal
 import socket
 import subprocess
 import time
-from flask import Flask, jsonify, request, Response
+import orjson
+from flask import Flask, request, Response
+from werkzeug.wsgi import wrap_file
 
 app = Flask(__name__)
 
@@ -57,12 +61,62 @@ SERVICES = {
 # 工具函数
 ########################################
 
-def check_port(port, host="127.0.0.1", timeout=1.5):
+def json_response(obj):
+    # 用 orjson 代替 flask.jsonify 序列化
+    return Response(orjson.dumps(obj), mimetype="application/json")
+
+
+# 端口探测结果短暂缓存，避免外部频繁轮询 /status 时反复建连打扰服务
+PORT_CACHE_TTL = 0.5
+_PORT_CACHE = {}  # (host, port) -> (monotonic_ts, is_open)
+
+
+def check_port(port, host="127.0.0.1", timeout=0.05, use_cache=True):
+    key = (host, port)
+    if use_cache:
+        hit = _PORT_CACHE.get(key)
+        if hit and time.monotonic() - hit[0] < PORT_CACHE_TTL:
+            return hit[1]
+
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.settimeout(timeout)
     try:
-        with socket.create_connection((host, port), timeout=timeout):
+        ok = s.connect_ex((host, port)) == 0
+    except OSError:
+        ok = False
+    finally:
+        s.close()
+
+    _PORT_CACHE[key] = (time.monotonic(), ok)
+    return ok
+
+
+def wait_port(port, deadline, host="127.0.0.1", retry_interval=0.2):
+    """
+    等待端口可连，直到 deadline（time.monotonic()）
+    非阻塞 connect + select 等待握手完成；被拒绝时短暂间隔后重试
+    """
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setblocking(False)
+        try:
+            err = s.connect_ex((host, port))
+            if err in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+                _, writable, _ = select.select([], [s], [], remaining)
+                err = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) if writable else errno.ETIMEDOUT
+        except OSError as e:
+            err = e.errno
+        finally:
+            s.close()
+
+        if err == 0:
+            _PORT_CACHE[(host, port)] = (time.monotonic(), True)
             return True
-    except Exception:
-        return False
+        time.sleep(min(retry_interval, max(0.0, deadline - time.monotonic())))
 
 
 def read_pid(pid_file):
@@ -95,6 +149,55 @@ def process_exists(pid):
         return False
 
 
+# 本进程启动的子进程（pid -> Popen）：stop 时用来 wait 回收，避免留下僵尸进程
+_PROCS = {}
+
+
+def wait_exit(pid, timeout):
+    """
+    等待进程退出，返回是否已退出
+    - 优先 pidfd + select：进程退出时内核立即唤醒，不用 sleep 轮询
+    - 自己启动的子进程再 wait 一次完成回收
+    - pidfd 不可用（没有 os.pidfd_open，或调用报 ENOSYS / EPERM）时：自己的子进程用 wait(timeout)，否则回退为 0.5s 轮询
+    """
+    proc = _PROCS.get(pid)
+
+    fd = None
+    try:
+        fd = os.pidfd_open(pid)
+    except ProcessLookupError:
+        if proc is not None:
+            proc.wait()
+        return True
+    except (AttributeError, OSError):
+        # 非 Linux / Python < 3.9 没有 os.pidfd_open；内核 < 5.3 或 seccomp 沙箱下会报 ENOSYS / EPERM
+        pass
+
+    if fd is not None:
+        try:
+            readable, _, _ = select.select([fd], [], [], timeout)
+            exited = bool(readable)
+        finally:
+            os.close(fd)
+        if exited and proc is not None:
+            proc.wait()
+        return exited
+
+    if proc is not None:
+        try:
+            proc.wait(timeout=timeout)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if not process_exists(pid):
+            return True
+        time.sleep(0.5)
+    return not process_exists(pid)
+
+
 def derive_state(pid, port_open):
     """
     三态：
@@ -121,6 +224,7 @@ def start_process(cfg):
         stderr=log_fp,
         preexec_fn=os.setsid  # 让子进程成为新进程组，便于 killpg
     )
+    _PROCS[proc.pid] = proc
     write_pid(cfg["pid_file"], proc.pid)
     return proc.pid
 
@@ -139,38 +243,119 @@ def stop_process(cfg, grace=8):
         os.killpg(pgid, signal.SIGTERM)
 
         # 等待优雅退出
-        t0 = time.time()
-        while time.time() - t0 < grace:
-            if not process_exists(pid):
-                remove_pid(cfg["pid_file"])
-                return "stopped"
-            time.sleep(0.5)
+        if wait_exit(pid, grace):
+            _PROCS.pop(pid, None)
+            remove_pid(cfg["pid_file"])
+            return "stopped"
 
         # 超时强杀
         if process_exists(pid):
             os.killpg(pgid, signal.SIGKILL)
+            wait_exit(pid, 2)
+        _PROCS.pop(pid, None)
         remove_pid(cfg["pid_file"])
         return "killed"
     except Exception as e:
         return f"error: {e}"
 
 
+def tail_offset(log_file, lines, chunk_size=64 * 1024):
+    """
+    从文件末尾按块反向扫描，返回最后 N 行的起始字节偏移
+    只数换行、不保留内容，内存占用与文件大小无关
+    """
+    with open(log_file, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if lines <= 0:
+            return 0
+
+        # 文件末尾的换行属于最后一行，不计数
+        end = size
+        if size > 0:
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                end = size - 1
+
+        pos = end
+        remaining = lines
+        while pos > 0:
+            step = min(chunk_size, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            n = chunk.count(b"\n")
+            if n >= remaining:
+                idx = len(chunk)
+                for _ in range(remaining):
+                    idx = chunk.rindex(b"\n", 0, idx)
+                return pos + idx + 1
+            remaining -= n
+    return 0
+
+
+def follow_file(log_file, wake_timeout=30.0):
+    """
+    类似 tail -F：从文件末尾开始，持续产出新增内容
+    - 装了 inotify_simple（Linux）时阻塞在内核里等写事件，写入即唤醒，空闲不占 CPU
+    - 日志被移走/删除（logrotate）后等新文件出现再重新打开
+    - 没有 inotify_simple 时回退为 1s 轮询
+    """
+    try:
+        from inotify_simple import INotify, flags  # pip install inotify_simple
+    except ImportError:
+        INotify = None
+
+    f = open(log_file, "rb")
+    f.seek(0, os.SEEK_END)
+    try:
+        if INotify is None:
+            while True:
+                data = f.read()
+                if data:
+                    yield data
+                else:
+                    time.sleep(1.0)
+
+        gone = flags.MOVE_SELF | flags.DELETE_SELF
+        while True:
+            with INotify() as ino:
+                ino.add_watch(log_file, flags.MODIFY | gone)
+                rotated = False
+                while not rotated:
+                    # 用 select 等可读（gevent 下会被 monkey-patch 成协作式，不阻塞整个 worker）
+                    readable, _, _ = select.select([ino], [], [], wake_timeout)
+                    events = ino.read(timeout=0) if readable else []
+                    # 被截断（copytruncate）时从头读
+                    if os.fstat(f.fileno()).st_size < f.tell():
+                        f.seek(0)
+                    data = f.read()
+                    if data:
+                        yield data
+                    rotated = any(e.mask & gone for e in events)
+
+            f.close()
+            while not os.path.exists(log_file):
+                time.sleep(1.0)
+            f = open(log_file, "rb")
+    finally:
+        f.close()
+
+
 ########################################
 # 6 个 GET 指令
 ########################################
 
 @app.route("/<service>/status", methods=["GET"])
 def status(service):
-    if service not in SERVICES:
-        return jsonify({"error": "unknown service"}), 404
-
-    cfg = SERVICES[service]
+    cfg = SERVICES.get(service)
+    if cfg is None:
+        return json_response({"error": "unknown service"}), 404
     pid = read_pid(cfg["pid_file"])
     port_ok = check_port(cfg["port"])
     running = bool(pid and process_exists(pid))
     state = derive_state(pid, port_ok)
 
-    return jsonify({
+    return json_response({
         "service": service,
         "state": state,           # stopped | starting | ready
         "running": running,
@@ -182,34 +367,32 @@ def status(service):
 
 @app.route("/<service>/start", methods=["GET"])
 def start(service):
-    if service not in SERVICES:
-        return jsonify({"error": "unknown service"}), 404
-
-    cfg = SERVICES[service]
+    cfg = SERVICES.get(service)
+    if cfg is None:
+        return json_response({"error": "unknown service"}), 404
     pid = read_pid(cfg["pid_file"])
     port_ok = check_port(cfg["port"])
 
     # 已就绪
     if pid and process_exists(pid) and port_ok:
-        return jsonify({"service": service, "status": "already_running", "pid": pid})
+        return json_response({"service": service, "status": "already_running", "pid": pid})
 
     # 若 PID 存在但端口未开，视为 starting
     if pid and process_exists(pid) and not port_ok:
-        return jsonify({"service": service, "status": "starting", "pid": pid})
+        return json_response({"service": service, "status": "starting", "pid": pid})
 
     # 启动新进程（异步）
     new_pid = start_process(cfg)
-    return jsonify({"service": service, "status": "starting", "pid": new_pid})
+    return json_response({"service": service, "status": "starting", "pid": new_pid})
 
 
 @app.route("/<service>/stop", methods=["GET"])
 def stop(service):
-    if service not in SERVICES:
-        return jsonify({"error": "unknown service"}), 404
-
-    cfg = SERVICES[service]
+    cfg = SERVICES.get(service)
+    if cfg is None:
+        return json_response({"error": "unknown service"}), 404
     result = stop_process(cfg)
-    return jsonify({"service": service, "status": result})
+    return json_response({"service": service, "status": result})
 
 
 ########################################
@@ -222,19 +405,16 @@ def wait_ready(service):
     轮询直到端口可用或超时
     ?timeout=120  （秒）
     """
-    if service not in SERVICES:
-        return jsonify({"error": "unknown service"}), 404
+    cfg = SERVICES.get(service)
+    if cfg is None:
+        return json_response({"error": "unknown service"}), 404
 
     timeout = int(request.args.get("timeout", 120))
-    cfg = SERVICES[service]
 
-    t0 = time.time()
-    while time.time() - t0 < timeout:
-        if check_port(cfg["port"]):
-            return jsonify({"service": service, "ready": True})
-        time.sleep(2)
+    if wait_port(cfg["port"], deadline=time.monotonic() + timeout):
+        return json_response({"service": service, "ready": True})
 
-    return jsonify({"service": service, "ready": False, "timeout": timeout})
+    return json_response({"service": service, "ready": False, "timeout": timeout})
 
 
 ########################################
@@ -246,45 +426,48 @@ def logs(service):
     """
     默认返回最后 200 行
     ?lines=500
+    ?raw=1  返回整个日志文件（1 / true / yes，不区分大小写；raw=0、raw=false 仍只返回最后 N 行）
     """
-    if service not in SERVICES:
-        return jsonify({"error": "unknown service"}), 404
+    cfg = SERVICES.get(service)
+    if cfg is None:
+        return json_response({"error": "unknown service"}), 404
 
     lines = int(request.args.get("lines", 200))
-    log_file = SERVICES[service]["log_file"]
+    log_file = cfg["log_file"]
 
     if not os.path.exists(log_file):
-        return jsonify({"service": service, "logs": ""})
-
-    # 读取最后 N 行
-    with open(log_file, "rb") as f:
-        data = f.readlines()[-lines:]
-    return Response(b"".join(data), mimetype="text/plain")
+        return json_response({"service": service, "logs": ""})
+
+    # 定位最后 N 行的起点（?raw=1 返回整个文件），从该处把文件交给 WSGI 服务器发送：
+    # gunicorn 等会对文件对象走 sendfile(2)，内容不经过 Python 内存
+    raw = request.args.get("raw", "").strip().lower() in ("1", "true", "yes")
+    offset = 0 if raw else tail_offset(log_file, lines)
+    fh = open(log_file, "rb")
+    fh.seek(offset)
+    return Response(
+        wrap_file(request.environ, fh, buffer_size=64 * 1024),
+        mimetype="text/plain",
+        direct_passthrough=True,
+    )
 
 
 @app.route("/<service>/logs/stream", methods=["GET"])
 def logs_stream(service):
     """
-    简单的流式日志（SSE-like，逐行输出）
+    简单的流式日志（SSE-like，有新内容即输出）
     """
-    if service not in SERVICES:
-        return jsonify({"error": "unknown service"}), 404
+    cfg = SERVICES.get(service)
+    if cfg is None:
+        return json_response({"error": "unknown service"}), 404
 
-    log_file = SERVICES[service]["log_file"]
+    log_file = cfg["log_file"]
 
     def generate():
         if not os.path.exists(log_file):
             yield b"(no log yet)\n"
             return
-        with open(log_file, "rb") as f:
-            # 从文件末尾开始跟随
-            f.seek(0, os.SEEK_END)
-            while True:
-                line = f.readline()
-                if not line:
-                    time.sleep(1.0)
-                    continue
-                yield line
+        # 从文件末尾开始跟随，有新写入即推送
+        yield from follow_file(log_file)
 
     return Response(generate(), mimetype="text/plain")
 
@@ -295,4 +478,7 @@ def logs_stream(service):
 
 if __name__ == "__main__":
     # 注意：不要开启 debug=True（会导致重复启动子进程）
+    # 开发服务器一个连接占一个线程，/logs/stream、/wait_ready 这类长连接会把它占满；
+    # 常驻部署请用 scripts/serve_backend.sh（gunicorn + gevent）
+    print("[WARN] running Flask dev server; use scripts/serve_backend.sh for long-lived deployments")
     app.run(host="0.0.0.0", port=5050)
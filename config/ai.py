@@ -14,10 +14,19 @@ from __future__ import annotations
 
 import os
 import json
-from dataclasses import dataclass
-from typing import List, Dict, Any, Optional
-
+import asyncio
+import contextlib
+import hashlib
+import functools
+import tempfile
+from dataclasses import dataclass, replace
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 # ============================================================
@@ -68,20 +77,27 @@ class AIConfig:
     zhipu: Optional[ZhipuConfig]
     openai_compat: Optional[OpenAICompatConfig]
     ocr: MinerUOCRConfig
+    # 按 (模型, messages, response_json) 缓存 LLM 响应到磁盘；重跑时命中直接返回
+    llm_cache: bool = False
+    llm_cache_dir: str = "storage/.llm_cache"
 
 
 # ============================================================
 # Config loader
 # ============================================================
 
+@functools.lru_cache(maxsize=1)
 def load_ai_config() -> AIConfig:
     provider = os.getenv("LLM_PROVIDER", "zhipu")
+    # 设为 0 时输出确定，analyze_03_deep*.py 才会缓存深度解读请求
+    temperature = float(os.getenv("LLM_TEMPERATURE", "0.2"))
 
     zhipu_cfg = None
     if provider == "zhipu":
         zhipu_cfg = ZhipuConfig(
             api_key=os.getenv("ZHIPU_API_KEY", ""),
             model=os.getenv("ZHIPU_MODEL", "glm-4.5-flash"),
+            temperature=temperature,
         )
 
     openai_cfg = None
@@ -91,6 +107,7 @@ def load_ai_config() -> AIConfig:
             base_url=os.getenv("LLM_BASE_URL", "http://127.0.0.1:8000/v1"),
             api_key=os.getenv("LLM_API_KEY", ""),
             chat_completions_path=os.getenv("LLM_CHAT_PATH", "/chat/completions"),
+            temperature=temperature,
         )
 
     ocr_cfg = MinerUOCRConfig(
@@ -105,7 +122,40 @@ def load_ai_config() -> AIConfig:
         zhipu=zhipu_cfg,
         openai_compat=openai_cfg,
         ocr=ocr_cfg,
+        llm_cache=os.getenv("LLM_CACHE", "False").lower() in ("1", "true", "yes"),
+        llm_cache_dir=os.getenv("LLM_CACHE_DIR", "storage/.llm_cache"),
+    )
+
+
+# ============================================================
+# HTTP session
+# ============================================================
+
+# 建连超时单独设短一点；读超时仍用各自 cfg.timeout（LLM/OCR 可能要跑很久）
+CONNECT_TIMEOUT = 10
+
+
+def _new_session(retry_post: bool = True) -> requests.Session:
+    """
+    长连接复用的 Session：同一 client 的多次请求共用 TCP/TLS 连接，
+    连接失败或服务端 502/503/504（如 vLLM 还在加载）时自动退避重试。
+    retry_post=False：POST 遇到 502/503/504 不在这一层重试，交给外层（LLMTransport）重试并计入限速
+    """
+    retry = Retry(
+        total=3,
+        connect=3,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST"} if retry_post else {"GET"}),
+        raise_on_status=False,
     )
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    s.headers["Connection"] = "keep-alive"
+    return s
 
 
 # ============================================================
@@ -114,8 +164,14 @@ def load_ai_config() -> AIConfig:
 
 class LLMClient:
 
-    def __init__(self, cfg: AIConfig):
+    def __init__(self, cfg: AIConfig, retry_post: bool = True):
         self.cfg = cfg
+        self._retry_post = retry_post
+        self._sess = _new_session(retry_post)
+        # 智谱 SDK client 首次调用时再创建，之后复用
+        self._zhipu_client = None
+        # 异步 client 绑定事件循环：在 chat_async 里按需创建，用完 aclose()
+        self._aclient: Optional[httpx.AsyncClient] = None
 
     # ---------- public ----------
 
@@ -124,22 +180,134 @@ class LLMClient:
         messages: List[Dict[str, str]],
         response_json: bool = False,
     ) -> Dict[str, Any]:
+        cache_key = self._cache_key(messages, response_json)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+
         if self.cfg.llm_provider == "zhipu":
-            return self._chat_zhipu(messages, response_json)
+            resp = self._chat_zhipu(messages, response_json)
         elif self.cfg.llm_provider == "openai_compat":
-            return self._chat_openai_compat(messages, response_json)
+            resp = self._chat_openai_compat(messages, response_json)
         else:
             raise ValueError(f"Unknown LLM provider: {self.cfg.llm_provider}")
 
+        self._cache_put(cache_key, resp)
+        return resp
+
     def chat_text(self, messages: List[Dict[str, str]], **kwargs) -> str:
         resp = self.chat(messages, **kwargs)
+        return self._content_of(resp)
+
+    async def chat_async(
+        self,
+        messages: List[Dict[str, str]],
+        response_json: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        chat() 的异步版：openai_compat 走共享的 httpx.AsyncClient，
+        单线程即可同时挂起大量请求；智谱 SDK 是同步的，放到线程里执行。
+        """
+        if self.cfg.llm_provider != "openai_compat":
+            return await asyncio.to_thread(self.chat, messages, response_json)
+
+        cache_key = self._cache_key(messages, response_json)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        resp = await self._chat_openai_compat_async(messages, response_json)
+        self._cache_put(cache_key, resp)
+        return resp
+
+    async def chat_text_async(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        resp = await self.chat_async(messages, **kwargs)
+        return self._content_of(resp)
+
+    def with_response_cache(self, cache_dir: str) -> "LLMClient":
+        """
+        开启请求级磁盘缓存（key 为 provider + 模型 + 实际发送的 messages）的 client，缓存写到 cache_dir
+        temperature != 0 时同样的请求输出并不确定，不缓存，原样返回 self
+        """
+        if self._temperature() != 0:
+            return self
+        return LLMClient(replace(self.cfg, llm_cache=True, llm_cache_dir=cache_dir), self._retry_post)
+
+    def without_post_retries(self) -> "LLMClient":
+        """
+        会话层不重试 POST 的 client（配置相同）：外层 LLMTransport 自己重试时用，
+        避免两层重试叠加、且每次重试都经过限速器。返回新对象，get_ai_clients 缓存的共享 client 不受影响
+        """
+        if not self._retry_post:
+            return self
+        return LLMClient(self.cfg, retry_post=False)
+
+    async def aclose(self) -> None:
+        if self._aclient is not None:
+            await self._aclient.aclose()
+            self._aclient = None
+
+    # ---------- private ----------
+
+    def _model_name(self) -> str:
+        if self.cfg.zhipu is not None:
+            return self.cfg.zhipu.model
+        if self.cfg.openai_compat is not None:
+            return self.cfg.openai_compat.model
+        return ""
+
+    def _temperature(self) -> float:
+        if self.cfg.zhipu is not None:
+            return self.cfg.zhipu.temperature
+        if self.cfg.openai_compat is not None:
+            return self.cfg.openai_compat.temperature
+        return 0.0
+
+    def _cache_key(self, messages: List[Dict[str, str]], response_json: bool) -> Optional[str]:
+        if not self.cfg.llm_cache:
+            return None
+        raw = orjson.dumps(
+            {"p": self.cfg.llm_provider, "m": self._model_name(), "msgs": messages, "rj": response_json},
+            option=orjson.OPT_SORT_KEYS,
+        )
+        return hashlib.sha256(raw).hexdigest()
+
+    def _cache_get(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        if key is None:
+            return None
+        path = os.path.join(self.cfg.llm_cache_dir, f"{key}.json")
+        try:
+            with open(path, "rb") as f:
+                return orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+
+    def _cache_put(self, key: Optional[str], resp: Dict[str, Any]) -> None:
+        # 只缓存拿到正文的响应；先写临时文件再 os.replace，避免并发/中断留下半个文件
+        if key is None:
+            return
+        try:
+            resp["choices"][0]["message"]["content"]
+        except Exception:
+            return
+        os.makedirs(self.cfg.llm_cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.cfg.llm_cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps(resp))
+            os.replace(tmp, os.path.join(self.cfg.llm_cache_dir, f"{key}.json"))
+        except Exception:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _content_of(resp: Dict[str, Any]) -> str:
         try:
             return resp["choices"][0]["message"]["content"]
         except Exception:
             return json.dumps(resp, ensure_ascii=False, indent=2)
 
-    # ---------- private ----------
-
     @staticmethod
     def _openai_compat_chat_url(base_url: str, chat_path: str) -> str:
         """
@@ -153,11 +321,11 @@ class LLMClient:
             return b + p
         return b + "/v1" + p
 
-    def _chat_openai_compat(
+    def _openai_compat_request(
         self,
         messages: List[Dict[str, str]],
         response_json: bool,
-    ) -> Dict[str, Any]:
+    ) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
         cfg = self.cfg.openai_compat
         assert cfg is not None
 
@@ -175,8 +343,18 @@ class LLMClient:
         }
         if response_json:
             payload["response_format"] = {"type": "json_object"}
+        return url, headers, payload
 
-        r = requests.post(url, headers=headers, json=payload, timeout=cfg.timeout)
+    def _chat_openai_compat(
+        self,
+        messages: List[Dict[str, str]],
+        response_json: bool,
+    ) -> Dict[str, Any]:
+        cfg = self.cfg.openai_compat
+        assert cfg is not None
+
+        url, headers, payload = self._openai_compat_request(messages, response_json)
+        r = self._sess.post(url, headers=headers, json=payload, timeout=(CONNECT_TIMEOUT, cfg.timeout))
         try:
             r.raise_for_status()
         except requests.HTTPError as e:
@@ -186,6 +364,36 @@ class LLMClient:
             raise
         return r.json()
 
+    async def _chat_openai_compat_async(
+        self,
+        messages: List[Dict[str, str]],
+        response_json: bool,
+    ) -> Dict[str, Any]:
+        cfg = self.cfg.openai_compat
+        assert cfg is not None
+
+        if self._aclient is None:
+            self._aclient = httpx.AsyncClient(
+                timeout=httpx.Timeout(cfg.timeout, connect=CONNECT_TIMEOUT),
+                transport=httpx.AsyncHTTPTransport(
+                    retries=3,
+                    limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+                ),
+            )
+
+        url, headers, payload = self._openai_compat_request(messages, response_json)
+        r = await self._aclient.post(url, headers=headers, json=payload)
+        try:
+            r.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            body = (r.text or "").strip()
+            if body:
+                raise httpx.HTTPStatusError(
+                    f"{e} | response_body={body[:2000]}", request=e.request, response=e.response
+                ) from e
+            raise
+        return r.json()
+
     def _chat_zhipu(
         self,
         messages: List[Dict[str, str]],
@@ -201,7 +409,9 @@ class LLMClient:
         if not cfg.api_key:
             raise RuntimeError("ZHIPU_API_KEY 为空：请通过环境变量设置智谱 API Key")
 
-        client = ZhipuAI(api_key=cfg.api_key)
+        if self._zhipu_client is None:
+            self._zhipu_client = ZhipuAI(api_key=cfg.api_key)
+        client = self._zhipu_client
 
         kwargs: Dict[str, Any] = {
             "model": cfg.model,
@@ -244,6 +454,8 @@ def _safe_cfg_repr(cfg: AIConfig) -> str:
     """
     data = {
         "llm_provider": cfg.llm_provider,
+        "llm_cache": cfg.llm_cache,
+        "llm_cache_dir": cfg.llm_cache_dir,
         "zhipu": None,
         "openai_compat": None,
         "ocr": {
@@ -285,6 +497,7 @@ class OCRClient:
 
     def __init__(self, cfg: MinerUOCRConfig):
         self.cfg = cfg
+        self._sess = _new_session()
 
     def ocr_pdf(self, pdf_path: str) -> Dict[str, Any]:
         if not self.cfg.enabled:
@@ -296,10 +509,10 @@ class OCRClient:
         try:
             with open(pdf_path, "rb") as f:
                 files = {self.cfg.file_field: (filename, f, self.cfg.content_type)}
-                r = requests.post(
+                r = self._sess.post(
                     self.cfg.base_url,
                     files=files,
-                    timeout=self.cfg.timeout,
+                    timeout=(CONNECT_TIMEOUT, self.cfg.timeout),
                 )
 
             r.raise_for_status()
@@ -324,18 +537,77 @@ class OCRClient:
                 },
             }
 
+    def ocr_pdf_batch(self, pdf_paths: List[str]) -> List[Dict[str, Any]]:
+        """
+        一次请求上传多篇 PDF（MinerU 的 files 字段可重复），摊薄每次调用的调度/模型启动开销。
+        返回与 pdf_paths 一一对应、与 ocr_pdf 同格式的结果；整批失败或缺某篇结果时该篇回退到 ocr_pdf
+        """
+        if len(pdf_paths) <= 1:
+            return [self.ocr_pdf(p) for p in pdf_paths]
+        if not self.cfg.enabled:
+            raise RuntimeError("OCR is disabled")
+
+        data: Dict[str, Any] = {}
+        try:
+            with contextlib.ExitStack() as stack:
+                files = [
+                    (
+                        self.cfg.file_field,
+                        (os.path.basename(p), stack.enter_context(open(p, "rb")), self.cfg.content_type),
+                    )
+                    for p in pdf_paths
+                ]
+                r = self._sess.post(
+                    self.cfg.base_url,
+                    files=files,
+                    timeout=(CONNECT_TIMEOUT, self.cfg.timeout * len(pdf_paths)),
+                )
+            r.raise_for_status()
+            data = r.json()
+        except Exception:
+            data = {}
+
+        results = data.get("results") or {}
+        meta = {k: v for k, v in data.items() if k != "results"}
+        out: List[Dict[str, Any]] = []
+        for p in pdf_paths:
+            paper_id = os.path.splitext(os.path.basename(p))[0]
+            res = results.get(paper_id)
+            if res is None:
+                out.append(self.ocr_pdf(p))
+            else:
+                out.append({**meta, "results": {paper_id: res}})
+        return out
+
 
 # ============================================================
 # Factory
 # ============================================================
 
+@functools.lru_cache(maxsize=1)
 def get_ai_clients():
+    """
+    进程内只构造一次；各脚本逐篇调用时复用同一组 client（及其连接池）
+    """
     cfg = load_ai_config()
     llm = LLMClient(cfg)
     ocr = OCRClient(cfg.ocr)
     return cfg, llm, ocr
 
 
+@functools.lru_cache(maxsize=None)
+def get_llm_for_model(model: str) -> LLMClient:
+    """
+    同一 provider / 服务地址下换一个模型的 LLM client（如按论文长度路由到的小模型），按模型名各构造一次
+    """
+    cfg = load_ai_config()
+    if cfg.zhipu is not None:
+        cfg = replace(cfg, zhipu=replace(cfg.zhipu, model=model))
+    if cfg.openai_compat is not None:
+        cfg = replace(cfg, openai_compat=replace(cfg.openai_compat, model=model))
+    return LLMClient(cfg)
+
+
 # ============================================================
 # Minimal test
 # ============================================================
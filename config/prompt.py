@@ -17,18 +17,20 @@ SYSTEM_CN_PLAIN = """你是一个严谨的学术论文助手。
 你必须基于输入文本回答，不要编造不存在的信息。
 你必须只输出回答正文（纯文本），不要输出 JSON、不要 markdown、不要代码块、不要任何额外解释。"""
 
-def build_user_prompt_step03_summary_cn(summary: str) -> str:
-    """
-    参考 Step03_query_GPT.py：把摘要结构化为中文 JSON（单层 key-value）。
-    """
-    s = (summary or "").replace("\n", " ").strip()
-    return f"""
-请将以下论文摘要分点用中文总结，避免使用数学符号，并以 JSON 格式输出，每个要点对应一个键值对。
+def normalize_abstract(summary: str) -> str:
+    """摘要压成一行；同一篇论文的摘要/相关性两个提示词共用，调用方只需算一次"""
+    return (summary or "").replace("\n", " ").strip()
+
+
+# 模板里不变的部分在 import 时拼好，构造提示词时只做一次拼接
+_SUMMARY_PREFIX = """请将以下论文摘要分点用中文总结，避免使用数学符号，并以 JSON 格式输出，每个要点对应一个键值对。
 
-摘要：{s}
+摘要："""
+
+_SUMMARY_SUFFIX = """
 
 输出 JSON 的 key 必须严格为：
-{{
+{
   "总结": "内容",
   "背景": "内容",
   "目的": "内容",
@@ -36,29 +38,38 @@ def build_user_prompt_step03_summary_cn(summary: str) -> str:
   "主要发现": "内容",
   "结论": "内容",
   "翻译": "内容"
-}}
+}
 
 规则：
 - 必须输出严格合法 JSON（不要 markdown、不要代码块）。
-- 如果摘要里没有提到某项，请填 "unknown"。
-""".strip()
+- 如果摘要里没有提到某项，请填 "unknown"。"""
+
+_RELEVANCE_PREFIX = """你正在筛选论文是否与你的研究方向高度相关。
+
+研究方向："""
+
+_RELEVANCE_MIDDLE = """
+
+请判断以下论文摘要是否与你的研究方向高度相关，仅回复“是”或“否”：
+
+摘要："""
+
+
+def build_user_prompt_step03_summary_cn(summary: str) -> str:
+    """
+    参考 Step03_query_GPT.py：把摘要结构化为中文 JSON（单层 key-value）。
+    summary 需已经过 normalize_abstract。
+    """
+    return _SUMMARY_PREFIX + summary + _SUMMARY_SUFFIX
 
 
 def build_user_prompt_step03_relevance_cn(summary: str, interest_description: str) -> str:
     """
     参考 Step03_query_GPT.py：只判断是否高度相关，输出“是/否”。
+    summary 需已经过 normalize_abstract。
     """
-    s = (summary or "").replace("\n", " ").strip()
     interest = (interest_description or "").strip() or "3D场景表示、理解、智能"
-    return f"""
-你正在筛选论文是否与你的研究方向高度相关。
-
-研究方向：{interest}
-
-请判断以下论文摘要是否与你的研究方向高度相关，仅回复“是”或“否”：
-
-摘要：{s}
-""".strip()
+    return _RELEVANCE_PREFIX + interest + _RELEVANCE_MIDDLE + summary
 
 
 def build_user_prompt_step03_deep_cn(paper_title: str, paper_text: str) -> str:
@@ -101,17 +112,18 @@ def build_user_prompt_step03_deep_cn(paper_title: str, paper_text: str) -> str:
 """.strip()
 
 
-def build_user_prompt_step03_deep_single_q_cn(paper_title: str, paper_text: str, question: str) -> str:
+def build_user_prompt_step03_deep_context_cn(paper_title: str, paper_text: str) -> str:
     """
-    深度解读（单问题版）：
+    深度解读（单问题版）的公共前缀：说明 + 标题 + 正文，同一篇论文的 5 个问题完全相同。
+    作为单独一条 user 消息放在问题之前，服务端的前缀缓存（OpenAI 兼容服务的自动前缀缓存、智谱的上下文缓存）
+    可在后续问题里复用这段 prefill
     - 每次只问 1 个问题，降低一次性多问题输出导致的漏答/错 key 风险
     - 输出纯文本答案；程序侧自行构造键值对
     """
     title = (paper_title or "").strip()
     text = (paper_text or "").strip()
-    q = (question or "").strip()
     return f"""
-你是一个优秀的学术论文解读助手，请通读并分析以下论文的原始内容，并回答“一个”问题。
+你是一个优秀的学术论文解读助手，请通读并分析以下论文的原始内容，之后我会问你“一个”问题。
 
 要求：
 - 请使用简洁、准确、通俗的中文解释，并尽量避免使用公式、符号或缩写。
@@ -123,7 +135,13 @@ def build_user_prompt_step03_deep_single_q_cn(paper_title: str, paper_text: str,
 
 论文内容（部分或全部）如下：
 {text}
+""".strip()
 
+
+def build_user_prompt_step03_deep_question_cn(question: str) -> str:
+    """深度解读（单问题版）中随问题变化的部分，紧跟在 build_user_prompt_step03_deep_context_cn 之后"""
+    q = (question or "").strip()
+    return f"""
 问题：
 {q}
 """.strip()
@@ -150,3 +168,44 @@ def build_user_prompt_step03_deep_fix_cn(required_q_keys: list[str], bad_output_
 待转换内容：
 {bad_output_text}
 """.strip()
+
+
+def build_user_prompt_step03_deep_batch_cn(items: list[tuple[str, str]], required_q_keys: list[str]) -> str:
+    """
+    深度解读（多篇合并版）：一次请求回答 N 篇论文的 5 个问题，摊薄每次请求的网络与预填充开销。
+    JSON 模式只允许输出对象，因此用 {"papers": [...]} 包一层数组；每个元素带 "id"（论文编号，从 1 开始），
+    调用方按 id 而不是数组位置把回答对应回论文，模型漏答或打乱顺序时不会张冠李戴。
+    items: [(标题, 正文), ...]
+    """
+    schema = "{\n      \"id\": 1,\n" + ",\n".join([f'      \"{k}\": \"...\"' for k in required_q_keys]) + "\n    }"
+    blocks = []
+    for i, (paper_title, paper_text) in enumerate(items, 1):
+        title = (paper_title or "").strip()
+        text = (paper_text or "").strip()
+        blocks.append(f"===== 论文 {i} =====\n论文标题：《{title}》\n\n论文内容（部分或全部）如下：\n{text}")
+    papers = "\n\n".join(blocks)
+    n = len(items)
+    return f"""
+你是一个优秀的学术论文解读助手，下面共有 {n} 篇论文，请逐篇通读并分析原始内容，分别回答同样的 5 个问题。
+
+要求：
+- 请使用简洁、准确、通俗的语言解释，并尽量避免使用公式、符号或缩写。
+- 每篇论文只依据它自己的内容回答，不要混用其它论文的信息。
+- 如果文中没有明确说明，请对应字段写 "unknown"，不要编造。
+- 每个回答尽量简短（建议 2-4 句），不要列长清单，不要输出数组/嵌套对象。
+- 输出一个 JSON 对象，只有一个 key "papers"，其值为长度恰好为 {n} 的数组，每篇论文对应一个元素，不要遗漏或重复。
+- 数组每个元素必须有 key "id"，值为该论文的编号（整数，即 "===== 论文 i =====" 中的 i）；
+  除 "id" 外的 key 必须且只能是下面这 5 个问题文本（逐字一致）。
+
+5 个 key（必须逐字一致）：
+{json.dumps(required_q_keys, ensure_ascii=False, indent=2)}
+
+输出格式示例：
+{{
+  "papers": [
+    {schema}
+  ]
+}}
+
+{papers}
+""".strip()
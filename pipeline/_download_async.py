@@ -0,0 +1,171 @@
+"""
+arXiv PDF 异步下载：单线程事件循环 + 共享的 httpx.AsyncClient 连接池，
+大量下载请求不再各占一个线程
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+from pathlib import Path
+from typing import AsyncIterator, List, Optional, Set, Tuple
+
+import httpx
+
+from _parse_common import (
+    HEADERS,
+    commit_part,
+    download_headers,
+    drop_part,
+    head_matches_local,
+    local_pdf_state,
+    ok_marker,
+    part_write_mode,
+    pdf_urls,
+    validated_pdf,
+)
+
+# HTTP/2 需要可选依赖 h2（pip install h2 / httpx[http2]）；没有时退回 HTTP/1.1 连接池
+try:
+    import h2  # noqa: F401
+
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# 空闲 keep-alive 连接保留时长（秒）
+KEEPALIVE_EXPIRY = 60.0
+
+
+def _retry_delay(attempt: int, sleep_base: float, err: Exception | None) -> float:
+    """
+    指数退避 + 随机抖动，避免所有在途下载在同一时刻一起重试；
+    429/503 带 Retry-After（秒数）时以它为准
+    """
+    if isinstance(err, httpx.HTTPStatusError):
+        ra = err.response.headers.get("Retry-After", "")
+        if ra.isdigit():
+            return float(ra)
+    return sleep_base * (2 ** (attempt - 1)) + random.uniform(0, 1)
+
+
+async def fetch_pdf(
+    client: httpx.AsyncClient,
+    paper_id: str,
+    pdf_dir: Path,
+    max_retries: int = 3,
+    sleep_base: float = 1.0,
+) -> Path:
+    """
+    _parse_common.download_arxiv_pdf 的协程版，URL 顺序、ETag/HEAD 复验、.part 续传、
+    PDF 魔数校验与 .ok 标记都走 _parse_common 的同一组函数；
+    区别只在重试：同步版由 requests session 重试，这里按轮次退避后把两个 url 再试一遍
+    """
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    pid = (paper_id or "").strip()
+    if not pid:
+        raise ValueError("paper_id is empty")
+
+    out_path = pdf_dir / f"{pid}.pdf"
+    part_path = out_path.with_name(out_path.name + ".part")
+    have_local, etag = local_pdf_state(out_path)
+
+    last_err: Exception | None = None
+
+    for attempt in range(1, max_retries + 1):
+        for url in pdf_urls(pid):
+            try:
+                if have_local and not etag:
+                    h = await client.head(url, timeout=30)
+                    if head_matches_local(out_path, h.status_code, h.headers.get("Content-Length")):
+                        return out_path
+
+                async with client.stream("GET", url, headers=download_headers(part_path, etag)) as r:
+                    if r.status_code == 304 and have_local:
+                        ok_marker(out_path).touch()
+                        return out_path
+                    if r.status_code == 416:
+                        # 续传位置不被接受：丢掉 .part，下一个 url 从头下载
+                        drop_part(part_path)
+                    r.raise_for_status()
+                    new_etag = r.headers.get("ETag", "")
+
+                    ctype = (r.headers.get("Content-Type") or "").lower()
+                    if "text/html" in ctype:
+                        sample = b""
+                        async for chunk in r.aiter_bytes(256):
+                            sample = chunk
+                            break
+                        raise RuntimeError(f"Got HTML instead of PDF from {url}: {sample[:120]!r}")
+
+                    # 206 才是续传；服务端忽略 Range（或 If-Range 不匹配）回 200 时从头写
+                    with part_path.open(part_write_mode(part_path, r.status_code, new_etag)) as f:
+                        async for chunk in r.aiter_bytes(1024 * 1024):
+                            f.write(chunk)
+
+                return commit_part(part_path, out_path, url, new_etag)
+
+            except Exception as e:
+                last_err = e
+                continue
+
+        if attempt < max_retries:
+            await asyncio.sleep(_retry_delay(attempt, sleep_base, last_err))
+
+    raise RuntimeError(f"Failed to download valid PDF for {pid} after retries: {last_err}")
+
+
+async def download_all(
+    paper_ids: List[str],
+    pdf_dir: Path,
+    concurrency: int = 8,
+    timeout: int = 600,
+    sleep_s: float = 0.0,
+    present: Optional[Set[str]] = None,
+    marked: Optional[Set[str]] = None,
+    revalidate: bool = False,
+) -> AsyncIterator[Tuple[str, bool, str]]:
+    """
+    并发下载缺失的 PDF，按完成顺序逐个产出 (pid, ok, err)
+    Semaphore 限制同时在途的下载数；连接池大小与之一致，连接在论文之间复用（装了 h2 时走 HTTP/2 多路复用）
+    present: 调用方已扫描到的 pdf_dir 中 pid 集合；给出时用它判断是否已下载，不再逐篇 stat
+    marked: 同上，已有 .pdf.ok 标记的 pid 集合；已有但未标记的文件与同步版一样先校验文件头，坏文件重新下载
+    revalidate: 已有的真 PDF 也交给 fetch_pdf，用 ETag / HEAD 向服务端复验，未变则不传正文
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+    # arXiv 没有按批返回 PDF 的接口，只能摊薄每篇的连接开销：空闲连接保留得比默认的 5 秒久，
+    # 下载间隔 sleep_s 或重试退避期间连接不会被回收，后续论文继续复用同一条 TCP/TLS 会话
+    limits = httpx.Limits(
+        max_connections=max(1, concurrency),
+        max_keepalive_connections=max(1, concurrency),
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+    # HTTP/2 下同一主机的并发请求复用一条 TCP/TLS 连接，各自为一个 stream；重复的 UA 等请求头经 HPACK 压缩
+    async with httpx.AsyncClient(
+        http2=_HTTP2,
+        headers=HEADERS,
+        limits=limits,
+        timeout=httpx.Timeout(timeout),
+        follow_redirects=True,
+    ) as client:
+
+        async def bounded(pid: str) -> Tuple[str, bool, str]:
+            try:
+                pdf_path = pdf_dir / f"{pid}.pdf"
+                have = (pid in present) if present is not None else pdf_path.exists()
+                is_marked = (pid in marked) if marked is not None else None
+                if not revalidate and have and validated_pdf(pdf_path, is_marked):
+                    return pid, True, ""
+                async with sem:
+                    await fetch_pdf(client, pid, pdf_dir)
+                    # 每次下载后间隔一下，避免对 arXiv 请求过快
+                    if sleep_s > 0:
+                        await asyncio.sleep(sleep_s)
+                return pid, True, ""
+            except Exception as e:
+                return pid, False, str(e)
+
+        tasks = [asyncio.create_task(bounded(pid)) for pid in paper_ids]
+        for t in asyncio.as_completed(tasks):
+            yield await t
@@ -0,0 +1,44 @@
+"""
+analyze_01_base / analyze_03_deep 共用的 JSON 文本扫描：从 LLM 输出里取出第一个完整的 {...}
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Optional
+
+# 扫描 JSON 对象时只关心这几个字符，其余文本由正则引擎直接跳过
+_JSON_TOKEN_RE = re.compile(r'[{}"\\]')
+
+
+def first_json_object(text: str) -> Optional[str]:
+    """
+    从文本中取出第一个括号配平的 {...}：
+    - 从左到右记录 {} 深度，字符串字面量里的括号和转义不计
+    - 深度回到 0 立即返回，不扫描后面的内容；找不到返回 None
+    """
+    start = text.find("{")
+    if start < 0:
+        return None
+    depth = 0
+    in_str = False
+    skip_at = -1
+    for m in _JSON_TOKEN_RE.finditer(text, start):
+        i = m.start()
+        if i == skip_at:
+            continue
+        c = m.group()
+        if c == "\\":
+            if in_str:
+                skip_at = i + 1
+        elif c == '"':
+            in_str = not in_str
+        elif in_str:
+            continue
+        elif c == "{":
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return text[start : i + 1]
+    return None
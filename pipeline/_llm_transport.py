@@ -0,0 +1,124 @@
+"""
+LLM 调用的限速 + 重试外壳：包住 LLMClient，对外仍是 chat_text / chat_text_async，
+analyze_* 里的调用处不用改，只需在拿到 llm 后包一层 LLMTransport(llm, rpm=...)
+- 限速：按 rpm 均匀放行请求，多个线程 / 协程共享同一个节拍，替代每次请求后固定 sleep
+- 重试：429 / 5xx / 连接错误 / 超时按指数退避 + 随机抖动重试，遵守 Retry-After；其它错误直接抛出
+"""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import requests
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# 单次退避的上限（秒）
+MAX_BACKOFF = 30.0
+
+
+class RateLimiter:
+    """每分钟最多 rpm 个请求，按 60/rpm 秒的间隔逐个放行；rpm<=0 表示不限速。线程与协程均可使用"""
+
+    def __init__(self, rpm: float = 0):
+        self.interval = 60.0 / rpm if rpm and rpm > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+
+    def _reserve(self) -> float:
+        """预约下一个放行时刻，返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            t = max(now, self._next)
+            self._next = t + self.interval
+            return t - now
+
+    def acquire(self) -> None:
+        if self.interval:
+            delay = self._reserve()
+            if delay > 0:
+                time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        if self.interval:
+            delay = self._reserve()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+
+def _response_of(err: BaseException) -> Any:
+    """LLMClient 会把 HTTPError 重新包装一次（附上响应正文），响应对象可能在 __cause__ 上"""
+    e: Optional[BaseException] = err
+    while e is not None:
+        resp = getattr(e, "response", None)
+        if resp is not None:
+            return resp
+        e = e.__cause__
+    return None
+
+
+def _is_retryable(err: BaseException) -> bool:
+    if isinstance(err, (requests.ConnectionError, requests.Timeout, httpx.TransportError, TimeoutError)):
+        return True
+    resp = _response_of(err)
+    return resp is not None and getattr(resp, "status_code", None) in RETRY_STATUS
+
+
+def _retry_delay(attempt: int, backoff: float, err: BaseException) -> float:
+    """指数退避 + 随机抖动，避免并发请求在同一时刻一起重试；429/503 带 Retry-After（秒数）时以它为准"""
+    resp = _response_of(err)
+    if resp is not None:
+        ra = (resp.headers.get("Retry-After") or "").strip()
+        if ra.isdigit():
+            return float(ra)
+    return min(MAX_BACKOFF, backoff * (2 ** (attempt - 1))) + random.uniform(0, 1)
+
+
+class LLMTransport:
+    """
+    llm: LLMClient（或任何提供 chat_text / chat_text_async 的对象）
+    rpm: 每分钟请求上限，0 表示不限速
+    max_retries: 可重试错误的最多重试次数（不含首次请求）
+    其余属性（cfg、_model_name、aclose 等）原样转给被包装的 llm
+    """
+
+    def __init__(self, llm: Any, rpm: float = 0, max_retries: int = 4, backoff: float = 1.0):
+        # LLMClient 的会话层会对 POST 的 502/503/504 再重试：与这里的重试叠加（一次 503 风暴最多 5×4 次请求），
+        # 且那些请求绕过限速器。换成不在会话层重试 POST 的副本，所有重试都在这一层、都计入 rpm
+        strip = getattr(llm, "without_post_retries", None)
+        self._llm = strip() if callable(strip) else llm
+        self.limiter = RateLimiter(rpm)
+        self.max_retries = max(0, max_retries)
+        self.backoff = backoff
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._llm, name)
+
+    def chat_text(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                return self._llm.chat_text(messages, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not _is_retryable(e):
+                    raise
+                time.sleep(_retry_delay(attempt, self.backoff, e))
+
+    async def chat_text_async(self, messages: List[Dict[str, str]], **kwargs) -> str:
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async()
+            try:
+                return await self._llm.chat_text_async(messages, **kwargs)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not _is_retryable(e):
+                    raise
+                await asyncio.sleep(_retry_delay(attempt, self.backoff, e))
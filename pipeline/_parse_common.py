@@ -0,0 +1,441 @@
+"""
+analyze_02_parse / analyze_02_parse_pro 共用的部分：master 表读写、PDF 校验与下载、批量 OCR 落盘。
+两个入口只保留各自的调度方式（异步下载 + OCR 线程池 / 下载线程 + 有界队列），其余逻辑只在这里维护一份
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+MASTER_FIELDS = [
+    "paperID",
+    "sources",
+    "createDate",
+    "base_analysis",
+    "relevance",
+    "download",
+    "deep_analysis",
+    "publish",
+    # 如果你想记录失败原因，可以把下面这列打开，并同时在写入处赋值
+    # "download_error",
+]
+
+# UA 尽量像浏览器一点（很多站对奇怪 UA 更敏感）
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (X11; Linux aarch64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+    )
+}
+
+
+# -----------------------------
+# master 表
+# -----------------------------
+def read_master_rows(master_csv: Path) -> List[dict]:
+    if not master_csv.exists():
+        return []
+    # C 解析器一次读完整表；全部按字符串读、空单元格保持 ""，结果与 csv.DictReader 一致
+    try:
+        df = pd.read_csv(master_csv, dtype=str, keep_default_na=False, encoding="utf-8")
+    except pd.errors.EmptyDataError:
+        return []
+    return df.to_dict("records")
+
+
+def write_master_rows(master_csv: Path, rows: List[dict]) -> None:
+    master_csv.parent.mkdir(parents=True, exist_ok=True)
+    # 先写临时文件再 os.replace：中途被杀也不会留下写了一半的 master
+    tmp = master_csv.with_suffix(master_csv.suffix + ".tmp")
+    df = pd.DataFrame.from_records(rows, columns=MASTER_FIELDS).fillna("")
+    df.to_csv(tmp, index=False, encoding="utf-8", lineterminator="\r\n")
+    os.replace(tmp, master_csv)
+
+
+def is_true(v: str) -> bool:
+    return (v or "").strip().lower() == "true"
+
+
+def scan_stems(d: Path, suffix: str) -> Set[str]:
+    """一次 os.scandir 列出目录下某后缀文件的 stem，替代逐篇 Path.exists()"""
+    try:
+        with os.scandir(d) as it:
+            return {e.name[: -len(suffix)] for e in it if e.name.endswith(suffix) and e.is_file()}
+    except FileNotFoundError:
+        return set()
+
+
+def select_todo(
+    rows: Iterable[dict], pdf_present: Set[str], parse_present: Set[str], revalidate: bool = False
+) -> List[str]:
+    """
+    只处理：relevance=True 且「尚未同时具备 pdf + parse 结果」的论文
+    revalidate=True 时已完成的也选上，交给下载器向服务端复验本地 PDF 是否仍是最新版本
+    """
+    todo: List[str] = []
+    for r in rows:
+        pid = (r.get("paperID") or "").strip()
+        if not pid:
+            continue
+        if not is_true(r.get("relevance", "")):
+            continue
+        if not revalidate and pid in pdf_present and pid in parse_present:
+            continue
+        todo.append(pid)
+    return todo
+
+
+# -----------------------------
+# PDF 文件
+# -----------------------------
+# 只为读 5 字节文件头而打开时不更新 atime（非 Linux 上没有该标志）
+_O_RDONLY_NOATIME = os.O_RDONLY | getattr(os, "O_NOATIME", 0)
+
+
+def looks_like_pdf(path: Path) -> bool:
+    """
+    快速判定文件是否真 PDF（防止保存了 HTML reCAPTCHA 页面）
+    直接 os.open + os.read，不构造 Python 文件对象
+    """
+    try:
+        fd = os.open(path, _O_RDONLY_NOATIME)
+    except PermissionError:
+        # O_NOATIME 要求调用者是文件属主；不是时退回普通只读
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return False
+    except OSError:
+        return False
+    try:
+        return os.read(fd, 5) == b"%PDF-"
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def read_head(path: Path, n: int = 256) -> bytes:
+    """只读开头一小段用于报错，失败页可能是很大的 HTML，不整文件读进内存"""
+    try:
+        with path.open("rb") as f:
+            return f.read(n)
+    except OSError:
+        return b""
+
+
+def drop_cache(path: Path) -> None:
+    """
+    OCR 完成后 PDF 不会再被本流程读取：提示内核丢掉它占用的 page cache，
+    避免成批的大 PDF 把更有用的页面（如模型权重、parse 结果）挤出内存。非 Linux 上直接跳过
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def pdf_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def parse_is_current(parse_path: Path, pdf_hash: str) -> bool:
+    """
+    parse json 已存在且其中记录的 _pdf_sha256 与当前 PDF 一致 -> 不必重跑 OCR；
+    PDF 被重新下载成了另一个版本时哈希不同，需要重新解析。
+    加哈希之前生成的 parse json 没有该字段，视为一致，避免对存量数据整体重跑 OCR
+    """
+    if not parse_path.exists():
+        return False
+    try:
+        stored = orjson.loads(parse_path.read_bytes()).get("_pdf_sha256")
+    except (OSError, orjson.JSONDecodeError, AttributeError):
+        return False
+    return stored is None or stored == pdf_hash
+
+
+def ok_marker(path: Path) -> Path:
+    """校验通过后留下的旁路标记 {pid}.pdf.ok"""
+    return path.with_name(path.name + ".ok")
+
+
+def validated_pdf(path: Path, marked: Optional[bool] = None) -> bool:
+    """
+    有 .ok 标记即视为已校验过的真 PDF，不再读文件头；
+    否则读文件头校验，通过后补上标记，下次运行只需一次 stat（或直接查 scandir 集合）
+    marked: 扫描目录时已知的标记存在性；为 None 时才 stat
+    """
+    marker = ok_marker(path)
+    if marked is None:
+        marked = marker.exists()
+    if marked:
+        return True
+    if not looks_like_pdf(path):
+        return False
+    marker.touch()
+    return True
+
+
+# -----------------------------
+# Process-wide requests session
+# -----------------------------
+_SESSION: Optional[requests.Session] = None
+_SESSION_LOCK = threading.Lock()
+
+
+def init_session(pool_size: int = 32, max_retries: int = 3, backoff: float = 1.0) -> requests.Session:
+    """
+    全进程共用一个 Session（Session.get 线程安全）：连接池大小与下载线程数一致，
+    各线程共享到 arxiv 的 keep-alive 连接，不再每个线程各自握手 TCP/TLS。
+    429/5xx 与连接错误交给 urllib3 按指数退避 + 随机抖动重试，并遵守 Retry-After
+    """
+    global _SESSION
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff,
+        backoff_jitter=1.0,
+        status_forcelist=(429, 500, 502, 503, 504),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    s = requests.Session()
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    _SESSION = s
+    return s
+
+
+def get_session() -> requests.Session:
+    """调用方可先按并发数 init_session；未初始化时按默认参数懒建"""
+    if _SESSION is None:
+        with _SESSION_LOCK:
+            if _SESSION is None:
+                init_session()
+    return _SESSION
+
+
+def etag_path(path: Path) -> Path:
+    """上次成功下载时服务端返回的 ETag，存为 {pid}.pdf.etag"""
+    return path.with_name(path.name + ".etag")
+
+
+def pdf_urls(pid: str) -> List[str]:
+    # 更稳的顺序：export -> arxiv（优先 export.arxiv.org，降低触发 reCAPTCHA 概率）
+    return [
+        f"https://export.arxiv.org/pdf/{pid}.pdf",
+        f"https://arxiv.org/pdf/{pid}.pdf",
+    ]
+
+
+def local_pdf_state(out_path: Path) -> Tuple[bool, str]:
+    """
+    本地已有真 PDF -> (True, 上次保存的 ETag 或 "")；
+    旧文件不是真 PDF 时连同 .ok / .etag 一起删掉，返回 (False, "")
+    """
+    etag_file = etag_path(out_path)
+    if out_path.exists():
+        if looks_like_pdf(out_path):
+            etag = etag_file.read_text(encoding="utf-8").strip() if etag_file.exists() else ""
+            return True, etag
+        out_path.unlink(missing_ok=True)
+        ok_marker(out_path).unlink(missing_ok=True)
+        etag_file.unlink(missing_ok=True)
+    return False, ""
+
+
+def head_matches_local(out_path: Path, status_code: int, content_length: Optional[str]) -> bool:
+    """本地真 PDF 没有 ETag 时用 HEAD 比对 Content-Length；一致则补上 .ok 标记，跳过整段正文传输"""
+    if status_code == 200 and content_length == str(out_path.stat().st_size):
+        ok_marker(out_path).touch()
+        return True
+    return False
+
+
+def download_headers(part_path: Path, etag: str) -> Dict[str, str]:
+    """
+    GET 请求头：有 ETag 时条件 GET（304 直接复用本地文件）；
+    上次中断留下的 .part 用 Range 续传，并带上开始下载时记下的 ETag 作 If-Range：
+    服务端文件已换成新版本时回 200 整个新文件，不会把新版本的尾部接到旧版本的前半截上。
+    .part 没有可用的 ETag 时无法确认是同一版本，直接丢掉从头下载
+    """
+    req_headers = dict(HEADERS)
+    if etag:
+        req_headers["If-None-Match"] = etag
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    if offset:
+        part_tag = etag_path(part_path)
+        validator = part_tag.read_text(encoding="utf-8").strip() if part_tag.exists() else ""
+        if validator:
+            req_headers["Range"] = f"bytes={offset}-"
+            req_headers["If-Range"] = validator
+        else:
+            drop_part(part_path)
+    return req_headers
+
+
+def drop_part(part_path: Path) -> None:
+    """删掉 .part 及其 ETag"""
+    part_path.unlink(missing_ok=True)
+    etag_path(part_path).unlink(missing_ok=True)
+
+
+def part_write_mode(part_path: Path, status_code: int, new_etag: str) -> str:
+    """
+    206 才是 If-Range 校验通过的续传，追加写；200（包括带 Range 的请求被服务端整体重发）从头写，
+    并记下这次响应的强 ETag，供下次续传时作 If-Range（弱 ETag 不能用于 If-Range，不记）
+    """
+    if status_code == 206:
+        return "ab"
+    part_tag = etag_path(part_path)
+    if new_etag and not new_etag.startswith("W/"):
+        part_tag.write_text(new_etag, encoding="utf-8")
+    else:
+        part_tag.unlink(missing_ok=True)
+    return "wb"
+
+
+def commit_part(part_path: Path, out_path: Path, url: str, new_etag: str) -> Path:
+    """
+    写完的 .part 必须验证 PDF 魔数（可能是 HTML / challenge 页面被保存了），
+    校验通过才换成正式文件（进程中途被杀也不会留下半截的 {pid}.pdf），并留下 .ok 标记与 ETag
+    """
+    if not looks_like_pdf(part_path):
+        head = read_head(part_path)
+        drop_part(part_path)
+        raise RuntimeError(
+            f"Downloaded file is not a real PDF (%PDF- missing). url={url} head={head[:120]!r}"
+        )
+    os.replace(part_path, out_path)
+    etag_path(part_path).unlink(missing_ok=True)
+    ok_marker(out_path).touch()
+    if new_etag:
+        etag_path(out_path).write_text(new_etag, encoding="utf-8")
+    return out_path
+
+
+def download_arxiv_pdf(
+    paper_id: str,
+    pdf_dir: Path,
+    timeout: int = 120,
+) -> Path:
+    """
+    下载 arXiv PDF 到本地，并做真实性校验（_download_async.fetch_pdf 是它的协程版，共用下面这些步骤）：
+    - 优先用 export.arxiv.org，降低触发 reCAPTCHA 概率
+    - 本地已有真 PDF 时（--revalidate 才会对已有文件调用）：有 ETag 就条件 GET（304 直接复用），
+      没有就 HEAD 比对 Content-Length；服务端版本变了则重新下载，ocr_pdfs 按哈希发现后重跑 OCR
+    - 先写 {pid}.pdf.part，检查文件头必须为 %PDF- 后再 os.replace 成正式文件；残留的 .part 用 Range + If-Range 续传
+    - 若检测到 HTML/非 PDF：删除文件并换下一个 url
+    - 429/5xx/连接错误由 session 指数退避重试，并遵守 Retry-After
+    """
+    pdf_dir.mkdir(parents=True, exist_ok=True)
+    pid = (paper_id or "").strip()
+    if not pid:
+        raise ValueError("paper_id is empty")
+
+    out_path = pdf_dir / f"{pid}.pdf"
+    part_path = out_path.with_name(out_path.name + ".part")
+    have_local, etag = local_pdf_state(out_path)
+
+    last_err: Exception | None = None
+    session = get_session()
+
+    # 状态码/连接层面的重试由 session 完成；这里只在某个 url 彻底失败（或返回的不是 PDF）时换下一个
+    for url in pdf_urls(pid):
+        try:
+            if have_local and not etag:
+                h = session.head(url, headers=HEADERS, timeout=30, allow_redirects=True)
+                if head_matches_local(out_path, h.status_code, h.headers.get("Content-Length")):
+                    return out_path
+
+            with session.get(url, headers=download_headers(part_path, etag), stream=True, timeout=timeout) as r:
+                if r.status_code == 304 and have_local:
+                    ok_marker(out_path).touch()
+                    return out_path
+                if r.status_code == 416:
+                    # 续传位置不被接受：丢掉 .part，下一个 url 从头下载
+                    drop_part(part_path)
+                r.raise_for_status()
+                new_etag = r.headers.get("ETag", "")
+
+                # content-type 不是强保证，但可提前预警；有些情况下会返回 text/html（reCAPTCHA）
+                ctype = (r.headers.get("Content-Type") or "").lower()
+                if "text/html" in ctype:
+                    sample = r.raw.read(256, decode_content=True)
+                    raise RuntimeError(f"Got HTML instead of PDF from {url}: {sample[:120]!r}")
+
+                # 流式写入 .part：copyfileobj 在 C 循环里按 1 MiB 块拷贝；206 才是续传，200 则从头写
+                with part_path.open(part_write_mode(part_path, r.status_code, new_etag)) as f:
+                    r.raw.decode_content = True
+                    shutil.copyfileobj(r.raw, f, length=1024 * 1024)
+
+            return commit_part(part_path, out_path, url, new_etag)
+
+        except Exception as e:
+            last_err = e
+            continue
+
+    raise RuntimeError(f"Failed to download valid PDF for {pid}: {last_err}")
+
+
+# -----------------------------
+# OCR
+# -----------------------------
+def ocr_pdfs(pids: List[str], pdf_dir: Path, parse_dir: Path, ocr) -> List[Tuple[str, bool, str]]:
+    """
+    parse 缺失（或与当前 PDF 哈希不符）的合成一次 ocr_pdf_batch 调用，逐篇写 json 并记录 _pdf_sha256。
+    返回与 pids 一一对应的 (pid, ok, err)
+    """
+    out = [(pid, True, "") for pid in pids]
+    todo: List[int] = []
+    hashes: Dict[int, str] = {}
+    for i, pid in enumerate(pids):
+        try:
+            hashes[i] = pdf_sha256(pdf_dir / f"{pid}.pdf")
+        except OSError as e:
+            out[i] = (pid, False, str(e))
+            continue
+        if not parse_is_current(parse_dir / f"{pid}.json", hashes[i]):
+            todo.append(i)
+    if not todo:
+        return out
+    try:
+        parsed_list = ocr.ocr_pdf_batch([str(pdf_dir / f"{pids[i]}.pdf") for i in todo])
+    except Exception as e:
+        for i in todo:
+            out[i] = (pids[i], False, str(e))
+        return out
+
+    for i, parsed in zip(todo, parsed_list):
+        try:
+            if isinstance(parsed, dict):
+                parsed["_pdf_sha256"] = hashes[i]
+            # OCR 结果动辄数 MB：orjson 直接编码成 UTF-8，不缩进，体积和耗时都小得多
+            (parse_dir / f"{pids[i]}.json").write_bytes(orjson.dumps(parsed))
+            drop_cache(pdf_dir / f"{pids[i]}.pdf")
+        except Exception as e:
+            out[i] = (pids[i], False, str(e))
+    return out
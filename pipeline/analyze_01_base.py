@@ -6,16 +6,17 @@ from __future__ import annotations
 
 import sys
 import argparse
-import csv
-import json
+import asyncio
 import os
 import re
 import time
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 
 import arxiv
+import orjson
+import pandas as pd
 
 from tqdm import tqdm
 
@@ -30,16 +31,19 @@ from config.prompt import (
     SYSTEM_CN_RELEVANCE,
     build_user_prompt_step03_relevance_cn,
     build_user_prompt_step03_summary_cn,
+    normalize_abstract,
 )
+from _json_scan import first_json_object
+
 
 def _parse_json_obj(text: str) -> Dict[str, Any]:
     """
     解析 LLM 输出为 JSON 对象：
-    - 先直接 json.loads
-    - 失败则从文本中提取第一个 {...} 再 json.loads
+    - 先直接 orjson.loads
+    - 失败则从文本中提取第一个 {...} 再 orjson.loads
     """
     t = (text or "").strip()
-    obj = json.loads(t)
+    obj = orjson.loads(t)
     if isinstance(obj, dict):
         return obj
 
@@ -51,31 +55,20 @@ def _parse_json_obj_relaxed(text: str) -> Dict[str, Any]:
     try:
         return _parse_json_obj(text)
     except Exception:
-        t = (text or "").strip()
-        m = re.search(r"\{[\s\S]*\}", t)
-        if not m:
+        obj_text = first_json_object((text or "").strip())
+        if obj_text is None:
             raise
-        return _parse_json_obj(m.group(0))
+        return _parse_json_obj(obj_text)
 
 
-def fetch_arxiv_metadata(paper_id: str) -> Dict[str, Any]:
-    """
-    拉取 arXiv 元数据（title/abstract/authors/url...）。
-    paper_id 允许包含版本号（如 2512.23675v1）。
-    """
-    pid = (paper_id or "").strip()
-    if not pid:
-        raise ValueError("paper_id is empty")
+def _strip_version(paper_id: str) -> str:
+    """2512.23675v1 -> 2512.23675"""
+    return re.sub(r"v\d+$", "", (paper_id or "").strip())
 
-    pid_no_ver = pid.split("v", 1)[0]
-    client = arxiv.Client()
-    search = arxiv.Search(id_list=[pid_no_ver], max_results=1)
-    r = next(iter(client.results(search)), None)
-    if r is None:
-        raise RuntimeError(f"failed to fetch arXiv metadata for {pid}")
 
+def _meta_from_result(paper_id: str, r: arxiv.Result) -> Dict[str, Any]:
     return {
-        "paperID": pid,
+        "paperID": paper_id,
         "title": (r.title or "").replace("\n", " ").strip(),
         "abstract": (r.summary or "").replace("\n", " ").strip(),
         "authors": [a.name for a in (r.authors or [])],
@@ -87,31 +80,69 @@ def fetch_arxiv_metadata(paper_id: str) -> Dict[str, Any]:
     }
 
 
-def analyze_one(paper_id: str, interest_description: str, sleep_s: float = 0.0) -> Dict[str, Any]:
-    cfg, llm, _ocr = get_ai_clients()
+def fetch_arxiv_metadata_batch(
+    paper_ids: List[str],
+    client: Optional[arxiv.Client] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    一次 arXiv API 请求拉取多篇论文的元数据（id_list），按原始 paper_id（含版本号）索引。
+    查不到的 id 不会出现在返回值里。
+    """
+    pids = [p for p in ((x or "").strip() for x in paper_ids) if p]
+    if not pids:
+        return {}
+
+    by_base: Dict[str, List[str]] = {}
+    for pid in pids:
+        by_base.setdefault(_strip_version(pid), []).append(pid)
+
+    client = client or arxiv.Client(page_size=100, delay_seconds=3)
+    search = arxiv.Search(id_list=list(by_base.keys()), max_results=len(by_base))
+
+    out: Dict[str, Dict[str, Any]] = {}
+    for r in client.results(search):
+        for pid in by_base.get(_strip_version(r.get_short_id()), []):
+            out[pid] = _meta_from_result(pid, r)
+    return out
+
+
+def fetch_arxiv_metadata(paper_id: str) -> Dict[str, Any]:
+    """
+    拉取 arXiv 元数据（title/abstract/authors/url...）。
+    paper_id 允许包含版本号（如 2512.23675v1）。
+    """
+    pid = (paper_id or "").strip()
+    if not pid:
+        raise ValueError("paper_id is empty")
+
+    meta = fetch_arxiv_metadata_batch([pid]).get(pid)
+    if meta is None:
+        raise RuntimeError(f"failed to fetch arXiv metadata for {pid}")
+    return meta
 
-    meta = fetch_arxiv_metadata(paper_id)
-    abstract = meta.get("abstract", "")
 
+def _summary_messages(abstract: str) -> List[Dict[str, str]]:
     # Step 1: 结构化摘要（JSON）
-    messages_summary = [
+    return [
         {"role": "system", "content": SYSTEM_CN_JSON},
         {"role": "user", "content": build_user_prompt_step03_summary_cn(abstract)},
     ]
-    summary_text = llm.chat_text(messages_summary, response_json=True)
-    summary_obj = _parse_json_obj_relaxed(summary_text)
 
+
+def _relevance_messages(abstract: str, interest_description: str) -> List[Dict[str, str]]:
     # Step 2: 相关性判断（是/否）
-    messages_rel = [
+    return [
         {"role": "system", "content": SYSTEM_CN_RELEVANCE},
         {"role": "user", "content": build_user_prompt_step03_relevance_cn(abstract, interest_description)},
     ]
-    rel_text = (llm.chat_text(messages_rel) or "").strip()
-    is_relevant = rel_text.startswith("是") or rel_text.lower().startswith("yes")
 
-    if sleep_s > 0:
-        time.sleep(sleep_s)
 
+def _is_relevant_answer(rel_text: str) -> bool:
+    t = (rel_text or "").strip()
+    return t.startswith("是") or t.lower().startswith("yes")
+
+
+def _build_result(cfg, paper_id: str, meta: Dict[str, Any], summary_obj: Dict[str, Any], is_relevant: bool) -> Dict[str, Any]:
     return {
         "paperID": paper_id,
         "fetched": meta,
@@ -127,11 +158,79 @@ def analyze_one(paper_id: str, interest_description: str, sleep_s: float = 0.0)
     }
 
 
+def analyze_one(
+    paper_id: str,
+    interest_description: str,
+    sleep_s: float = 0.0,
+    meta: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    meta 可由调用方预先批量拉取（fetch_arxiv_metadata_batch）；为空时单独请求 arXiv。
+    """
+    cfg, llm, _ocr = get_ai_clients()
+
+    if meta is None:
+        meta = fetch_arxiv_metadata(paper_id)
+    abstract = normalize_abstract(meta.get("abstract", ""))
+
+    summary_text = llm.chat_text(_summary_messages(abstract), response_json=True)
+    summary_obj = _parse_json_obj_relaxed(summary_text)
+
+    rel_text = llm.chat_text(_relevance_messages(abstract, interest_description))
+    is_relevant = _is_relevant_answer(rel_text)
+
+    if sleep_s > 0:
+        time.sleep(sleep_s)
+
+    return _build_result(cfg, paper_id, meta, summary_obj, is_relevant)
+
+
+async def analyze_one_async(
+    paper_id: str,
+    interest_description: str,
+    sem: asyncio.Semaphore,
+    sleep_s: float = 0.0,
+    meta: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    analyze_one 的协程版：LLM 请求走 llm.chat_text_async，sem 限制同时在途的论文数。
+    """
+    cfg, llm, _ocr = get_ai_clients()
+
+    async with sem:
+        if meta is None:
+            # arxiv 库是同步的：放到线程里，不阻塞事件循环
+            meta = await asyncio.to_thread(fetch_arxiv_metadata, paper_id)
+        abstract = normalize_abstract(meta.get("abstract", ""))
+
+        # 摘要与相关性两个请求互不依赖：同时发出，LLM 服务端（vLLM 连续批处理）可合并到同一批前向里
+        summary_text, rel_text = await asyncio.gather(
+            llm.chat_text_async(_summary_messages(abstract), response_json=True),
+            llm.chat_text_async(_relevance_messages(abstract, interest_description)),
+        )
+        summary_obj = _parse_json_obj_relaxed(summary_text)
+        is_relevant = _is_relevant_answer(rel_text)
+
+        if sleep_s > 0:
+            await asyncio.sleep(sleep_s)
+
+    return _build_result(cfg, paper_id, meta, summary_obj, is_relevant)
+
+
+def _write_json(path: Path, obj: Dict[str, Any]) -> None:
+    # orjson 直接输出 UTF-8 字节（中文不转义，等价于 ensure_ascii=False）
+    path.write_bytes(orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+
 def _read_master_rows(master_csv: Path) -> list[dict]:
     if not master_csv.exists():
         return []
-    with master_csv.open("r", encoding="utf-8", newline="") as f:
-        return list(csv.DictReader(f))
+    # C 解析器一次读完整表；全部按字符串读、空单元格保持 ""，结果与 csv.DictReader 一致
+    try:
+        df = pd.read_csv(master_csv, dtype=str, keep_default_na=False, encoding="utf-8")
+    except pd.errors.EmptyDataError:
+        return []
+    return df.to_dict("records")
 
 
 def _write_master_rows(master_csv: Path, rows: list[dict]) -> None:
@@ -147,11 +246,61 @@ def _write_master_rows(master_csv: Path, rows: list[dict]) -> None:
         "deep_analysis",
         "publish",
     ]
-    with master_csv.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
-        w.writeheader()
-        for r in rows:
-            w.writerow({k: (r.get(k, "") or "") for k in fieldnames})
+    # 先写临时文件再 os.replace：中途被杀也不会留下写了一半的 master
+    tmp = master_csv.with_suffix(master_csv.suffix + ".tmp")
+    df = pd.DataFrame.from_records(rows, columns=fieldnames).fillna("")
+    df.to_csv(tmp, index=False, encoding="utf-8", lineterminator="\r\n")
+    os.replace(tmp, master_csv)
+
+
+async def _analyze_all(todo: List[Tuple[dict, str]], out_dir: Path, args: argparse.Namespace) -> int:
+    """
+    单线程事件循环驱动所有论文：耗时主要是 arXiv/LLM 的网络往返，
+    并发在途可让 LLM 服务端批处理；结果在循环里逐个落盘并更新 rows，不需要加锁。
+    """
+    _cfg, llm, _ocr = get_ai_clients()
+    sem = asyncio.Semaphore(max(1, args.workers))
+    batch_size = max(1, args.meta_batch)
+    arxiv_client = arxiv.Client(page_size=100, delay_seconds=3)
+    pbar = tqdm(total=len(todo), desc="analyze_01_base", unit="paper")
+    done = 0
+
+    async def run_one(r: dict, pid: str, meta: Optional[Dict[str, Any]]) -> None:
+        nonlocal done
+        try:
+            result = await analyze_one_async(pid, args.interest, sem, sleep_s=args.sleep, meta=meta)
+            out_path = out_dir / f"{pid}.json"
+            _write_json(out_path, result)
+
+            # 更新 master：基础分析完成 + 相关性判断结果
+            r["base_analysis"] = "True"
+            r["relevance"] = "True" if result["analysis"]["is_relevant"] else "False"
+            done += 1
+            print(f"[OK] analyzed: {pid} -> {out_path}")
+        except Exception as e:
+            print(f"[ERR] analyze failed: {pid} ; {e}")
+        finally:
+            pbar.update(1)
+
+    try:
+        # 元数据按批拉取：每批拿到后立刻创建任务，下一批的 arXiv 请求与已在途的 LLM 调用重叠
+        tasks = []
+        for i in range(0, len(todo), batch_size):
+            batch = todo[i : i + batch_size]
+            pids = [pid for _r, pid in batch]
+            try:
+                metas = await asyncio.to_thread(fetch_arxiv_metadata_batch, pids, arxiv_client)
+            except Exception as e:
+                # 整批失败时退回逐篇请求（analyze_one_async 内部会单独拉取）
+                print(f"[WARN] batch metadata fetch failed ({len(pids)} ids): {e}")
+                metas = {}
+            for r, pid in batch:
+                tasks.append(asyncio.create_task(run_one(r, pid, metas.get(pid))))
+        await asyncio.gather(*tasks)
+    finally:
+        pbar.close()
+        await llm.aclose()
+    return done
 
 
 def main():
@@ -159,6 +308,8 @@ def main():
     ap.add_argument("--master_csv", default="storage/papers_master.csv")
     ap.add_argument("--out_dir", default="storage/analysis/base")
     ap.add_argument("--sleep", type=float, default=1.0)
+    ap.add_argument("--workers", type=int, default=int(os.getenv("ANALYZE_WORKERS", "8")), help="同时在途的论文数")
+    ap.add_argument("--meta_batch", type=int, default=25, help="每次 arXiv API 请求批量拉取的论文数")
     ap.add_argument("--interest", default=os.getenv("INTEREST_DESCRIPTION", "3D场景表示、理解、智能"))
     args = ap.parse_args()
 
@@ -171,27 +322,15 @@ def main():
         print(f"[WARN] master csv not found or empty: {master_csv}")
         return
 
-    todo = [r for r in rows if (r.get("base_analysis") or "False").strip().lower() != "true"]
-
-    done = 0
-    for r in tqdm(todo, total=len(todo), desc="analyze_01_base", unit="paper"):
-        pid = (r.get("paperID") or "").strip()
-        if not pid:
-            continue
-        try:
-            result = analyze_one(pid, args.interest, sleep_s=args.sleep)
-            out_path = out_dir / f"{pid}.json"
-            with out_path.open("w", encoding="utf-8") as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+    # 规范化后的 paperID 只算一次，与行一起传下去
+    pids = [(r.get("paperID") or "").strip() for r in rows]
+    todo = [
+        (r, pid)
+        for r, pid in zip(rows, pids)
+        if pid and (r.get("base_analysis") or "False").strip().lower() != "true"
+    ]
 
-            # 更新 master：基础分析完成 + 相关性判断结果
-            r["base_analysis"] = "True"
-            r["relevance"] = "True" if result["analysis"]["is_relevant"] else "False"
-            done += 1
-            print(f"[OK] analyzed: {pid} -> {out_path}")
-        except Exception as e:
-            print(f"[ERR] analyze failed: {pid} ; {e}")
-            continue
+    done = asyncio.run(_analyze_all(todo, out_dir, args))
 
     _write_master_rows(master_csv, rows)
     print(f"[DONE] analyzed={done} ; master_updated={master_csv}")
@@ -1,7 +1,6 @@
 from __future__ import annotations
 import argparse
 import csv
-import json
 import os
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -15,25 +14,24 @@ if str(_ROOT) not in sys.path:
 
 from tqdm import tqdm
 
-from analyze_01_base import analyze_one, _read_master_rows, _write_master_rows
+from analyze_01_base import analyze_one, _read_master_rows, _write_master_rows, _write_json
 
-def process_task(row: dict, interest: str, out_dir: Path, sleep_s: float):
+# 每完成这么多篇就把 master 落盘一次：中途退出最多丢这么多篇的状态
+CHECKPOINT_EVERY = 32
+
+
+def process_task(pid: str, interest: str, out_dir: Path, sleep_s: float):
     """
-    单个任务的工作函数：处理一篇论文并保存结果
+    单个任务的工作函数：处理一篇论文并保存结果（pid 已由 main 规范化）
     """
-    pid = (row.get("paperID") or "").strip()
-    if not pid:
-        return None, False
-
     try:
         # 执行分析
         result = analyze_one(pid, interest, sleep_s=sleep_s)
         
         # 保存 JSON 文件
         out_path = out_dir / f"{pid}.json"
-        with out_path.open("w", encoding="utf-8") as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
-        
+        _write_json(out_path, result)
+
         # 返回结果用于更新 master 列表
         return pid, result["analysis"]["is_relevant"]
     except Exception as e:
@@ -57,43 +55,51 @@ def main():
         print(f"[WARN] master csv not found or empty: {master_csv}")
         return
 
+    # 一次性把要用的列抽成平行数组：之后按下标访问，不再对每行反复 get/strip/lower
+    pids = [(r.get("paperID") or "").strip() for r in rows]
+    base_done = [(r.get("base_analysis") or "False").strip().lower() == "true" for r in rows]
+
     # 筛选待处理任务
-    todo_rows = [r for r in rows if (r.get("base_analysis") or "False").strip().lower() != "true"]
-    if not todo_rows:
+    todo_idxs = [i for i, done in enumerate(base_done) if not done and pids[i]]
+    if not todo_idxs:
         print("[INFO] No pending papers to analyze.")
         return
 
-    print(f"[START] Total todo: {len(todo_rows)} using {args.workers} workers")
+    print(f"[START] Total todo: {len(todo_idxs)} using {args.workers} workers")
 
     # 使用线程池执行
     done_count = 0
-    # 将 rows 转换成 dict 以便根据 paperID 快速定位更新
-    row_map = { (r.get("paperID") or "").strip(): r for r in rows }
+    dirty = 0
 
     with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        # 提交所有任务
-        future_to_pid = {
-            executor.submit(process_task, r, args.interest, out_dir, args.sleep): (r.get("paperID") or "").strip() 
-            for r in todo_rows
+        # 提交所有任务；future 直接映射到行下标，完成时按下标更新对应行
+        future_to_idx = {
+            executor.submit(process_task, pids[i], args.interest, out_dir, args.sleep): i
+            for i in todo_idxs
         }
 
         # 使用 tqdm 监听任务完成情况
-        for future in tqdm(as_completed(future_to_pid), total=len(todo_rows), desc="Parallel Analysis"):
-            pid = future_to_pid[future]
+        for future in tqdm(as_completed(future_to_idx), total=len(todo_idxs), desc="Parallel Analysis"):
+            i = future_to_idx[future]
+            pid = pids[i]
             try:
-                res_pid, status = future.result()
+                _pid, status = future.result()
                 if isinstance(status, Exception):
                     print(f"\n[ERR] {pid} failed: {status}")
                 else:
                     # 更新内存中的 rows 数据
-                    if res_pid in row_map:
-                        row_map[res_pid]["base_analysis"] = "True"
-                        row_map[res_pid]["relevance"] = "True" if status else "False"
-                        done_count += 1
+                    rows[i]["base_analysis"] = "True"
+                    rows[i]["relevance"] = "True" if status else "False"
+                    done_count += 1
             except Exception as e:
                 print(f"\n[CRITICAL] Unexpected error for {pid}: {e}")
 
-    # 任务全部完成后，统一写入 CSV
+            dirty += 1
+            if dirty >= CHECKPOINT_EVERY:
+                _write_master_rows(master_csv, rows)
+                dirty = 0
+
+    # 任务全部完成后，写入剩余的更新
     _write_master_rows(master_csv, rows)
     print(f"\n[DONE] Successfully analyzed: {done_count} papers. Master CSV updated.")
 
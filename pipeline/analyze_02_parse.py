@@ -6,14 +6,15 @@ from __future__ import annotations
 
 import sys
 import argparse
-import csv
-import json
+import asyncio
+import collections
 import os
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import List, Tuple
 
-import requests
+import orjson
 from tqdm import tqdm
 
 # 允许把该文件当脚本运行：确保项目根目录在 sys.path 中
@@ -22,136 +23,90 @@ if str(_ROOT) not in sys.path:
     sys.path.insert(0, str(_ROOT))
 
 from config.ai import get_ai_clients
-
-
-MASTER_FIELDS = [
-    "paperID",
-    "sources",
-    "createDate",
-    "base_analysis",
-    "relevance",
-    "download",
-    "deep_analysis",
-    "publish",
-]
-
-
-def _read_master_rows(master_csv: Path) -> List[dict]:
-    if not master_csv.exists():
-        return []
-    with master_csv.open("r", encoding="utf-8", newline="") as f:
-        return list(csv.DictReader(f))
-
-
-def _write_master_rows(master_csv: Path, rows: List[dict]) -> None:
-    master_csv.parent.mkdir(parents=True, exist_ok=True)
-    with master_csv.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=MASTER_FIELDS)
-        w.writeheader()
-        for r in rows:
-            w.writerow({k: (r.get(k, "") or "") for k in MASTER_FIELDS})
-
-
-def _is_true(v: str) -> bool:
-    return (v or "").strip().lower() == "true"
-
-
-def _looks_like_pdf(path: Path) -> bool:
-    """快速判定文件是否真 PDF（防止保存了 HTML reCAPTCHA 页面）"""
-    try:
-        with path.open("rb") as f:
-            head = f.read(5)
-        return head == b"%PDF-"
-    except Exception:
-        return False
-
-
-def download_arxiv_pdf(
-    paper_id: str,
-    pdf_dir: Path,
-    timeout: int = 600,
-    max_retries: int = 3,
-    sleep_base: float = 1.0,
-) -> Path:
-    """
-    下载 arXiv PDF 到本地，并做真实性校验：
-    - 优先用 export.arxiv.org，降低触发 reCAPTCHA 概率
-    - 下载完成后检查文件头必须为 %PDF-
-    - 若检测到 HTML/非 PDF：删除文件并重试
-    """
-    pdf_dir.mkdir(parents=True, exist_ok=True)
-    pid = (paper_id or "").strip()
-    if not pid:
-        raise ValueError("paper_id is empty")
-
-    out_path = pdf_dir / f"{pid}.pdf"
-
-    # 更稳的顺序：export -> arxiv
-    urls = [
-        f"https://export.arxiv.org/pdf/{pid}.pdf",
-        f"https://arxiv.org/pdf/{pid}.pdf",
-    ]
-
-    # UA 尽量像浏览器一点（很多站对奇怪 UA 更敏感）
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (X11; Linux aarch64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
-        )
-    }
-
-    last_err: Exception | None = None
-
-    for attempt in range(1, max_retries + 1):
-        for url in urls:
+from _download_async import download_all
+from _parse_common import (
+    MASTER_FIELDS,
+    ocr_pdfs,
+    read_master_rows,
+    scan_stems,
+    select_todo,
+    write_master_rows,
+)
+
+
+# -----------------------------
+# 进度日志：每篇完成即追加一行 JSON，master 只在结束时整表重写；
+# 中途被杀时，下次启动先回放日志再筛 todo，已完成的不会白做
+# -----------------------------
+def _progress_path(master_csv: Path) -> Path:
+    return master_csv.with_suffix(".progress.jsonl")
+
+
+def _replay_progress(progress_path: Path, rows: List[dict]) -> int:
+    """把上次未落到 master 的进度应用到 rows；返回应用的条数（末尾写了一半的行忽略）"""
+    if not progress_path.exists():
+        return 0
+    by_pid = {(r.get("paperID") or "").strip(): r for r in rows}
+    n = 0
+    with progress_path.open("rb") as f:
+        for line in f:
             try:
-                # 若存在旧文件但不是真 PDF，先删掉
-                if out_path.exists() and not _looks_like_pdf(out_path):
-                    out_path.unlink(missing_ok=True)
-
-                with requests.get(url, headers=headers, stream=True, timeout=timeout) as r:
-                    r.raise_for_status()
-
-                    # content-type 不是强保证，但可提前预警
-                    ctype = (r.headers.get("Content-Type") or "").lower()
-                    # 有些情况下会返回 text/html（reCAPTCHA）
-                    if "text/html" in ctype:
-                        # 读一点点内容，帮助报错定位（不落盘）
-                        sample = r.raw.read(256, decode_content=True)
-                        raise RuntimeError(f"Got HTML instead of PDF from {url}: {sample[:120]!r}")
-
-                    # 流式写入
-                    with out_path.open("wb") as f:
-                        for chunk in r.iter_content(chunk_size=1024 * 256):
-                            if chunk:
-                                f.write(chunk)
-
-                # 关键：写完必须验证 PDF 魔数
-                if not _looks_like_pdf(out_path):
-                    # 可能是 HTML / challenge 页面被保存了
-                    try:
-                        # 额外取一点文本辅助定位（可选）
-                        txt = out_path.read_bytes()[:512]
-                    except Exception:
-                        txt = b""
-                    out_path.unlink(missing_ok=True)
-                    raise RuntimeError(
-                        f"Downloaded file is not a real PDF (%PDF- missing). "
-                        f"url={url} head={txt[:120]!r}"
-                    )
-
-                return out_path
-
-            except Exception as e:
-                last_err = e
-                # 换下一个 url
+                rec = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                continue
+            r = by_pid.get(rec.pop("pid", ""))
+            if r is None:
                 continue
+            r.update({k: v for k, v in rec.items() if k in MASTER_FIELDS})
+            n += 1
+    return n
+
+
+class _ProgressLog:
+    """追加写的进度日志；record 可从多个线程调用"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._f = path.open("ab")
+        # 上次被杀时末尾可能留下半行：先补换行，免得新记录接在它后面一起被丢弃
+        if self._f.tell() > 0:
+            with path.open("rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._f.write(b"\n")
+
+    def record(self, pid: str, **fields: str) -> None:
+        line = orjson.dumps({"pid": pid, **fields}) + b"\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+
+    def close(self, clear: bool = False) -> None:
+        """clear=True：master 已完整写入，日志内容不再需要，直接删掉"""
+        with self._lock:
+            self._f.close()
+            if clear:
+                self.path.unlink(missing_ok=True)
+
+
+def _parse_batch(
+    pending: "collections.deque[str]", batch_size: int, pdf_dir: Path, parse_dir: Path, ocr
+) -> List[Tuple[str, bool, str]]:
+    """
+    OCR 线程：从 pending 一次取走至多 batch_size 篇交给 ocr_pdfs（合并成一次 OCR 调用）。
+    每篇下载完成都会提交一次本函数；线程空出来时把这段时间积压的一并取走，取空则返回 []
+    返回 [(pid, ok, err), ...]
+    """
+    pids: List[str] = []
+    while len(pids) < batch_size:
+        try:
+            pids.append(pending.popleft())
+        except IndexError:
+            break
 
-        # 本轮两个 url 都失败：退避重试
-        if attempt < max_retries:
-            time.sleep(sleep_base * attempt)
+    return ocr_pdfs(pids, pdf_dir, parse_dir, ocr)
 
-    raise RuntimeError(f"Failed to download valid PDF for {pid} after retries: {last_err}")
 
 def main() -> None:
     ap = argparse.ArgumentParser()
@@ -159,6 +114,14 @@ def main() -> None:
     ap.add_argument("--pdf_dir", default="storage/papers/pdfs")
     ap.add_argument("--parse_dir", default="storage/papers/parse")
     ap.add_argument("--sleep", type=float, default=0.1)
+    ap.add_argument("--workers", type=int, default=4, help="同时在途的下载数")
+    ap.add_argument("--ocr_workers", type=int, default=1, help="OCR 并发线程数（OCR 占 GPU，保持较小）")
+    ap.add_argument("--ocr_batch", type=int, default=4, help="单次 OCR 请求最多合并的 PDF 篇数")
+    ap.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="已下载的 PDF 也用 ETag / HEAD 向 arXiv 复验；服务端版本变了则重新下载并重跑 OCR",
+    )
     args = ap.parse_args()
 
     master_csv = Path(args.master_csv)
@@ -166,60 +129,69 @@ def main() -> None:
     parse_dir = Path(args.parse_dir)
     parse_dir.mkdir(parents=True, exist_ok=True)
 
-    rows = _read_master_rows(master_csv)
+    rows = read_master_rows(master_csv)
     if not rows:
         print(f"[WARN] master csv not found or empty: {master_csv}")
         return
 
-    # 只处理：relevance=True 且「尚未同时具备 pdf + parse 结果」的论文
-    todo = []
-    for r in rows:
-        pid = (r.get("paperID") or "").strip()
-        if not pid:
-            continue
-        if not _is_true(r.get("relevance", "")):
-            continue
-        pdf_path = pdf_dir / f"{pid}.pdf"
-        parse_path = parse_dir / f"{pid}.json"
-        if pdf_path.exists() and parse_path.exists():
-            continue
-        todo.append(r)
+    # 上次运行中途退出时留下的进度先回放到 rows
+    progress_path = _progress_path(master_csv)
+    replayed = _replay_progress(progress_path, rows)
+    if replayed:
+        print(f"[INFO] replayed {replayed} updates from {progress_path}")
+
+    # 目录各扫一遍得到已有文件集合，循环内只做集合查询，不再逐篇 stat
+    pdf_present = scan_stems(pdf_dir, ".pdf")
+    ok_present = scan_stems(pdf_dir, ".pdf.ok")
+    parse_present = scan_stems(parse_dir, ".json")
+    todo_pids = select_todo(rows, pdf_present, parse_present, revalidate=args.revalidate)
 
     _cfg, _llm, ocr = get_ai_clients()
 
+    # 下载在单线程事件循环里并发进行（网络延迟为主）；每篇下载完成后立刻交给 OCR 线程池，两阶段重叠执行
+    row_by_pid = {(r.get("paperID") or "").strip(): r for r in rows}
     done = 0
-    for r in tqdm(todo, total=len(todo), desc="analyze_02_parse", unit="paper"):
-        pid = (r.get("paperID") or "").strip()
-        if not pid:
-            continue
+    progress = _ProgressLog(progress_path)
+    with ThreadPoolExecutor(max_workers=max(1, args.ocr_workers)) as ocr_ex:
+        ocr_futs = []
+        pending: "collections.deque[str]" = collections.deque()
 
-        try:
-            pdf_path = pdf_dir / f"{pid}.pdf"
-            parse_path = parse_dir / f"{pid}.json"
-
-            # 1) 下载（如果缺失）
-            if not pdf_path.exists():
-                pdf_path = download_arxiv_pdf(pid, pdf_dir)
-
-
-            # 2) OCR 解析（如果缺失）
-            if not parse_path.exists():
-                parsed = ocr.ocr_pdf(str(pdf_path))
-                with parse_path.open("w", encoding="utf-8") as f:
-                    json.dump(parsed, f, ensure_ascii=False, indent=2)
-            
-            # 3) 更新 master 记录
-            r["download"] = "True"
-
-            done += 1
-        except Exception as e:
-            print(f"[ERR] {pid}: {e}")
-            continue
-        finally:
-            if args.sleep > 0:
-                time.sleep(args.sleep)
-
-    _write_master_rows(master_csv, rows)
+        async def _download_stage() -> None:
+            pbar = tqdm(total=len(todo_pids), desc="analyze_02_parse[download]", unit="paper")
+            try:
+                async for pid, ok, err in download_all(
+                    todo_pids, pdf_dir, concurrency=args.workers, sleep_s=args.sleep,
+                    present=pdf_present, marked=ok_present, revalidate=args.revalidate,
+                ):
+                    pbar.update(1)
+                    if not ok:
+                        print(f"[ERR] {pid}: {err}")
+                        continue
+                    pending.append(pid)
+                    ocr_futs.append(
+                        ocr_ex.submit(_parse_batch, pending, max(1, args.ocr_batch), pdf_dir, parse_dir, ocr)
+                    )
+            finally:
+                pbar.close()
+
+        asyncio.run(_download_stage())
+
+        # 每篇下载对应一次提交，但一次提交可能处理多篇（也可能取空），进度按篇数累计
+        pbar = tqdm(total=len(ocr_futs), desc="analyze_02_parse[ocr]", unit="paper")
+        for fut in as_completed(ocr_futs):
+            for pid, ok, err in fut.result():
+                pbar.update(1)
+                if not ok:
+                    print(f"[ERR] {pid}: {err}")
+                    continue
+                # 更新 master 记录；先记进度日志，master 到最后统一重写
+                row_by_pid[pid]["download"] = "True"
+                progress.record(pid, download="True")
+                done += 1
+        pbar.close()
+
+    write_master_rows(master_csv, rows)
+    progress.close(clear=True)
     print(f"[DONE] parsed={done} ; master_updated={master_csv}")
 
 
@@ -6,15 +6,12 @@ from __future__ import annotations
 
 import sys
 import argparse
-import csv
-import json
 import time
 from pathlib import Path
 from typing import List, Optional, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
+from concurrent.futures import ThreadPoolExecutor
+import queue
 
-import requests
 from tqdm import tqdm
 
 # 允许把该文件当脚本运行：确保项目根目录在 sys.path 中
@@ -23,164 +20,84 @@ if str(_ROOT) not in sys.path:
     sys.path.insert(0, str(_ROOT))
 
 from config.ai import get_ai_clients
+from _parse_common import (
+    download_arxiv_pdf,
+    init_session,
+    ocr_pdfs,
+    read_master_rows,
+    scan_stems,
+    select_todo,
+    validated_pdf,
+    write_master_rows,
+)
 
 
-MASTER_FIELDS = [
-    "paperID",
-    "sources",
-    "createDate",
-    "base_analysis",
-    "relevance",
-    "download",
-    "deep_analysis",
-    "publish",
-    # 如果你想记录失败原因，可以把下面这列打开，并同时在写入处赋值
-    # "download_error",
-]
+# 每完成这么多篇就把 master 落盘一次：中途退出最多丢这么多篇的状态
+CHECKPOINT_EVERY = 32
 
+# 凑 OCR 批次时最多等这么久（秒）；等不满就按已有的篇数先跑，避免为凑满一批长时间空等
+OCR_BATCH_WAIT = 2.0
 
-def _read_master_rows(master_csv: Path) -> List[dict]:
-    if not master_csv.exists():
-        return []
-    with master_csv.open("r", encoding="utf-8", newline="") as f:
-        return list(csv.DictReader(f))
 
-
-def _write_master_rows(master_csv: Path, rows: List[dict]) -> None:
-    master_csv.parent.mkdir(parents=True, exist_ok=True)
-    with master_csv.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=MASTER_FIELDS)
-        w.writeheader()
-        for r in rows:
-            w.writerow({k: (r.get(k, "") or "") for k in MASTER_FIELDS})
-
-
-def _is_true(v: str) -> bool:
-    return (v or "").strip().lower() == "true"
-
-
-def _looks_like_pdf(path: Path) -> bool:
-    """快速判定文件是否真 PDF（防止保存了 HTML reCAPTCHA 页面）"""
-    try:
-        with path.open("rb") as f:
-            head = f.read(5)
-        return head == b"%PDF-"
-    except Exception:
-        return False
-
-
-# -----------------------------
-# Thread-local requests session
-# -----------------------------
-_tls = threading.local()
-
-
-def _get_session() -> requests.Session:
-    s = getattr(_tls, "session", None)
-    if s is None:
-        s = requests.Session()
-        _tls.session = s
-    return s
-
-
-def download_arxiv_pdf(
-    paper_id: str,
+def _download_one(
+    pid: str,
     pdf_dir: Path,
-    timeout: int = 120,
-    max_retries: int = 3,
-    sleep_base: float = 1.0,
-) -> Path:
+    sleep_s: float,
+    have_pdf: Optional[bool] = None,
+    marked: Optional[bool] = None,
+    revalidate: bool = False,
+) -> Tuple[str, bool, str]:
     """
-    下载 arXiv PDF 到本地，并做真实性校验：
-    - 优先用 export.arxiv.org，降低触发 reCAPTCHA 概率
-    - 下载完成后检查文件头必须为 %PDF-
-    - 若检测到 HTML/非 PDF：删除文件并重试
+    下载阶段：PDF 缺失或是假 -> 下载/重下并校验
+    have_pdf / marked: 扫描目录时已知的 PDF 与 .ok 标记存在性；为 None 时才 stat
+    revalidate: 已有的真 PDF 也交给下载器，用 ETag / HEAD 向服务端复验，未变则不传正文
     """
-    pdf_dir.mkdir(parents=True, exist_ok=True)
-    pid = (paper_id or "").strip()
-    if not pid:
-        raise ValueError("paper_id is empty")
-
-    out_path = pdf_dir / f"{pid}.pdf"
-
-    # 更稳的顺序：export -> arxiv
-    urls = [
-        f"https://export.arxiv.org/pdf/{pid}.pdf",
-        f"https://arxiv.org/pdf/{pid}.pdf",
-    ]
-
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (X11; Linux aarch64) AppleWebKit/537.36 "
-            "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
-        )
-    }
-
-    last_err: Exception | None = None
-    session = _get_session()
-
-    for attempt in range(1, max_retries + 1):
-        for url in urls:
-            try:
-                # 若存在旧文件但不是真 PDF，先删掉
-                if out_path.exists() and not _looks_like_pdf(out_path):
-                    out_path.unlink(missing_ok=True)
-
-                with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
-                    r.raise_for_status()
-
-                    ctype = (r.headers.get("Content-Type") or "").lower()
-                    if "text/html" in ctype:
-                        sample = r.raw.read(256, decode_content=True)
-                        raise RuntimeError(f"Got HTML instead of PDF from {url}: {sample[:120]!r}")
-
-                    with out_path.open("wb") as f:
-                        for chunk in r.iter_content(chunk_size=1024 * 256):
-                            if chunk:
-                                f.write(chunk)
-
-                if not _looks_like_pdf(out_path):
-                    head = out_path.read_bytes()[:256] if out_path.exists() else b""
-                    out_path.unlink(missing_ok=True)
-                    raise RuntimeError(
-                        f"Downloaded file is not a real PDF (%PDF- missing). url={url} head={head[:120]!r}"
-                    )
-
-                return out_path
-
-            except Exception as e:
-                last_err = e
-                continue
-
-        if attempt < max_retries:
-            time.sleep(sleep_base * attempt)
-
-    raise RuntimeError(f"Failed to download valid PDF for {pid} after retries: {last_err}")
+    try:
+        pdf_path = pdf_dir / f"{pid}.pdf"
+        if have_pdf is None:
+            have_pdf = pdf_path.exists()
+        if revalidate or (not have_pdf) or (not validated_pdf(pdf_path, marked)):
+            download_arxiv_pdf(pid, pdf_dir)
+            # 每次下载后间隔一下，降低触发 reCAPTCHA 的概率
+            if sleep_s > 0:
+                time.sleep(sleep_s)
+        return pid, True, "ok"
+    except Exception as e:
+        return pid, False, str(e)
 
 
-def _process_one_paper(pid: str, pdf_dir: Path, parse_dir: Path, ocr) -> Tuple[str, bool, str]:
+def _download_stage(
+    pid: str,
+    pdf_dir: Path,
+    sleep_s: float,
+    out_q: "queue.Queue[Tuple[str, bool, str]]",
+    have_pdf: Optional[bool] = None,
+    marked: Optional[bool] = None,
+    revalidate: bool = False,
+) -> None:
     """
-    单篇论文流水线（不分离下载和解析）：
-    1) PDF 缺失或是假 -> 下载/重下并校验
-    2) parse 缺失 -> OCR 解析并写 json
+    下载线程：结果（无论成败）都放进 out_q 交给 OCR 阶段；队列满时阻塞，避免下载跑得太靠前
     """
+    res = (pid, False, "download not attempted")
     try:
-        pdf_path = pdf_dir / f"{pid}.pdf"
-        parse_path = parse_dir / f"{pid}.json"
-
-        # 1) 下载（缺失 or 假 PDF）
-        if (not pdf_path.exists()) or (not _looks_like_pdf(pdf_path)):
-            pdf_path = download_arxiv_pdf(pid, pdf_dir)
+        res = _download_one(pid, pdf_dir, sleep_s, have_pdf, marked, revalidate)
+    finally:
+        out_q.put(res)
 
-        # 2) OCR 解析（缺失才解析）
-        if not parse_path.exists():
-            parsed = ocr.ocr_pdf(str(pdf_path))
-            with parse_path.open("w", encoding="utf-8") as f:
-                json.dump(parsed, f, ensure_ascii=False, indent=2)
 
-        return pid, True, "ok"
-    except Exception as e:
-        return pid, False, str(e)
+def _ocr_batch(
+    items: List[Tuple[str, bool, str]], pdf_dir: Path, parse_dir: Path, ocr
+) -> List[Tuple[str, bool, str]]:
+    """
+    OCR 阶段：一批下载结果中成功的交给 ocr_pdfs 合并成一次 OCR 调用，下载失败的原样透传。
+    返回与 items 一一对应的 (pid, ok, msg)
+    """
+    out = list(items)
+    idxs = [i for i, (_pid, ok, _msg) in enumerate(items) if ok]
+    for i, res in zip(idxs, ocr_pdfs([items[i][0] for i in idxs], pdf_dir, parse_dir, ocr)):
+        if not res[1]:
+            out[i] = res
+    return out
 
 
 def main() -> None:
@@ -190,10 +107,21 @@ def main() -> None:
     ap.add_argument("--parse_dir", default="storage/papers/parse")
     ap.add_argument("--sleep", type=float, default=0.5)
     ap.add_argument(
-        "--workers",
+        "--dl_workers",
+        type=int,
+        default=8,
+        help="download threads. OCR always runs on a single consumer to avoid GPU contention.",
+    )
+    ap.add_argument(
+        "--ocr_batch",
         type=int,
-        default=1,
-        help="paper-level threads (download+parse in one worker). Keep small to avoid reCAPTCHA / GPU contention.",
+        default=4,
+        help="max PDFs per OCR request; already-downloaded papers are grouped into one call.",
+    )
+    ap.add_argument(
+        "--revalidate",
+        action="store_true",
+        help="also re-check already-downloaded PDFs against arXiv (ETag / HEAD); changed ones are re-downloaded and re-OCRed.",
     )
     args = ap.parse_args()
 
@@ -203,30 +131,18 @@ def main() -> None:
     parse_dir.mkdir(parents=True, exist_ok=True)
     pdf_dir.mkdir(parents=True, exist_ok=True)
 
-    rows = _read_master_rows(master_csv)
+    rows = read_master_rows(master_csv)
     if not rows:
         print(f"[WARN] master csv not found or empty: {master_csv}")
         return
 
-    # 只处理：relevance=True 且「尚未同时具备 pdf + parse 结果」的论文
-    todo_pids: List[str] = []
-    pid_to_row: dict[str, dict] = {}
+    # 目录各扫一遍得到已有文件集合，循环内只做集合查询，不再逐篇 stat
+    pdf_present = scan_stems(pdf_dir, ".pdf")
+    parse_present = scan_stems(parse_dir, ".json")
+    ok_present = scan_stems(pdf_dir, ".pdf.ok")
 
-    for r in rows:
-        pid = (r.get("paperID") or "").strip()
-        if not pid:
-            continue
-        pid_to_row[pid] = r
-
-        if not _is_true(r.get("relevance", "")):
-            continue
-
-        pdf_path = pdf_dir / f"{pid}.pdf"
-        parse_path = parse_dir / f"{pid}.json"
-        if pdf_path.exists() and parse_path.exists():
-            continue
-
-        todo_pids.append(pid)
+    pid_to_row = {(r.get("paperID") or "").strip(): r for r in rows}
+    todo_pids = select_todo(rows, pdf_present, parse_present, revalidate=args.revalidate)
 
     if not todo_pids:
         print("[DONE] nothing to do")
@@ -236,30 +152,61 @@ def main() -> None:
 
     ok_cnt = 0
     fail_cnt = 0
-
-    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
-        futs = {
-            ex.submit(_process_one_paper, pid, pdf_dir, parse_dir, ocr): pid
-            for pid in todo_pids
-        }
-
-        for fut in tqdm(as_completed(futs), total=len(futs), desc="analyze_02_parse", unit="paper"):
-            pid, ok, msg = fut.result()
-
-            if ok:
-                pid_to_row[pid]["download"] = "True"
-                # pid_to_row[pid].pop("download_error", None)
-                ok_cnt += 1
-            else:
-                pid_to_row[pid]["download"] = "False"
-                # pid_to_row[pid]["download_error"] = msg[:300]
-                fail_cnt += 1
-                print(f"[ERR] {pid}: {msg}")
-
-            if args.sleep > 0:
-                time.sleep(args.sleep)
-
-    _write_master_rows(master_csv, rows)
+    dirty = 0
+
+    # 两阶段流水线：多线程下载 -> 有界队列 -> 主线程按批 OCR
+    # 下载与 OCR 重叠执行，总耗时约为 max(下载总时长 / N, OCR 总时长)
+    dl_workers = max(1, args.dl_workers)
+    init_session(pool_size=dl_workers)
+    ocr_q: "queue.Queue[Tuple[str, bool, str]]" = queue.Queue(maxsize=2 * dl_workers)
+
+    with ThreadPoolExecutor(max_workers=dl_workers) as ex:
+        for pid in todo_pids:
+            ex.submit(
+                _download_stage,
+                pid,
+                pdf_dir,
+                args.sleep,
+                ocr_q,
+                pid in pdf_present,
+                pid in ok_present,
+                args.revalidate,
+            )
+
+        # 进度以 OCR（较慢的阶段）完成数为准
+        # 每次至少取一篇；队列里已有的（或 OCR_BATCH_WAIT 内陆续到达的）凑成一批交给一次 OCR 调用
+        ocr_batch = max(1, args.ocr_batch)
+        remaining = len(todo_pids)
+        pbar = tqdm(total=remaining, desc="analyze_02_parse", unit="paper")
+        while remaining:
+            batch = [ocr_q.get()]
+            deadline = time.monotonic() + OCR_BATCH_WAIT
+            while len(batch) < min(ocr_batch, remaining):
+                try:
+                    batch.append(ocr_q.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            remaining -= len(batch)
+
+            for pid, ok, msg in _ocr_batch(batch, pdf_dir, parse_dir, ocr):
+                if ok:
+                    pid_to_row[pid]["download"] = "True"
+                    # pid_to_row[pid].pop("download_error", None)
+                    ok_cnt += 1
+                else:
+                    pid_to_row[pid]["download"] = "False"
+                    # pid_to_row[pid]["download_error"] = msg[:300]
+                    fail_cnt += 1
+                    print(f"[ERR] {pid}: {msg}")
+                pbar.update(1)
+
+                dirty += 1
+                if dirty >= CHECKPOINT_EVERY:
+                    write_master_rows(master_csv, rows)
+                    dirty = 0
+        pbar.close()
+
+    write_master_rows(master_csv, rows)
     print(f"[DONE] ok={ok_cnt} fail={fail_cnt} ; master_updated={master_csv}")
 
 
@@ -6,15 +6,20 @@ from __future__ import annotations
 
 import sys
 import argparse
+import asyncio
 import csv
 import json
 import os
 import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Any, Dict, List, Tuple, Optional
 
+import numpy as np
+import orjson
+import pandas as pd
 from tqdm import tqdm
 
 # 允许把该文件当脚本运行：确保项目根目录在 sys.path 中
@@ -26,9 +31,15 @@ from config.ai import get_ai_clients
 from config.prompt import (
     SYSTEM_CN_JSON,
     SYSTEM_CN_PLAIN,
-    build_user_prompt_step03_deep_single_q_cn,
+    build_user_prompt_step03_deep_cn,
+    build_user_prompt_step03_deep_batch_cn,
+    build_user_prompt_step03_deep_context_cn,
+    build_user_prompt_step03_deep_question_cn,
     build_user_prompt_step03_deep_fix_cn,
 )
+from _json_scan import first_json_object
+from _llm_transport import LLMTransport
+from _parse_common import scan_stems
 
 
 REQUIRED_Q_KEYS = [
@@ -70,46 +81,133 @@ def _read_master_rows(master_csv: Path) -> List[dict]:
 
 def _write_master_rows(master_csv: Path, rows: List[dict]) -> None:
     master_csv.parent.mkdir(parents=True, exist_ok=True)
-    with master_csv.open("w", encoding="utf-8", newline="") as f:
+    # 先写临时文件再 os.replace：中途被杀也不会留下写了一半的 master
+    tmp = master_csv.with_suffix(master_csv.suffix + ".tmp")
+    with tmp.open("w", encoding="utf-8", newline="") as f:
         w = csv.DictWriter(f, fieldnames=MASTER_FIELDS)
         w.writeheader()
         for r in rows:
             w.writerow({k: (r.get(k, "") or "") for k in MASTER_FIELDS})
+    os.replace(tmp, master_csv)
+
+
+# 深度解读完成日志：每篇结果落盘后追加一行 paperID，master 只在运行结束时重写一次；
+# 进程中途崩溃时，下次启动先把日志里的论文在 master 中补标为已完成，不必重跑
+_DONE_JOURNAL = ".done"
+
+
+def _load_done(out_dir: Path) -> set:
+    try:
+        return {ln.strip() for ln in (out_dir / _DONE_JOURNAL).read_text(encoding="utf-8").splitlines() if ln.strip()}
+    except FileNotFoundError:
+        return set()
+
+
+def _append_done(out_dir: Path, pid: str) -> None:
+    with (out_dir / _DONE_JOURNAL).open("a", encoding="utf-8") as f:
+        f.write(pid + "\n")
+
+
+def _apply_done(rows: List[dict], out_dir: Path) -> int:
+    """把完成日志并入 rows（deep_analysis=True），返回补标的行数"""
+    done = _load_done(out_dir)
+    n = 0
+    for r in rows:
+        if (r.get("paperID") or "").strip() in done and not _is_true(r.get("deep_analysis")):
+            r["deep_analysis"] = "True"
+            n += 1
+    return n
+
+
+def _flush_done(master_csv: Path, rows: List[dict], out_dir: Path) -> None:
+    """并入完成日志、原子重写 master，成功后清空日志"""
+    _apply_done(rows, out_dir)
+    _write_master_rows(master_csv, rows)
+    try:
+        (out_dir / _DONE_JOURNAL).unlink()
+    except FileNotFoundError:
+        pass
 
 
 def _is_true(v: str) -> bool:
     return (v or "").strip().lower() == "true"
 
 
+def _select_deep_todo(rows: List[dict], out_dir: Path) -> List[dict]:
+    """
+    待深度解读的行（返回 rows 中的原对象，调用方可直接改写）：
+    - base_analysis / relevance / download 均为 True，publish 不为 True
+    - 且不是「deep_analysis=True 并且 out_dir 下已有 <paperID>.json」
+    标志位比较用 pandas 整列完成，结果文件只做一次 os.scandir，不再逐篇 stat + 读 JSON
+    """
+    if not rows:
+        return []
+    df = pd.DataFrame.from_records(rows, columns=MASTER_FIELDS).fillna("").astype(str)
+    pid = df["paperID"].str.strip()
+
+    def flag(col: str) -> pd.Series:
+        return df[col].str.strip().str.lower() == "true"
+
+    done = flag("deep_analysis") & pid.isin(scan_stems(out_dir, ".json"))
+    mask = (
+        (pid != "")
+        & flag("base_analysis")
+        & flag("relevance")
+        & flag("download")
+        & ~flag("publish")
+        & ~done
+    )
+    return [rows[i] for i in np.flatnonzero(mask.to_numpy())]
+
+
 def _parse_json_obj_relaxed(text: str) -> Dict[str, Any]:
     """
     解析 LLM 输出为 JSON 对象：
-    - 先直接 json.loads
-    - 失败则从文本中提取第一个 {...} 再 json.loads
+    - 先直接 orjson.loads
+    - 失败则从文本中提取第一个 {...} 再 orjson.loads
     """
     t = (text or "").strip()
     try:
-        obj = json.loads(t)
+        obj = orjson.loads(t)
         if isinstance(obj, dict):
             return obj
     except Exception:
         pass
 
-    m = re.search(r"\{[\s\S]*\}", t)
-    if not m:
+    obj_text = first_json_object(t)
+    if obj_text is None:
         raise ValueError(f"cannot find json object in: {t[:200]}")
-    obj = json.loads(m.group(0))
+    obj = orjson.loads(obj_text)
     if not isinstance(obj, dict):
         raise ValueError("LLM JSON is not an object")
     return obj
 
 
+# 参考文献标题（可带章节编号，如 "## 7 References"）；其后的参考文献与附录不进提示词
+_REFS_HEADING_RE = re.compile(r"(?im)^#{1,3}\s*(?:\d+(?:\.\d+)*\.?\s*)?(?:references|bibliography|参考文献)\b")
+_MD_IMAGE_RE = re.compile(r"!\[[^\]]*\]\([^)]+\)")
+
+
+def _compact_md(md: str) -> str:
+    """
+    压缩正文再交给调用方按 max_chars 截断：去掉参考文献及之后的附录、图表图片链接，合并多余空行，
+    避免截断时留下参考文献却丢了结论
+    """
+    head = _REFS_HEADING_RE.split(md, maxsplit=1)[0]
+    if head.strip():
+        md = head
+    md = _MD_IMAGE_RE.sub("", md)
+    md = re.sub(r"\n{3,}", "\n\n", md)
+    return md.strip()
+
+
 def _load_parsed_md(parse_path: Path, paper_id: str) -> Tuple[str, str]:
     """
     从 OCR 解析结果里拿 md_content，并尽量拿到标题。
-    返回：(title, md_content)
+    返回：(title, 压缩后的 md_content，见 _compact_md)
     """
-    data = json.loads(parse_path.read_text(encoding="utf-8"))
+    # OCR 结果动辄数百 KB 到数 MB，orjson 直接解析字节
+    data = orjson.loads(parse_path.read_bytes())
     results = data.get("results") or {}
 
     pid = (paper_id or "").strip()
@@ -133,7 +231,26 @@ def _load_parsed_md(parse_path: Path, paper_id: str) -> Tuple[str, str]:
         if line.startswith("# "):
             title = line[2:].strip()
             break
-    return title, md
+    return title, _compact_md(md)
+
+
+def _write_deep_payload(
+    out_dir: Path, pid: str, title: str, parse_path: Path, deep_obj: Dict[str, Any]
+) -> None:
+    """写 <out_dir>/<pid>.json：先写 .json.tmp 再 os.replace，中途崩溃不会留下半个 JSON"""
+    out_path = out_dir / f"{pid}.json"
+    payload = {
+        "paperID": pid,
+        "title": title,
+        "deep_understanding": deep_obj,
+        "meta": {
+            "parse_path": str(parse_path),
+            "ts": datetime.now().isoformat(timespec="seconds"),
+        },
+    }
+    tmp = out_path.with_suffix(".json.tmp")
+    tmp.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE))
+    os.replace(tmp, out_path)
 
 
 def _deep_result_is_valid(obj: Dict[str, Any]) -> bool:
@@ -159,22 +276,93 @@ def _normalize_deep_result(obj: Dict[str, Any]) -> Dict[str, Any]:
     raise ValueError(f"deep json keys invalid: {list(obj.keys())[:10]}")
 
 
-def _repair_to_required_json(llm, bad_output_text: str) -> Dict[str, Any]:
-    """
-    当模型没有按要求输出 key 时，追加一次“格式修正”请求，把内容强制转换为 REQUIRED_Q_KEYS。
-    """
-    fix_prompt = build_user_prompt_step03_deep_fix_cn(REQUIRED_Q_KEYS, bad_output_text)
-    messages_fix = [
+def _deep_messages(title: str, md: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_CN_JSON},
+        {"role": "user", "content": build_user_prompt_step03_deep_cn(title, md)},
+    ]
+
+
+def _single_q_messages(title: str, md: str, q: str) -> List[Dict[str, str]]:
+    # 系统提示词 + 论文正文在前且逐字节相同，只有最后一条问题不同，便于服务端做前缀缓存
+    return [
+        {"role": "system", "content": SYSTEM_CN_PLAIN},
+        {"role": "user", "content": build_user_prompt_step03_deep_context_cn(title, md)},
+        {"role": "user", "content": build_user_prompt_step03_deep_question_cn(q)},
+    ]
+
+
+def _fix_messages(bad_output_text: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_CN_JSON},
+        {"role": "user", "content": build_user_prompt_step03_deep_fix_cn(REQUIRED_Q_KEYS, bad_output_text)},
+    ]
+
+
+def _batch_messages(items: List[Tuple[str, str]]) -> List[Dict[str, str]]:
+    return [
         {"role": "system", "content": SYSTEM_CN_JSON},
-        {"role": "user", "content": fix_prompt},
+        {"role": "user", "content": build_user_prompt_step03_deep_batch_cn(items, REQUIRED_Q_KEYS)},
     ]
-    fixed_text = llm.chat_text(messages_fix, response_json=True)
+
+
+def _valid_deep_obj(out_text: str) -> Optional[Dict[str, Any]]:
+    """解析出合格的 deep json 则返回它，否则返回 None（交给格式修正）"""
+    try:
+        obj = _parse_json_obj_relaxed(out_text)
+    except (ValueError, json.JSONDecodeError):
+        return None
+    return obj if _deep_result_is_valid(obj) else None
+
+
+def _check_repaired(fixed_text: str) -> Dict[str, Any]:
     fixed_obj = _parse_json_obj_relaxed(fixed_text)
     if set(fixed_obj.keys()) != set(REQUIRED_Q_KEYS):
         raise ValueError(f"repair failed, keys={list(fixed_obj.keys())[:10]}")
     return fixed_obj
 
 
+def _batch_papers(out_text: str, n: int) -> List[Any]:
+    """
+    合并请求的输出里取出 papers 数组，按每个元素的 "id"（论文编号，从 1 开始）对回 n 篇论文，
+    返回长度为 n 的列表（元素已去掉 "id"）；对不上的位置为 None，交给单篇重问：
+    - 数组长度不是 n：模型漏答/多答，整批都不可信，全部为 None
+    - id 缺失、不是 1..n 的整数，或同一 id 出现多次：对应论文为 None
+    """
+    papers = _parse_json_obj_relaxed(out_text).get("papers")
+    matched: List[Any] = [None] * n
+    if not isinstance(papers, list) or len(papers) != n:
+        return matched
+    seen: Dict[int, int] = {}
+    for elem in papers:
+        if not isinstance(elem, dict):
+            continue
+        try:
+            idx = int(elem.get("id")) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= idx < n:
+            seen[idx] = seen.get(idx, 0) + 1
+            matched[idx] = {k: v for k, v in elem.items() if k != "id"}
+    for idx, cnt in seen.items():
+        if cnt > 1:
+            matched[idx] = None
+    return matched
+
+
+def _repair_to_required_json(llm, bad_output_text: str) -> Dict[str, Any]:
+    """
+    当模型没有按要求输出 key 时，追加一次“格式修正”请求，把内容强制转换为 REQUIRED_Q_KEYS。
+    """
+    fixed_text = llm.chat_text(_fix_messages(bad_output_text), response_json=True)
+    return _check_repaired(fixed_text)
+
+
+async def _repair_to_required_json_async(llm, bad_output_text: str) -> Dict[str, Any]:
+    fixed_text = await llm.chat_text_async(_fix_messages(bad_output_text), response_json=True)
+    return _check_repaired(fixed_text)
+
+
 def _normalize_plain_answer(text: str) -> str:
     """
     规范化单题纯文本输出：
@@ -193,15 +381,105 @@ def _normalize_plain_answer(text: str) -> str:
     return t or "unknown"
 
 
-def _load_existing_deep(out_path: Path) -> Optional[Dict[str, Any]]:
-    try:
-        if not out_path.exists():
-            return None
-        data = json.loads(out_path.read_text(encoding="utf-8"))
-        deep = data.get("deep_understanding")
-        return deep if isinstance(deep, dict) else None
-    except Exception:
-        return None
+def _ask_deep_questions(llm, title: str, md: str, per_question: bool, sleep_s: float) -> Dict[str, Any]:
+    """
+    回答 REQUIRED_Q_KEYS 中的 5 个问题，返回以中文问题为 key 的 deep_obj：
+    - 默认一次 JSON 请求答完 5 题（标题 + 正文只发送一次）；key 不符合要求时追加一次格式修正
+    - per_question=True：每个问题单独请求，第 1 题之后其余 4 题并发发出（模型不擅长输出 JSON 时使用）
+    """
+    if not per_question:
+        out_text = llm.chat_text(_deep_messages(title, md), response_json=True)
+        obj = _valid_deep_obj(out_text)
+        if obj is None:
+            obj = _repair_to_required_json(llm, out_text)
+        return _normalize_deep_result(obj)
+
+    # 先答第 1 题把公共前缀写进服务端缓存，其余 4 题互不依赖、并发请求并命中该前缀
+    first = llm.chat_text(_single_q_messages(title, md, REQUIRED_Q_KEYS[0]))
+    with ThreadPoolExecutor(max_workers=len(REQUIRED_Q_KEYS) - 1) as pool:
+        rest = pool.map(lambda q: llm.chat_text(_single_q_messages(title, md, q)), REQUIRED_Q_KEYS[1:])
+        answers = [first, *rest]
+
+    # 每篇请求完成后间隔（避免过快打满/触发限流）
+    if sleep_s > 0:
+        time.sleep(sleep_s)
+    return {q: _normalize_plain_answer(a) for q, a in zip(REQUIRED_Q_KEYS, answers)}
+
+
+async def _ask_deep_questions_async(
+    llm, title: str, md: str, per_question: bool, sleep_s: float
+) -> Dict[str, Any]:
+    """_ask_deep_questions 的协程版：LLM 请求走 llm.chat_text_async，逐问题模式用 asyncio.gather 并发"""
+    if not per_question:
+        out_text = await llm.chat_text_async(_deep_messages(title, md), response_json=True)
+        obj = _valid_deep_obj(out_text)
+        if obj is None:
+            obj = await _repair_to_required_json_async(llm, out_text)
+        return _normalize_deep_result(obj)
+
+    first = await llm.chat_text_async(_single_q_messages(title, md, REQUIRED_Q_KEYS[0]))
+    rest = await asyncio.gather(
+        *(llm.chat_text_async(_single_q_messages(title, md, q)) for q in REQUIRED_Q_KEYS[1:])
+    )
+    answers = [first, *rest]
+    if sleep_s > 0:
+        await asyncio.sleep(sleep_s)
+    return {q: _normalize_plain_answer(a) for q, a in zip(REQUIRED_Q_KEYS, answers)}
+
+
+def _enable_response_cache(llm, cache_dir: Optional[str]):
+    """
+    --cache_dir 交给 config/ai.py 的请求级缓存：key 是实际发送的 messages（逐问题模式的每一问、格式修正请求各自一条），
+    提示词模板或正文一变就自然失效；只有 temperature=0 的确定性输出才缓存。cache_dir 为空（--no_cache）时原样返回
+    """
+    if not cache_dir:
+        return llm
+    cached = llm.with_response_cache(cache_dir)
+    if cached is llm:
+        print(f"[INFO] LLM temperature={llm._temperature()} != 0, response cache disabled")
+    return cached
+
+
+async def _deep_answers_batch_async(
+    llm,
+    items: List[Tuple[str, str]],
+    sleep_s: float = 0.0,
+) -> List[Any]:
+    """
+    多篇论文合并成一次 JSON 请求，返回与 items（[(标题, 正文), ...]）一一对应的 deep_obj；
+    某篇失败时对应位置是异常对象，不影响同批其它论文：
+    - 只有 1 篇时直接按单篇请求
+    - 回答按 "id" 对回论文（见 _batch_papers）；key 不合格的元素单独做格式修正，
+      对不上 id 的（或整批请求失败时）单独重问；这几篇并发进行
+    """
+    results: List[Any] = [None] * len(items)
+    papers: List[Any] = []
+    if len(items) > 1:
+        try:
+            out_text = await llm.chat_text_async(_batch_messages(items), response_json=True)
+            papers = _batch_papers(out_text, len(items))
+        except Exception as e:
+            print(f"[WARN] batched deep request failed ({len(items)} papers), retrying one by one: {e}")
+        if sleep_s > 0:
+            await asyncio.sleep(sleep_s)
+
+    async def _finish(i: int) -> None:
+        title, md = items[i]
+        elem = papers[i] if i < len(papers) else None
+        try:
+            if isinstance(elem, dict) and _deep_result_is_valid(elem):
+                obj = _normalize_deep_result(elem)
+            elif isinstance(elem, dict):
+                obj = await _repair_to_required_json_async(llm, json.dumps(elem, ensure_ascii=False))
+            else:
+                obj = await _ask_deep_questions_async(llm, title, md, False, sleep_s)
+        except Exception as e:
+            results[i] = e
+            return
+        results[i] = obj
+
+    await asyncio.gather(*(_finish(i) for i in range(len(items))))
+    return results
 
 
 def main() -> None:
@@ -212,6 +490,15 @@ def main() -> None:
     ap.add_argument("--max_chars", type=int, default=20000)
     ap.add_argument("--sleep", type=float, default=0.0)
     ap.add_argument("--limit", type=int, default=0, help="0 表示不限制；否则只处理前 N 篇")
+    ap.add_argument(
+        "--per_question",
+        action="store_true",
+        help="每个问题单独请求（每篇 5 次并发调用）；默认一次 JSON 请求答完 5 题",
+    )
+    ap.add_argument("--cache_dir", default="storage/.llm_cache/deep", help="LLM 请求缓存目录（仅 temperature=0 时生效）")
+    ap.add_argument("--no_cache", action="store_true", help="不读写请求缓存，每篇都重新请求 LLM")
+    ap.add_argument("--rpm", type=float, default=0, help="每分钟 LLM 请求上限，0 表示不限速")
+    ap.add_argument("--llm_retries", type=int, default=4, help="429/5xx/超时等可重试错误的重试次数")
     args = ap.parse_args()
 
     master_csv = Path(args.master_csv)
@@ -223,93 +510,57 @@ def main() -> None:
     if not rows:
         print(f"[WARN] master csv not found or empty: {master_csv}")
         return
+    recovered = _apply_done(rows, out_dir)
+    if recovered:
+        print(f"[INFO] recovered {recovered} deep_analysis flags from previous run")
 
-    # 处理条件：
-    # - base_analysis=True
-    # - relevance=True
-    # - download=True（意味着 PDF/OCR 已准备好）
-    # - publish=False（未发布）
-    # - deep_analysis!=True（尚未深度解读）
-    todo = []
-    for r in rows:
-        pid = (r.get("paperID") or "").strip()
-        if not pid:
-            continue
-        if not _is_true(r.get("base_analysis", "")):
-            continue
-        if not _is_true(r.get("relevance", "")):
-            continue
-        if not _is_true(r.get("download", "")):
-            continue
-        if _is_true(r.get("publish", "")):
-            continue
-        out_path = out_dir / f"{pid}.json"
-        existing = _load_existing_deep(out_path)
-        already_ok = existing is not None and _deep_result_is_valid(existing)
-        if _is_true(r.get("deep_analysis", "")) and already_ok:
-            continue
-        todo.append(r)
+    todo = _select_deep_todo(rows, out_dir)
 
     if args.limit and args.limit > 0:
         todo = todo[: args.limit]
 
     if not todo:
+        if recovered:
+            _flush_done(master_csv, rows, out_dir)
         print("[DONE] no papers to deep analyze")
         return
 
     _cfg, llm, _ocr = get_ai_clients()
+    llm = _enable_response_cache(llm, None if args.no_cache else args.cache_dir)
+    llm = LLMTransport(llm, rpm=args.rpm, max_retries=args.llm_retries)
 
     done = 0
-    for r in tqdm(todo, total=len(todo), desc="analyze_03_deep", unit="paper"):
-        pid = (r.get("paperID") or "").strip()
-        if not pid:
-            continue
-        try:
-            parse_path = parse_dir / f"{pid}.json"
-            if not parse_path.exists():
-                raise FileNotFoundError(f"missing parse file: {parse_path}")
-
-            title, md = _load_parsed_md(parse_path, pid)
-            md = md[: args.max_chars]
-
-            # 逐问题多次请求：每次只回答 1 个问题，最后组装成 REQUIRED_Q_KEYS 对应的 deep_obj
-            deep_obj: Dict[str, Any] = {}
-            for q in REQUIRED_Q_KEYS:
-                messages = [
-                    {"role": "system", "content": SYSTEM_CN_PLAIN},
-                    {"role": "user", "content": build_user_prompt_step03_deep_single_q_cn(title, md, q)},
-                ]
-                out_text = llm.chat_text(messages)
-                deep_obj[q] = _normalize_plain_answer(out_text)
-
-                # 每次请求间隔（避免过快打满/触发限流）
-                if args.sleep > 0:
-                    time.sleep(args.sleep)
-
-            # deep_obj 是程序端按 REQUIRED_Q_KEYS 构造的，理论上恒 valid；这里保留一个断言式兜底
-            if not _deep_result_is_valid(deep_obj):
-                raise ValueError("deep_obj keys invalid after per-question calls")
-
-            out_path = out_dir / f"{pid}.json"
-            payload = {
-                "paperID": pid,
-                "title": title,
-                "deep_understanding": deep_obj,
-                "meta": {
-                    "parse_path": str(parse_path),
-                    "ts": datetime.now().isoformat(timespec="seconds"),
-                },
-            }
-            out_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-
-            # 只标记 deep_analysis，不动 publish
-            r["deep_analysis"] = "True"
-            done += 1
-        except Exception as e:
-            print(f"[ERR] {pid}: {e}")
-            continue
-
-    _write_master_rows(master_csv, rows)
+    try:
+        for r in tqdm(todo, total=len(todo), desc="analyze_03_deep", unit="paper"):
+            pid = (r.get("paperID") or "").strip()
+            if not pid:
+                continue
+            try:
+                parse_path = parse_dir / f"{pid}.json"
+                if not parse_path.exists():
+                    raise FileNotFoundError(f"missing parse file: {parse_path}")
+
+                title, md = _load_parsed_md(parse_path, pid)
+                md = md[: args.max_chars]
+
+                deep_obj = _ask_deep_questions(llm, title, md, per_question=args.per_question, sleep_s=args.sleep)
+
+                # deep_obj 已统一成 REQUIRED_Q_KEYS；这里保留一个断言式兜底
+                if not _deep_result_is_valid(deep_obj):
+                    raise ValueError("deep_obj keys invalid after deep analysis")
+
+                _write_deep_payload(out_dir, pid, title, parse_path, deep_obj)
+
+                # 只标记 deep_analysis，不动 publish；先记进完成日志，master 在结束时统一重写
+                _append_done(out_dir, pid)
+                r["deep_analysis"] = "True"
+                done += 1
+            except Exception as e:
+                print(f"[ERR] {pid}: {e}")
+                continue
+    finally:
+        # 被中断（Ctrl-C 等）时也把已完成的论文写回 master
+        _flush_done(master_csv, rows, out_dir)
     print(f"[DONE] deep_analyzed={done} ; master_updated={master_csv}")
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+"""
+深度分析的离线批处理版本：把所有待分析论文的请求写成 JSONL，经 OpenAI 兼容的 Batch 接口
+（/v1/files + /v1/batches）一次提交，轮询到完成后取回结果，落盘与更新 master 的方式与 analyze_03_deep_pro 相同。
+适合夜间定时任务：不要求实时返回，服务端可按更低价格 / 更高吞吐调度
+
+用法：
+  python pipeline/analyze_03_deep_batch.py                      # 提交并等待完成
+  python pipeline/analyze_03_deep_batch.py --no_wait            # 只提交，记录 batch id 后退出
+  python pipeline/analyze_03_deep_batch.py --batch_id batch_xxx # 继续等待/收取之前提交的批次
+"""
+
+from __future__ import annotations
+
+import sys
+import argparse
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+# 允许把该文件当脚本运行：确保项目根目录在 sys.path 中
+_ROOT = Path(__file__).resolve().parents[1]
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from config.ai import CONNECT_TIMEOUT, get_ai_clients
+from analyze_03_deep import (
+    _read_master_rows,
+    _load_parsed_md,
+    _parse_json_obj_relaxed,
+    _deep_result_is_valid,
+    _normalize_deep_result,
+    _repair_to_required_json,
+    _deep_messages,
+    _enable_response_cache,
+    _apply_done,
+    _append_done,
+    _flush_done,
+    _select_deep_todo,
+    _write_deep_payload,
+)
+
+# 批次进入这些状态后不会再变化
+_FINAL_STATES = {"completed", "failed", "expired", "cancelled"}
+
+
+def _api_base(llm) -> str:
+    """LLM_BASE_URL 规范成 .../v1，与 chat/completions 的拼接规则一致"""
+    cfg = llm.cfg.openai_compat
+    return llm._openai_compat_chat_url(cfg.base_url, "").rstrip("/")
+
+
+def _api_call(llm, method: str, path: str, **kwargs) -> Any:
+    cfg = llm.cfg.openai_compat
+    headers = {"Authorization": f"Bearer {cfg.api_key}"} if cfg.api_key else {}
+    r = llm._sess.request(
+        method, _api_base(llm) + path, headers=headers, timeout=(CONNECT_TIMEOUT, cfg.timeout), **kwargs
+    )
+    if r.status_code >= 400:
+        raise RuntimeError(f"{method} {path} -> HTTP {r.status_code}: {(r.text or '')[:2000]}")
+    return r
+
+
+def _deep_obj_from_content(llm, content: str) -> Dict[str, Any]:
+    try:
+        obj = _parse_json_obj_relaxed(content)
+    except (ValueError, json.JSONDecodeError):
+        obj = None
+    if obj is None or not _deep_result_is_valid(obj):
+        # 格式不对的少数几篇走一次在线的格式修正请求
+        obj = _repair_to_required_json(llm, content)
+    return _normalize_deep_result(obj)
+
+
+def _build_input(
+    llm, todo: List[dict], args: argparse.Namespace, input_path: Path
+) -> Tuple[Dict[str, Tuple[str, str]], List[str]]:
+    """
+    写 batch_input.jsonl，每篇一行；请求级缓存（与在线请求同一套 key）命中的直接落盘，不进批次
+    返回：({pid: (title, parse_path)} 已写入批次的论文, [缓存命中已完成的 pid])
+    """
+    parse_dir = Path(args.parse_dir)
+    out_dir = Path(args.out_dir)
+    meta: Dict[str, Tuple[str, str]] = {}
+    done: List[str] = []
+    with input_path.open("w", encoding="utf-8") as f:
+        for r in todo:
+            pid = (r.get("paperID") or "").strip()
+            parse_path = parse_dir / f"{pid}.json"
+            try:
+                title, md = _load_parsed_md(parse_path, pid)
+            except Exception as e:
+                print(f"[ERR] {pid}: {e}")
+                continue
+            md = md[: args.max_chars]
+            messages = _deep_messages(title, md)
+
+            cached = llm._cache_get(llm._cache_key(messages, True))
+            if cached is not None:
+                try:
+                    deep_obj = _deep_obj_from_content(llm, cached["choices"][0]["message"]["content"])
+                    _write_deep_payload(out_dir, pid, title, parse_path, deep_obj)
+                    _append_done(out_dir, pid)
+                    done.append(pid)
+                    continue
+                except Exception as e:
+                    print(f"[WARN] {pid}: cached response unusable, resubmitting: {e}")
+
+            _url, _headers, body = llm._openai_compat_request(messages, True)
+            line = {"custom_id": pid, "method": "POST", "url": "/v1/chat/completions", "body": body}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            meta[pid] = (title, str(parse_path))
+    return meta, done
+
+
+def _submit(llm, input_path: Path) -> str:
+    with input_path.open("rb") as f:
+        up = _api_call(llm, "POST", "/files", data={"purpose": "batch"}, files={"file": (input_path.name, f)})
+    batch = _api_call(
+        llm,
+        "POST",
+        "/batches",
+        json={
+            "input_file_id": up.json()["id"],
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        },
+    ).json()
+    return batch["id"]
+
+
+def _wait(llm, batch_id: str, poll_s: float) -> Dict[str, Any]:
+    while True:
+        batch = _api_call(llm, "GET", f"/batches/{batch_id}").json()
+        status = batch.get("status", "")
+        counts = batch.get("request_counts") or {}
+        print(
+            f"[INFO] batch {batch_id}: {status} "
+            f"({counts.get('completed', 0)}/{counts.get('total', 0)} done, {counts.get('failed', 0)} failed)"
+        )
+        if status in _FINAL_STATES:
+            return batch
+        time.sleep(poll_s)
+
+
+def _collect(
+    llm,
+    batch: Dict[str, Any],
+    meta: Dict[str, Tuple[str, str]],
+    out_dir: Path,
+    max_chars: int,
+) -> List[str]:
+    """下载输出 JSONL，逐行校验并落盘；返回成功的 pid"""
+    out_file = batch.get("output_file_id")
+    if not out_file:
+        print(f"[ERR] batch {batch.get('id')} finished as {batch.get('status')} without output")
+        return []
+    text = _api_call(llm, "GET", f"/files/{out_file}/content").text
+
+    ok: List[str] = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+        except json.JSONDecodeError as e:
+            # 截断/损坏的一行只跳过它，不影响其余已落盘的论文进入 _flush_done
+            print(f"[ERR] malformed batch output line skipped: {e}: {line[:200]!r}")
+            continue
+        pid = rec.get("custom_id", "") if isinstance(rec, dict) else ""
+        try:
+            if not isinstance(rec, dict):
+                raise RuntimeError(f"batch output line is not an object: {line[:200]!r}")
+            if rec.get("error"):
+                raise RuntimeError(rec["error"])
+            resp = rec.get("response") or {}
+            if resp.get("status_code", 200) >= 400:
+                raise RuntimeError(f"HTTP {resp.get('status_code')}: {str(resp.get('body'))[:300]}")
+            content = resp["body"]["choices"][0]["message"]["content"]
+            deep_obj = _deep_obj_from_content(llm, content)
+
+            title, parse_path = meta.get(pid) or ("", "")
+            if not parse_path:
+                raise RuntimeError("unknown custom_id in batch output")
+            if llm.cfg.llm_cache:
+                # 按提交时的 messages 记进请求级缓存，之后在线/批处理重跑同一篇都能命中
+                _, md = _load_parsed_md(Path(parse_path), pid)
+                llm._cache_put(llm._cache_key(_deep_messages(title, md[:max_chars]), True), resp["body"])
+            _write_deep_payload(out_dir, pid, title, Path(parse_path), deep_obj)
+            _append_done(out_dir, pid)
+            ok.append(pid)
+        except Exception as e:
+            print(f"[ERR] {pid}: {e}")
+    return ok
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--master_csv", default="storage/papers_master.csv")
+    ap.add_argument("--parse_dir", default="storage/papers/parse")
+    ap.add_argument("--out_dir", default="storage/analysis/deep")
+    ap.add_argument("--work_dir", default="storage/analysis/deep_batch", help="批次输入 JSONL 与状态文件目录")
+    ap.add_argument("--max_chars", type=int, default=20000)
+    ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--poll", type=float, default=60.0, help="轮询批次状态的间隔（秒）")
+    ap.add_argument("--no_wait", action="store_true", help="提交后立即退出，之后用 --batch_id 收取结果")
+    ap.add_argument("--batch_id", default="", help="继续等待/收取之前提交的批次")
+    ap.add_argument("--cache_dir", default="storage/.llm_cache/deep", help="LLM 请求缓存目录（仅 temperature=0 时生效）")
+    ap.add_argument("--no_cache", action="store_true", help="不读写请求缓存")
+    args = ap.parse_args()
+
+    master_csv = Path(args.master_csv)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    work_dir = Path(args.work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    rows = _read_master_rows(master_csv)
+    if not rows:
+        print(f"[WARN] master csv not found or empty: {master_csv}")
+        return
+    _apply_done(rows, out_dir)
+
+    _cfg, llm, _ocr = get_ai_clients()
+    if llm.cfg.llm_provider != "openai_compat":
+        print("[FATAL] batch mode needs LLM_PROVIDER=openai_compat (an endpoint with /v1/files and /v1/batches)")
+        sys.exit(1)
+    llm = _enable_response_cache(llm, None if args.no_cache else args.cache_dir)
+
+    done: List[str] = []
+    if args.batch_id:
+        # 收取之前提交的批次：pid -> (标题, parse 路径) 来自提交时写下的状态文件
+        state_path = work_dir / f"{args.batch_id}.json"
+        meta = {k: tuple(v) for k, v in json.loads(state_path.read_text(encoding="utf-8"))["papers"].items()}
+        batch_id = args.batch_id
+    else:
+        todo = _select_deep_todo(rows, out_dir)
+        if args.limit > 0:
+            todo = todo[: args.limit]
+        if not todo:
+            _flush_done(master_csv, rows, out_dir)
+            print("[DONE] no papers to deep analyze")
+            return
+
+        input_path = work_dir / f"batch_input-{datetime.now().strftime('%Y%m%d-%H%M%S')}.jsonl"
+        meta, done = _build_input(llm, todo, args, input_path)
+        batch_id = ""
+        if meta:
+            batch_id = _submit(llm, input_path)
+            state = {"batch_id": batch_id, "input": str(input_path), "papers": meta}
+            (work_dir / f"{batch_id}.json").write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+            print(f"[INFO] submitted batch {batch_id} with {len(meta)} papers ({len(done)} served from cache)")
+
+    if batch_id and not args.no_wait:
+        batch = _wait(llm, batch_id, args.poll)
+        done += _collect(llm, batch, meta, out_dir, args.max_chars)
+
+    _flush_done(master_csv, rows, out_dir)
+    print(f"[DONE] deep_analyzed={len(set(done))} ; master_updated={master_csv}")
+
+
+if __name__ == "__main__":
+    main()
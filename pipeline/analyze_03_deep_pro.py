@@ -1,14 +1,10 @@
 from __future__ import annotations
 import argparse
-import csv
-import json
+import asyncio
 import os
-import re
-import time
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Tuple, Optional
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Tuple
 
 import sys
 # 允许把该文件当脚本运行：确保项目根目录在 sys.path 中
@@ -20,81 +16,140 @@ from tqdm import tqdm
 
 # ... [保留原有的 _ROOT, get_ai_clients, REQUIRED_Q_KEYS, ALT_KEY_MAP 等所有工具函数] ...
 
-from config.ai import get_ai_clients
-from config.prompt import (
-    SYSTEM_CN_JSON,
-    SYSTEM_CN_PLAIN,
-    build_user_prompt_step03_deep_single_q_cn,
-    build_user_prompt_step03_deep_fix_cn,
-)
+from config.ai import get_ai_clients, get_llm_for_model
+from _llm_transport import LLMTransport
 
 from analyze_03_deep import (
     _read_master_rows,
-    _write_master_rows,
     _load_parsed_md,
     _deep_result_is_valid,
-    _repair_to_required_json,
-    _is_true,
-    _load_existing_deep,
-    REQUIRED_Q_KEYS,
-    _normalize_plain_answer,
+    _ask_deep_questions_async,
+    _deep_answers_batch_async,
+    _enable_response_cache,
+    _apply_done,
+    _append_done,
+    _flush_done,
+    _select_deep_todo,
+    _write_deep_payload,
 )
 
-def process_deep_task(
-    row: dict, 
-    args: argparse.Namespace, 
-    llm: Any
-) -> Tuple[str, bool, Optional[Dict[str, Any]]]:
+
+# 已读入的一篇论文：(paperID, parse 文件路径, 标题, 截断后的正文)
+LoadedPaper = Tuple[str, Path, str, str]
+
+
+def load_deep_inputs(
+    rows: List[dict],
+    args: argparse.Namespace
+) -> Tuple[List[LoadedPaper], List[Tuple[str, bool, Any]]]:
     """
-    单个论文的深度分析工作函数
-    返回: (paperID, success_status, result_object_or_error)
+    IO 阶段（在专用 IO 线程池里执行）：读 parse 结果、压缩并截断正文
+    返回: (读入成功的论文, [(paperID, False, 错误信息), ...])
     """
-    pid = (row.get("paperID") or "").strip()
     parse_dir = Path(args.parse_dir)
-    out_dir = Path(args.out_dir)
+    loaded: List[LoadedPaper] = []
+    failed: List[Tuple[str, bool, Any]] = []
+    for row in rows:
+        pid = (row.get("paperID") or "").strip()
+        try:
+            parse_path = parse_dir / f"{pid}.json"
+            if not parse_path.exists():
+                failed.append((pid, False, f"missing parse file: {parse_path}"))
+                continue
+            title, md = _load_parsed_md(parse_path, pid)
+            loaded.append((pid, parse_path, title, md[: args.max_chars]))
+        except Exception as e:
+            failed.append((pid, False, str(e)))
+    return loaded, failed
+
+
+async def process_deep_task(
+    item: LoadedPaper,
+    args: argparse.Namespace,
+    llm: Any,
+    llm_small: Any = None
+) -> Dict[str, Any]:
+    """
+    单个论文的深度分析协程（只含 LLM 请求，读写文件由调用方在 IO 线程池完成）
+    llm_small: 配置了 --router_model_small 时的小模型，正文短于 --small_char_threshold 的论文先交给它
+    返回: deep_obj；失败时抛异常
+    """
+    pid, _parse_path, title, md = item
+
+    # 默认一次请求答完 5 题；--per_question 时逐问题并发请求
+    deep_obj = None
+    if llm_small is not None and len(md) < args.small_char_threshold:
+        try:
+            deep_obj = await _ask_deep_questions_async(
+                llm_small, title, md, per_question=args.per_question, sleep_s=args.sleep
+            )
+        except ValueError as e:
+            # 小模型修正后仍不合格，交给主模型重做
+            print(f"\n[WARN] {pid}: small model output invalid, escalating: {e}")
+    if deep_obj is None:
+        deep_obj = await _ask_deep_questions_async(
+            llm, title, md, per_question=args.per_question, sleep_s=args.sleep
+        )
+
+    if not _deep_result_is_valid(deep_obj):
+        raise ValueError("deep_obj keys invalid after deep analysis")
+    return deep_obj
+
+
+async def process_deep_batch(
+    items: List[LoadedPaper],
+    args: argparse.Namespace,
+    llm: Any,
+    llm_small: Any = None
+) -> List[Tuple[LoadedPaper, Any]]:
+    """
+    多篇论文的深度分析协程：按 --batch_char_budget 把正文总长度分组，每组合并成一次 LLM 请求
+    配置了小模型时短论文与长论文分开装箱：全是短论文的组整组交给 llm_small，
+    其中输出不合格（ValueError）的几篇再合并交给主模型重做；只有一篇的组按 process_deep_task 逐篇分流
+    返回: [(论文, deep_obj 或 Exception), ...]
+    """
+    def _is_short(item: LoadedPaper) -> bool:
+        return llm_small is not None and len(item[3]) < args.small_char_threshold
+
+    # 按字符预算装箱：单篇超预算时自成一组；短/长论文各有一个在装的箱
+    groups: List[List[LoadedPaper]] = []
+    open_box: Dict[bool, int] = {}
+    sizes: List[int] = []
+    for item in items:
+        key = _is_short(item)
+        gi = open_box.get(key)
+        if gi is not None and sizes[gi] + len(item[3]) <= args.batch_char_budget:
+            groups[gi].append(item)
+            sizes[gi] += len(item[3])
+        else:
+            open_box[key] = len(groups)
+            groups.append([item])
+            sizes.append(len(item[3]))
+
+    out: List[Tuple[LoadedPaper, Any]] = []
+    for group in groups:
+        if len(group) == 1:
+            try:
+                out.append((group[0], await process_deep_task(group[0], args, llm, llm_small)))
+            except Exception as e:
+                out.append((group[0], e))
+            continue
+
+        pairs = [(title, md) for _pid, _path, title, md in group]
+        if not _is_short(group[0]):
+            objs = await _deep_answers_batch_async(llm, pairs, sleep_s=args.sleep)
+        else:
+            objs = await _deep_answers_batch_async(llm_small, pairs, sleep_s=args.sleep)
+            bad = [i for i, obj in enumerate(objs) if isinstance(obj, ValueError)]
+            if bad:
+                # 小模型修正后仍不合格，交给主模型重做
+                print(f"\n[WARN] small model output invalid for {len(bad)}/{len(group)} papers, escalating")
+                redo = await _deep_answers_batch_async(llm, [pairs[i] for i in bad], sleep_s=args.sleep)
+                for i, obj in zip(bad, redo):
+                    objs[i] = obj
+        out.extend(zip(group, objs))
+    return out
 
-    try:
-        parse_path = parse_dir / f"{pid}.json"
-        if not parse_path.exists():
-            return pid, False, f"missing parse file: {parse_path}"
-
-        title, md = _load_parsed_md(parse_path, pid)
-        md = md[: args.max_chars]
-
-        # Step 1: 逐问题多次请求（每次只回答 1 个问题）
-        deep_obj: Dict[str, Any] = {}
-        for q in REQUIRED_Q_KEYS:
-            messages = [
-                {"role": "system", "content": SYSTEM_CN_PLAIN},
-                {"role": "user", "content": build_user_prompt_step03_deep_single_q_cn(title, md, q)},
-            ]
-            out_text = llm.chat_text(messages)
-            deep_obj[q] = _normalize_plain_answer(out_text)
-
-            # 每次请求间隔
-            if args.sleep > 0:
-                time.sleep(args.sleep)
-
-        if not _deep_result_is_valid(deep_obj):
-            raise ValueError("deep_obj keys invalid after per-question calls")
-
-        # Step 3: 写入结果文件
-        out_path = out_dir / f"{pid}.json"
-        payload = {
-            "paperID": pid,
-            "title": title,
-            "deep_understanding": deep_obj,
-            "meta": {
-                "parse_path": str(parse_path),
-                "ts": datetime.now().isoformat(timespec="seconds"),
-            },
-        }
-        out_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
-        
-        return pid, True, deep_obj
-
-    except Exception as e:
-        return pid, False, str(e)
 
 def main() -> None:
     ap = argparse.ArgumentParser()
@@ -102,79 +157,145 @@ def main() -> None:
     ap.add_argument("--parse_dir", default="storage/papers/parse")
     ap.add_argument("--out_dir", default="storage/analysis/deep")
     ap.add_argument("--max_chars", type=int, default=20000)
-    ap.add_argument("--sleep", type=float, default=0.1)
-    ap.add_argument("--workers", type=int, default=4, help="并发线程数")
+    ap.add_argument("--sleep", type=float, default=0.0)
+    ap.add_argument("--workers", type=int, default=4, help="同时在途的论文（合并请求时为批次）数")
     ap.add_argument("--limit", type=int, default=0)
+    ap.add_argument("--per_question", action="store_true", help="每个问题单独请求（每篇 5 次并发调用）")
+    ap.add_argument("--cache_dir", default="storage/.llm_cache/deep", help="LLM 请求缓存目录（仅 temperature=0 时生效）")
+    ap.add_argument("--no_cache", action="store_true", help="不读写请求缓存，每篇都重新请求 LLM")
+    ap.add_argument("--rpm", type=float, default=0, help="每分钟 LLM 请求上限（所有并发任务共享），0 表示不限速")
+    ap.add_argument("--llm_retries", type=int, default=4, help="429/5xx/超时等可重试错误的重试次数")
+    ap.add_argument(
+        "--batch_papers",
+        type=int,
+        default=1,
+        help="每次 LLM 请求最多合并的论文篇数；1 表示逐篇请求（--per_question 时恒为 1）",
+    )
+    ap.add_argument("--batch_char_budget", type=int, default=60000, help="合并请求中正文的总字符数上限")
+    ap.add_argument(
+        "--router_model_small",
+        default=os.getenv("LLM_SMALL_MODEL", ""),
+        help="短论文先用的小模型名（同一 provider），输出不合格时再交给主模型；为空表示不分流",
+    )
+    ap.add_argument("--small_char_threshold", type=int, default=5000, help="正文短于该字符数的论文走小模型")
     args = ap.parse_args()
 
     master_csv = Path(args.master_csv)
     rows = _read_master_rows(master_csv)
     if not rows:
-        print(f"[WARN] master csv empty")
+        print("[WARN] master csv empty")
         return
 
     # 1. 筛选待分析任务
     out_dir = Path(args.out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
+    # 上次运行中途退出时，完成日志里的论文先补标，不再重跑
+    recovered = _apply_done(rows, out_dir)
+    if recovered:
+        print(f"[INFO] recovered {recovered} deep_analysis flags from previous run")
     
-    todo_rows = []
-    for r in rows:
-        pid = (r.get("paperID") or "").strip()
-        if not pid: continue
-        # 满足深度分析的前置条件
-        if (_is_true(r.get("base_analysis")) and 
-            _is_true(r.get("relevance")) and 
-            _is_true(r.get("download")) and 
-            not _is_true(r.get("publish"))):
-            
-            # 检查是否已存在有效结果
-            out_path = out_dir / f"{pid}.json"
-            if _is_true(r.get("deep_analysis")) and _load_existing_deep(out_path):
-                continue
-            todo_rows.append(r)
+    todo_rows = _select_deep_todo(rows, out_dir)
 
     if args.limit > 0:
         todo_rows = todo_rows[: args.limit]
 
     if not todo_rows:
+        if recovered:
+            _flush_done(master_csv, rows, out_dir)
         print("[INFO] No papers need deep analysis.")
         return
 
-    # 2. 初始化 AI 客户端 (线程安全)
+    # 2. 初始化 AI 客户端
     _cfg, llm, _ocr = get_ai_clients()
+    cache_dir = None if args.no_cache else args.cache_dir
+    llm = _enable_response_cache(llm, cache_dir)
+    # 限速 + 重试：瞬时的 429/5xx 不再直接让这篇论文失败
+    llm = LLMTransport(llm, rpm=args.rpm, max_retries=args.llm_retries)
+    # 短论文分流到小模型；与主模型共用同一个限速节拍
+    llm_small = None
+    if args.router_model_small:
+        llm_small = LLMTransport(
+            _enable_response_cache(get_llm_for_model(args.router_model_small), cache_dir),
+            max_retries=args.llm_retries,
+        )
+        llm_small.limiter = llm.limiter
 
-    # 3. 并发执行
+    # 3. 并发执行：单线程事件循环上的流水线
+    #    读入（IO 线程池）-> 有界队列 -> --workers 个 LLM 协程 -> 写结果（IO 线程池）
+    #    LLM 协程只等网络，读 parse / 写结果不占它们的并发名额
     print(f"[START] Deep analyzing {len(todo_rows)} papers with {args.workers} workers...")
-    
-    # 用字典存储更新结果，最后统一同步到 rows
-    results_map = {} 
 
-    with ThreadPoolExecutor(max_workers=args.workers) as executor:
-        future_to_pid = {
-            executor.submit(process_deep_task, r, args, llm): r["paperID"] 
-            for r in todo_rows
-        }
+    # 每篇成功后追加到完成日志，master 在结束时统一重写一次
+    done_count = 0
+
+    # 多篇合并请求时按 --batch_papers 分块，每块是一个 LLM 任务
+    batch_papers = 1 if args.per_question else max(1, args.batch_papers)
+    chunks = [todo_rows[i : i + batch_papers] for i in range(0, len(todo_rows), batch_papers)]
+    workers = max(1, args.workers)
+
+    async def runner() -> None:
+        loop = asyncio.get_running_loop()
+        io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="deep-io")
+        queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+        writes: List[asyncio.Task] = []
+        pbar = tqdm(total=len(todo_rows), desc="Deep Analysis")
+
+        def report(pid: str, success: bool, data: Any) -> None:
+            nonlocal done_count
+            if success:
+                _append_done(out_dir, pid)
+                done_count += 1
+            else:
+                print(f"\n[ERR] {pid} failed: {data}")
+            pbar.update(1)
 
-        for future in tqdm(as_completed(future_to_pid), total=len(todo_rows), desc="Deep Analysis"):
-            pid = future_to_pid[future]
+        async def producer() -> None:
+            for chunk in chunks:
+                loaded, failed = await loop.run_in_executor(io_pool, load_deep_inputs, chunk, args)
+                for pid, _ok, err in failed:
+                    report(pid, False, err)
+                if loaded:
+                    await queue.put(loaded)
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def write(item: LoadedPaper, deep_obj: Dict[str, Any]) -> None:
+            pid, parse_path, title, _md = item
             try:
-                res_pid, success, data = future.result()
-                if success:
-                    results_map[res_pid] = "True"
-                else:
-                    print(f"\n[ERR] {res_pid} failed: {data}")
+                await loop.run_in_executor(io_pool, _write_deep_payload, out_dir, pid, title, parse_path, deep_obj)
+                report(pid, True, deep_obj)
             except Exception as e:
-                print(f"\n[CRITICAL] {pid} crash: {e}")
+                report(pid, False, str(e))
 
-    # 4. 更新 Master 数据并保存
-    done_count = 0
-    for r in rows:
-        pid = r.get("paperID")
-        if pid in results_map:
-            r["deep_analysis"] = "True"
-            done_count += 1
+        async def consumer() -> None:
+            while (loaded := await queue.get()) is not None:
+                try:
+                    results = await process_deep_batch(loaded, args, llm, llm_small)
+                except Exception as e:
+                    for item in loaded:
+                        report(item[0], False, f"crash: {e}")
+                    continue
+                for item, obj in results:
+                    if isinstance(obj, Exception):
+                        report(item[0], False, str(obj))
+                    else:
+                        writes.append(asyncio.create_task(write(item, obj)))
 
-    _write_master_rows(master_csv, rows)
+        try:
+            await asyncio.gather(producer(), *(consumer() for _ in range(workers)))
+            await asyncio.gather(*writes)
+        finally:
+            pbar.close()
+            io_pool.shutdown(wait=True)
+            await llm.aclose()
+            if llm_small is not None:
+                await llm_small.aclose()
+
+    try:
+        asyncio.run(runner())
+    finally:
+        # 4. 并入完成日志并原子重写 master（被中断时也执行）
+        _flush_done(master_csv, rows, out_dir)
     print(f"[DONE] Processed {done_count} papers. Master CSV updated.")
 
 if __name__ == "__main__":
@@ -1,32 +1,58 @@
 import os
 import csv
 import argparse
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 
 import yaml
 import arxiv
 
 
-def load_topics(topic_yml: str) -> List[Dict[str, str]]:
-    """topic.yml -> task list: [{topic, subtopic, query}, ...]"""
+@functools.lru_cache(maxsize=4)
+def _load_topics_cached(topic_yml: str, mtime_ns: int) -> Tuple[Tuple[str, str, str], ...]:
+    """按 (路径, mtime) 缓存解析结果：同一进程内重复 run（如按日期回补）不再重读 YAML，文件改动后自动失效"""
     with open(topic_yml, "r", encoding="utf-8") as f:
         data = yaml.load(f, Loader=yaml.SafeLoader)
 
-    tasks: List[Dict[str, str]] = []
+    tasks: List[Tuple[str, str, str]] = []
     for topic, subtopics in (data or {}).items():
         if isinstance(subtopics, dict):
             for subtopic, query in subtopics.items():
-                tasks.append({"topic": str(topic), "subtopic": str(subtopic), "query": str(query)})
+                tasks.append((str(topic), str(subtopic), str(query)))
         else:
             # 兼容旧格式：topic: "query"
-            tasks.append({"topic": str(topic), "subtopic": "default", "query": str(subtopics)})
+            tasks.append((str(topic), "default", str(subtopics)))
+
+    return tuple(tasks)
+
+
+def load_topics(topic_yml: str) -> List[Dict[str, str]]:
+    """topic.yml -> task list: [{topic, subtopic, query}, ...]；每次返回新的 list/dict，调用方可随意修改"""
+    cached = _load_topics_cached(os.path.abspath(topic_yml), os.stat(topic_yml).st_mtime_ns)
+    return [{"topic": t, "subtopic": st, "query": q} for t, st, q in cached]
+
 
-    return tasks
+class _SerialClient(arxiv.Client):
+    """
+    arxiv.Client 靠未加锁的 _last_request_dt 保证请求间隔 delay_seconds，多线程共用时前几个请求会同时发出。
+    这里用锁把每次翻页（间隔等待 + 请求 + 重试）串行化，保证所有线程合起来仍是每 delay_seconds 秒一个请求
+    """
 
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # 重试时 _parse_feed 会递归调用自己，用可重入锁
+        self._page_lock = threading.RLock()
 
-def fetch_arxiv(query: str, max_results: int = 30) -> List[arxiv.Result]:
-    client = arxiv.Client()
+    def _parse_feed(self, url: str, first_page: bool = True, _try_index: int = 0):
+        with self._page_lock:
+            return super()._parse_feed(url, first_page=first_page, _try_index=_try_index)
+
+
+def fetch_arxiv(query: str, max_results: int = 30, client: Optional[arxiv.Client] = None) -> List[arxiv.Result]:
+    client = client or arxiv.Client()
     search = arxiv.Search(
         query=query,
         max_results=max_results,
@@ -41,10 +67,13 @@ def run(
     max_results: int = 30,
     include_extra_fields: bool = True,
     date_str: Optional[str] = None,
+    workers: int = 4,
 ) -> str:
     """
     读取 topic.yml -> 抓取 -> 输出 CSV
     include_extra_fields=True 时，CSV 会额外包含 topic/subtopic/title/url，便于后续去重与分析。
+    workers：并发的 arXiv 查询数；各 subtopic 的查询互不依赖，共用一个 _SerialClient（连接复用 + 请求间隔）。
+    对 arXiv 的请求仍按 delay_seconds 逐个发出（arXiv 要求每 3 秒最多一个请求），并发只让结果转换与等待重叠
     """
     tasks = load_topics(topic_yml)
 
@@ -55,8 +84,12 @@ def run(
     # 用 dict 去重（同一篇可能出现在多个 subtopic），保留首次出现
     rows_by_id: Dict[str, Dict[str, Any]] = {}
 
-    for t in tasks:
-        results = fetch_arxiv(t["query"], max_results=max_results)
+    # 每个查询一页取完；ex.map 按 tasks 顺序返回，"保留首次出现"的去重结果与串行时一致
+    client = _SerialClient(page_size=min(max_results, 2000), delay_seconds=3, num_retries=3)
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tasks) or 1))) as ex:
+        fetched = list(ex.map(lambda t: fetch_arxiv(t["query"], max_results=max_results, client=client), tasks))
+
+    for t, results in zip(tasks, fetched):
         for r in results:
             paper_id = r.get_short_id()            # 你原来用的就是它 :contentReference[oaicite:6]{index=6}
             publish_date = r.published.date().strftime("%Y-%m-%d")  # 你原来用 r.published.date() :contentReference[oaicite:7]{index=7}
@@ -90,12 +123,13 @@ def run(
     return out_path
 
 
-if __name__ == "__main__":
+def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--date", default=None, help="输出文件日期（YYYY-MM-DD），用于与调度器对齐")
     ap.add_argument("--topic_yml", default="config/topic.yml")
     ap.add_argument("--out_dir", default="storage/fetch-arxiv")
     ap.add_argument("--max_results", type=int, default=30)
+    ap.add_argument("--workers", type=int, default=4, help="并发的 arXiv 查询数（请求本身仍每 3 秒一个）")
     args = ap.parse_args()
 
     run(
@@ -103,4 +137,9 @@ if __name__ == "__main__":
         out_dir=args.out_dir,
         max_results=args.max_results,
         date_str=args.date,
+        workers=args.workers,
     )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,57 @@
 import os
-import re
 import csv
 import argparse
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from typing import List, Dict, Any
 
-ID_RE = re.compile(r"^/papers/(?P<id>\d{4}\.\d{5})$")
+# 论文链接形如 /papers/2501.12345：先比长度，再逐段判数字，不走正则
+PAPER_PREFIX = "/papers/"
+PAPER_HREF_LEN = len(PAPER_PREFIX) + len("YYMM.NNNNN")
+
+
+def _arxiv_id_from_href(href: str) -> str:
+    """合法的论文链接返回 arXiv id（不含版本号），否则返回空串"""
+    if len(href) != PAPER_HREF_LEN or not href.startswith(PAPER_PREFIX):
+        return ""
+    aid = href[len(PAPER_PREFIX):]
+    if aid[4] == "." and aid.isascii() and aid[:4].isdigit() and aid[5:].isdigit():
+        return aid
+    return ""
+
+
+def _make_session() -> requests.Session:
+    """
+    模块内共用一个 Session：多次抓取（多个日期/分页）复用到 huggingface.co 的 keep-alive 连接，
+    响应按 gzip 压缩传输；429/5xx 与连接错误交给 urllib3 按指数退避重试
+    """
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10, max_retries=retry)
+    s = requests.Session()
+    s.headers.update({"User-Agent": "paper-daily-bot/0.1", "Accept-Encoding": "gzip, deflate"})
+    s.mount("https://", adapter)
+    return s
+
+
+_SESSION = _make_session()
+
 
 def fetch_hf_daily(date_str: str, timeout: int = 30) -> List[Dict[str, Any]]:
     url = f"https://huggingface.co/papers/date/{date_str}"
-    headers = {"User-Agent": "paper-daily-bot/0.1"}
-    r = requests.get(url, headers=headers, timeout=timeout)
+    r = _SESSION.get(url, timeout=timeout)
     r.raise_for_status()
 
-    soup = BeautifulSoup(r.text, "html.parser")
+    # lxml 的 C 解析器；CSS 前缀选择器只取论文链接，不再遍历页面上的全部 <a>
+    soup = BeautifulSoup(r.text, "lxml")
     items = []
     seen = set()
 
-    for a in soup.find_all("a", href=True):
-        m = ID_RE.match(a["href"])
-        if not m:
-            continue
-        arxiv_id = m.group("id")
-        if arxiv_id in seen:
+    for a in soup.select('a[href^="/papers/"]'):
+        arxiv_id = _arxiv_id_from_href(a["href"])
+        if not arxiv_id or arxiv_id in seen:
             continue
         seen.add(arxiv_id)
 
@@ -52,7 +79,7 @@ def save_csv(items: List[Dict[str, Any]], out_path: str) -> None:
             w.writerow(it)
 
 
-if __name__ == "__main__":
+def main() -> None:
     ap = argparse.ArgumentParser()
     ap.add_argument("--date", default=None, help="抓取日期（YYYY-MM-DD），用于与调度器对齐")
     ap.add_argument("--out_dir", default=os.path.join("storage", "fetch-hf-daily"))
@@ -63,3 +90,7 @@ if __name__ == "__main__":
     out_path = os.path.join(args.out_dir, f"hf_papers_{date_str}.csv")
     save_csv(items, out_path)
     print(f"[OK] {len(items)} items -> {out_path}")
+
+
+if __name__ == "__main__":
+    main()
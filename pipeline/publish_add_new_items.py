@@ -1,16 +1,19 @@
 from __future__ import annotations
 
+import os
 import sys
 import argparse
 import csv
-import json
-import re
-import html
+import io
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
+from email.utils import parsedate_to_datetime
+from functools import partial
 from pathlib import Path
-from typing import Dict, Any, List, Tuple
-from xml.etree import ElementTree as ET
-from xml.dom import minidom
+from typing import Dict, Any, List, Optional, Tuple
+import orjson
+import pandas as pd
+from lxml import etree as ET
 
 
 # 允许把该文件当脚本运行：确保项目根目录在 sys.path 中
@@ -32,33 +35,58 @@ MASTER_FIELDS = [
 
 TZ_OFFSET = timezone(timedelta(hours=8))  # 东八区
 
+# lxml（libxml2）解析/序列化 RSS；保留已有条目 <description> 的 CDATA
+_RSS_PARSER = ET.XMLParser(strip_cdata=False)
+
 
 def _is_true(v: str) -> bool:
     return (v or "").strip().lower() == "true"
 
 
+# 删除 C0 控制字符与 DEL：str.translate 的映射表在模块加载时建好，逐字符替换在 C 里完成
+_CTRL_TRANS = dict.fromkeys(list(range(0x00, 0x20)) + [0x7F])
+
+
 def _clean_string(x: Any) -> str:
     if x is None:
         return ""
-    if not isinstance(x, (str, bytes)):
-        x = str(x)
-    return re.sub(r"[\x00-\x1F\x7F]", "", x)
+    return (x if isinstance(x, str) else str(x)).translate(_CTRL_TRANS)
+
+
+# 写进描述 HTML 的文本：删控制字符与 html.escape(quote=True) 的五个实体替换合成一张表，一次 translate 完成
+_CLEAN_ESC_TRANS = {
+    **_CTRL_TRANS,
+    ord("&"): "&amp;",
+    ord("<"): "&lt;",
+    ord(">"): "&gt;",
+    ord('"'): "&quot;",
+    ord("'"): "&#x27;",
+}
+
+
+def _clean_escape(x: Any) -> str:
+    if x is None:
+        return ""
+    return (x if isinstance(x, str) else str(x)).translate(_CLEAN_ESC_TRANS)
 
 
 def _read_master_rows(master_csv: Path) -> List[dict]:
     if not master_csv.exists():
         return []
-    with master_csv.open("r", encoding="utf-8", newline="") as f:
-        return list(csv.DictReader(f))
+    # C 解析器一次读完整表；全部按字符串读、空单元格保持 ""，结果与 csv.DictReader 一致
+    try:
+        df = pd.read_csv(master_csv, dtype=str, keep_default_na=False, encoding="utf-8")
+    except pd.errors.EmptyDataError:
+        return []
+    return df.to_dict("records")
 
 
 def _write_master_rows(master_csv: Path, rows: List[dict]) -> None:
-    master_csv.parent.mkdir(parents=True, exist_ok=True)
+    # rows 读自 master_csv，目录必然已存在；按 MASTER_FIELDS 顺序一次性生成元组，交给 csv.writer 批量写出
     with master_csv.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=MASTER_FIELDS)
-        w.writeheader()
-        for r in rows:
-            w.writerow({k: (r.get(k, "") or "") for k in MASTER_FIELDS})
+        w = csv.writer(f)
+        w.writerow(MASTER_FIELDS)
+        w.writerows([tuple(r.get(k) or "" for k in MASTER_FIELDS) for r in rows])
 
 
 def _rfc2822(dt: datetime) -> str:
@@ -79,32 +107,34 @@ def _load_or_init_rss(
     feed_link: str,
     feed_description: str,
     run_dt: datetime,
-) -> Tuple[ET.ElementTree, ET.Element, set]:
+) -> Tuple[ET.ElementTree, ET.Element, Dict[str, ET.Element], int]:
     """
-    返回：(tree, channel, existing_ids)
-    existing_ids 用 <guid> 文本判重。
+    返回：(tree, channel, existing_items, insert_pos)
+    existing_items：<guid> 文本 -> 对应的 <item>，加载时遍历一次建好，之后判重与原地更新都是 O(1)
+    insert_pos：第一个 <item> 的下标（没有条目时为 metadata 之后），新条目都插在这里
     """
-    existing_ids: set = set()
+    existing_items: Dict[str, ET.Element] = {}
 
     if rss_path.exists():
-        tree = ET.parse(str(rss_path))
+        tree = ET.parse(str(rss_path), _RSS_PARSER)
         channel = _get_or_create_channel(tree)
-        for item in channel.findall("item"):
-            guid = item.findtext("guid") or ""
+        for item in channel.iterfind("item"):
+            guid = (item.findtext("guid") or "").strip()
             if guid:
-                existing_ids.add(guid.strip())
-        return tree, channel, existing_ids
+                existing_items.setdefault(guid, item)
+        insert_pos = next((i for i, child in enumerate(channel) if child.tag == "item"), len(channel))
+        return tree, channel, existing_items, insert_pos
 
     # 初始化最小 RSS 2.0
     rss = ET.Element("rss", version="2.0")
     channel = ET.SubElement(rss, "channel")
     ET.SubElement(channel, "title").text = feed_title
     ET.SubElement(channel, "link").text = feed_link
-    ET.SubElement(channel, "description").text = feed_description
+    ET.SubElement(channel, "description").text = _cdata(feed_description)
     ET.SubElement(channel, "language").text = "zh-CN"
     ET.SubElement(channel, "lastBuildDate").text = _rfc2822(run_dt)
     tree = ET.ElementTree(rss)
-    return tree, channel, existing_ids
+    return tree, channel, existing_items, len(channel)
 
 
 def _set_last_build_date(channel: ET.Element, run_dt: datetime) -> None:
@@ -114,15 +144,112 @@ def _set_last_build_date(channel: ET.Element, run_dt: datetime) -> None:
     node.text = _rfc2822(run_dt)
 
 
+def _cdata(text: str) -> Any:
+    """<description> 的内容写成 CDATA，让 RSS 阅读器按 HTML 渲染；含 "]]>" 时只能退回普通转义文本"""
+    text = text or ""
+    return text if "]]>" in text else ET.CDATA(text)
+
+
+# orjson 直接解析 UTF-8 字节，省去 read_text 的解码和 stdlib json 的纯 Python 开销
 def _load_base_json(base_path: Path) -> Dict[str, Any]:
-    return json.loads(base_path.read_text(encoding="utf-8"))
+    return orjson.loads(base_path.read_bytes())
 
 
 def _load_deep_json(deep_path: Path) -> Dict[str, Any]:
-    return json.loads(deep_path.read_text(encoding="utf-8"))
+    return orjson.loads(deep_path.read_bytes())
+
+
+def _paper_entry(pid: str, base: Dict[str, Any], deep: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    从 base/deep JSON 取出发布用到的全部字段（纯 str/bool，可直接存进描述缓存）
+    description 不含“相关”标记：它还取决于 master 的 relevance，发布时再拼
+    """
+    fetched = base.get("fetched") or {}
+    analysis = base.get("analysis") or {}
+    # 作者串只在这里拼一次并随条目进入描述缓存，_add_item 与之后的重复发布直接用 entry["author"]
+    authors = fetched.get("authors") or []
+    if isinstance(authors, list):
+        author_text = _clean_string(", ".join(map(str, authors)))
+    else:
+        author_text = _clean_string(authors)
+    deep_understanding = deep.get("deep_understanding") or {}
+    return {
+        "title": _clean_string(fetched.get("title") or pid),
+        "link": _clean_string(fetched.get("arxiv_url") or fetched.get("pdf_url") or ""),
+        "author": author_text,
+        "base_is_relevant": bool(analysis.get("is_relevant")) if isinstance(analysis, dict) else False,
+        "has_deep": isinstance(deep_understanding, dict) and bool(deep_understanding),
+        "description": _build_description_html(base, deep),
+    }
+
+
+def _load_paper_entry(
+    base_dir: Path, deep_dir: Path, desc_cache: Dict[str, Dict[str, Any]], pid: str
+) -> Optional[Dict[str, Any]]:
+    """
+    取一篇论文的发布字段：base/deep 的 mtime 与缓存里记录的一致时直接复用，不再解析 JSON、拼 HTML
+    base 不存在时返回 None（跳过），deep 不存在时视为没有深度解读
+    """
+    base_path = base_dir / f"{pid}.json"
+    deep_path = deep_dir / f"{pid}.json"
+    try:
+        base_mtime = base_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    try:
+        deep_mtime = deep_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        deep_mtime = 0
+    stamp = [base_mtime, deep_mtime]
+
+    cached = desc_cache.get(pid)
+    if cached is not None and cached.get("stamp") == stamp:
+        return cached
+
+    try:
+        base = _load_base_json(base_path)
+    except FileNotFoundError:
+        return None
+    try:
+        deep = _load_deep_json(deep_path)
+    except FileNotFoundError:
+        deep = {}
+    entry = _paper_entry(pid, base, deep)
+    entry["stamp"] = stamp
+    return entry
+
+
+def _load_desc_cache(path: Path) -> Dict[str, Dict[str, Any]]:
+    try:
+        data = orjson.loads(path.read_bytes())
+    except (FileNotFoundError, orjson.JSONDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _save_desc_cache(
+    path: Path,
+    desc_cache: Dict[str, Dict[str, Any]],
+    loaded: Dict[str, Dict[str, Any]],
+    rows: List[dict],
+) -> None:
+    """
+    并入本次读到的条目后只保留 master 里仍未发布的论文：已发布的不会再进 todo，留着只会让文件越长越大
+    内容没变时不重写；先写临时文件再替换，中途退出不会留下半个缓存
+    """
+    pending = {
+        (r.get("paperID") or "").strip() for r in rows if not _is_true(r.get("publish", ""))
+    }
+    kept = {pid: e for pid, e in {**desc_cache, **loaded}.items() if pid in pending}
+    if kept == desc_cache:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_bytes(orjson.dumps(kept))
+    os.replace(tmp, path)
 
 
-def _build_description_html(base: Dict[str, Any], deep: Dict[str, Any], is_relevant: bool) -> str:
+def _build_description_html(base: Dict[str, Any], deep: Dict[str, Any]) -> str:
     fetched = base.get("fetched") or {}
     analysis = base.get("analysis") or {}
     gpt_summary = (analysis.get("gpt_summary") or {}) if isinstance(analysis, dict) else {}
@@ -130,77 +257,84 @@ def _build_description_html(base: Dict[str, Any], deep: Dict[str, Any], is_relev
     title = _clean_string(fetched.get("title"))
     arxiv_url = _clean_string(fetched.get("arxiv_url") or fetched.get("pdf_url"))
     published = _clean_string(fetched.get("published"))
-    abstract = _clean_string(fetched.get("abstract"))
+    abstract = _clean_escape(fetched.get("abstract"))
 
     deep_understanding = deep.get("deep_understanding") or {}
     has_deep = isinstance(deep_understanding, dict) and bool(deep_understanding)
 
-    parts: list[str] = []
+    # 片段直接写进 C 实现的缓冲区，每段以换行结尾，返回时去掉最后一个换行（与按 "\n" 拼接一致）
+    buf = io.StringIO()
+    w = buf.write
 
-    # 对“已做深度解读且与研究主题相关”的条目加醒目标记
-    if has_deep and is_relevant:
-        parts.append("<p>⭐ 与研究主题相关</p>")
     # GPT 基础摘要
     if isinstance(gpt_summary, dict) and gpt_summary:
-        parts.append("<h3>GPT 基础摘要</h3>")
+        w("<h3>GPT 基础摘要</h3>\n")
         for k, v in gpt_summary.items():
-            parts.append(
-                f"<p><strong>{html.escape(_clean_string(k))}:</strong> {html.escape(_clean_string(v))}</p>"
-            )
+            w(f"<p><strong>{_clean_escape(k)}:</strong> {_clean_escape(v)}</p>\n")
 
     # 深度解读
     if has_deep:
-        parts.append("<h3>深度解读</h3>")
+        w("<h3>深度解读</h3>\n")
         for k, v in deep_understanding.items():
-            parts.append(
-                f"<p><strong>{html.escape(_clean_string(k))}:</strong> {html.escape(_clean_string(v))}</p>"
-            )
+            w(f"<p><strong>{_clean_escape(k)}:</strong> {_clean_escape(v)}</p>\n")
 
     if abstract:
-        parts.append("<h3>Abstract</h3>")
-        parts.append(f"<p>{html.escape(abstract)}</p>")
+        w("<h3>Abstract</h3>\n")
+        w(f"<p>{abstract}</p>\n")
+
+    return buf.getvalue()[:-1]
+
+
+_RELEVANT_MARK = "<p>⭐ 与研究主题相关</p>"
 
-    return "\n".join(parts)
+
+def _with_relevant_mark(entry: Dict[str, Any], is_relevant: bool) -> str:
+    # 对“已做深度解读且与研究主题相关”的条目加醒目标记
+    desc = entry["description"]
+    if not (entry["has_deep"] and is_relevant):
+        return desc
+    return f"{_RELEVANT_MARK}\n{desc}" if desc else _RELEVANT_MARK
 
 
 def _add_item(
     channel: ET.Element,
     paper_id: str,
-    base: Dict[str, Any],
-    deep: Dict[str, Any],
+    entry: Dict[str, Any],
     run_dt: datetime,
     is_relevant: bool,
-) -> None:
-    fetched = base.get("fetched") or {}
-    title = _clean_string(fetched.get("title") or paper_id)
-    link = _clean_string(fetched.get("arxiv_url") or fetched.get("pdf_url") or "")
-    authors = fetched.get("authors") or []
-    if isinstance(authors, list):
-        author_text = _clean_string(", ".join([str(a) for a in authors]))
-    else:
-        author_text = _clean_string(authors)
+    existing_items: Dict[str, ET.Element],
+    insert_pos: int,
+) -> bool:
+    """
+    新论文插到 channel 开头（insert_pos，紧跟在 metadata 后面）；feed 里已有同 guid 的条目（如上次写完 RSS 后没来得及更新 master）
+    则原地更新它的 description 与 pubDate，不重复插入。返回是否新插入
+    entry：_load_paper_entry 的结果
+    """
+    desc = _with_relevant_mark(entry, is_relevant)
+
+    old = existing_items.get(paper_id)
+    if old is not None:
+        for tag, text in (("description", _cdata(desc)), ("pubDate", _rfc2822(run_dt))):
+            node = old.find(tag)
+            if node is None:
+                node = ET.SubElement(old, tag)
+            node.text = text
+        return False
 
     item = ET.Element("item")
     ET.SubElement(item, "guid").text = paper_id
-    ET.SubElement(item, "title").text = title
-    if link:
-        ET.SubElement(item, "link").text = link
-    if author_text:
-        ET.SubElement(item, "author").text = author_text
+    ET.SubElement(item, "title").text = entry["title"]
+    if entry["link"]:
+        ET.SubElement(item, "link").text = entry["link"]
+    if entry["author"]:
+        ET.SubElement(item, "author").text = entry["author"]
     ET.SubElement(item, "pubDate").text = _rfc2822(run_dt)
+    ET.SubElement(item, "description").text = _cdata(desc)
 
-    # 先写成普通文本（ElementTree 会自动转义）；最终写文件前会统一改成 CDATA
-    desc = _build_description_html(base, deep, is_relevant=is_relevant)
-    ET.SubElement(item, "description").text = desc
-
-    # 插入到 channel 开头（紧跟在 metadata 后面）
-    insert_pos = 0
-    for i, child in enumerate(list(channel)):
-        if child.tag == "item":
-            insert_pos = i
-            break
-        insert_pos = i + 1
+    # 插入位置固定：后插入的条目排在前面，metadata 不受影响
     channel.insert(insert_pos, item)
+    existing_items[paper_id] = item
+    return True
 
 
 def main() -> None:
@@ -215,6 +349,12 @@ def main() -> None:
     ap.add_argument("--run_pubdate", default=None, help="统一发布时间（RFC2822），用于与调度器对齐")
     ap.add_argument("--limit", type=int, default=0, help="0 表示不限制；否则只发布前 N 篇")
     ap.add_argument("--dry_run", action="store_true")
+    ap.add_argument("--workers", type=int, default=16, help="并发读取 base/deep JSON 的线程数")
+    ap.add_argument(
+        "--desc_cache",
+        default="storage/analysis/.desc_cache.json",
+        help="按 base/deep 的 mtime 缓存待发布论文已构建的条目字段（--dry_run 也写入）；为空表示不使用缓存",
+    )
     args = ap.parse_args()
 
     master_csv = Path(args.master_csv)
@@ -242,12 +382,19 @@ def main() -> None:
     if args.limit and args.limit > 0:
         todo = todo[: args.limit]
 
+    # 没有待发布的论文且 feed 已存在：RSS 与 master 都不会变，不解析也不重写
+    if not todo and rss_path.exists():
+        print("[DONE] no new items ; rss and master unchanged")
+        return
+
     run_dt = datetime.now(TZ_OFFSET)
     if args.run_pubdate:
         # 例如：Wed, 31 Dec 2025 18:52:08 +0800
-        run_dt = datetime.strptime(args.run_pubdate.strip(), "%a, %d %b %Y %H:%M:%S %z")
+        run_dt = parsedate_to_datetime(args.run_pubdate.strip())
+        if run_dt.tzinfo is None:
+            run_dt = run_dt.replace(tzinfo=timezone.utc)
 
-    tree, channel, existing_ids = _load_or_init_rss(
+    tree, channel, existing_items, insert_pos = _load_or_init_rss(
         rss_path,
         feed_title=args.feed_title,
         feed_link=args.feed_link,
@@ -255,69 +402,70 @@ def main() -> None:
         run_dt=run_dt,
     )
 
-    will_publish = []
+    # 每篇只打开、解析一次 base/deep JSON（缓存命中时不解析），dry_run 与正式发布共用同一份结果
+    # 读文件是 IO 密集：线程池并发读，结果按 todo 顺序收集（RSS 顺序不变）
+    desc_cache_path = Path(args.desc_cache) if args.desc_cache else None
+    desc_cache = _load_desc_cache(desc_cache_path) if desc_cache_path else {}
+    first_rows: Dict[str, dict] = {}
     for r in todo:
         pid = (r.get("paperID") or "").strip()
-        if not pid or pid in existing_ids:
-            continue
-        base_path = base_dir / f"{pid}.json"
-        if not base_path.exists():
-            continue
-        will_publish.append(pid)
+        if pid:
+            first_rows.setdefault(pid, r)
+
+    publishable: Dict[str, Tuple[dict, Dict[str, Any]]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as ex:
+        loaded = ex.map(partial(_load_paper_entry, base_dir, deep_dir, desc_cache), first_rows)
+        for (pid, r), entry in zip(first_rows.items(), loaded):
+            if entry is not None:
+                publishable[pid] = (r, entry)
 
     if args.dry_run:
-        print(f"[DRY_RUN] will_publish={len(will_publish)}")
-        for pid in will_publish[:50]:
-            print("-", pid)
+        # dry_run 读到的条目留给随后的正式发布复用
+        if desc_cache_path:
+            _save_desc_cache(desc_cache_path, desc_cache, {pid: e for pid, (_r, e) in publishable.items()}, rows)
+        n_update = sum(1 for pid in publishable if pid in existing_items)
+        print(f"[DRY_RUN] will_publish={len(publishable) - n_update} ; will_update={n_update}")
+        for pid in list(publishable)[:50]:
+            print("-", pid + (" (update)" if pid in existing_items else ""))
         return
 
-    published_n = 0
-    for r in todo:
-        pid = (r.get("paperID") or "").strip()
-        if not pid or pid in existing_ids:
-            continue
-
-        base_path = base_dir / f"{pid}.json"
-        deep_path = deep_dir / f"{pid}.json"
-        if not base_path.exists():
-            continue
-
-        base = _load_base_json(base_path)
-        deep: Dict[str, Any] = {}
-        if deep_path.exists():
-            deep = _load_deep_json(deep_path)
-
-        analysis = base.get("analysis") or {}
-        base_is_relevant = bool(analysis.get("is_relevant")) if isinstance(analysis, dict) else False
-        row_is_relevant = _is_true(r.get("relevance", ""))
-        is_relevant = row_is_relevant or base_is_relevant
-
-        _add_item(channel, pid, base, deep, run_dt=run_dt, is_relevant=is_relevant)
-        existing_ids.add(pid)
+    # 对应的 base JSON 都不存在时同样没有可写的内容；feed 不存在时仍照常初始化
+    if not publishable and rss_path.exists():
+        print("[DONE] no new items ; rss and master unchanged")
+        return
 
+    published_n = 0
+    updated_n = 0
+    for pid, (r, entry) in publishable.items():
+        is_relevant = _is_true(r.get("relevance", "")) or entry["base_is_relevant"]
+
+        if _add_item(
+            channel,
+            pid,
+            entry,
+            run_dt=run_dt,
+            is_relevant=is_relevant,
+            existing_items=existing_items,
+            insert_pos=insert_pos,
+        ):
+            published_n += 1
+        else:
+            updated_n += 1
         r["publish"] = "True"
-        published_n += 1
 
     _set_last_build_date(channel, run_dt=run_dt)
     rss_path.parent.mkdir(parents=True, exist_ok=True)
-    # 写出时把每个 <description> 包成 CDATA，让 RSS 阅读器按 HTML 渲染
-    xml_bytes = ET.tostring(tree.getroot(), encoding="utf-8")
-    dom = minidom.parseString(xml_bytes)
-    for node in dom.getElementsByTagName("description"):
-        # 取当前文本内容（minidom 会把 &lt;h2&gt; 还原成 <h2>）
-        txt = ""
-        if node.firstChild is not None and node.firstChild.nodeType == node.firstChild.TEXT_NODE:
-            txt = node.firstChild.data
-            node.removeChild(node.firstChild)
-        node.appendChild(dom.createCDATASection(txt))
-
-    rss_path.parent.mkdir(parents=True, exist_ok=True)
-    with rss_path.open("wb") as f:
-        f.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
-        f.write(dom.documentElement.toxml(encoding="utf-8"))
+    rss_path.write_bytes(ET.tostring(tree, encoding="utf-8", xml_declaration=True))
 
     _write_master_rows(master_csv, rows)
-    print(f"[DONE] rss_updated={rss_path} ; published={published_n} ; master_updated={master_csv}")
+
+    if desc_cache_path:
+        # 本次发布的论文已标 publish=True，会从缓存里剔除；留下的是 --limit 之外或 dry_run 读过的待发布论文
+        _save_desc_cache(desc_cache_path, desc_cache, {}, rows)
+
+    print(
+        f"[DONE] rss_updated={rss_path} ; published={published_n} ; updated={updated_n} ; master_updated={master_csv}"
+    )
 
 
 if __name__ == "__main__":
@@ -3,10 +3,12 @@ from __future__ import annotations
 import sys
 import argparse
 from datetime import datetime, timezone, timedelta
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from xml.etree import ElementTree as ET
 from typing import Optional
 
+from lxml import etree as ET
+
 
 # 允许把该文件当脚本运行：确保项目根目录在 sys.path 中
 _ROOT = Path(__file__).resolve().parents[1]
@@ -14,18 +16,24 @@ if str(_ROOT) not in sys.path:
     sys.path.insert(0, str(_ROOT))
 
 
+# RSS 里 pubDate 的格式（RFC822），例如：Sat, 09 Nov 2024 00:26:14 +0800；只用于写 lastBuildDate
+PUBDATE_FMT = "%a, %d %b %Y %H:%M:%S %z"
+
+
 def _parse_pubdate(s: str) -> Optional[datetime]:
     """
     解析 RSS 里的 pubDate（RFC822）：
     例如：Sat, 09 Nov 2024 00:26:14 +0800
+    用标准库的 RFC 2822 解析器，不经过 strptime 的格式串与 locale（非英文 locale 下 %a/%b 会失败）
     """
     if not s:
         return None
-    s = s.strip()
     try:
-        return datetime.strptime(s, "%a, %d %b %Y %H:%M:%S %z")
-    except Exception:
+        dt = parsedate_to_datetime(s.strip())
+    except (TypeError, ValueError):
         return None
+    # "-0000" 表示时区未知，按 UTC 处理（与 strptime 的 %z 一致）
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
 
 
 def main() -> None:
@@ -40,36 +48,33 @@ def main() -> None:
         print("[DONE] rss file not found, skip")
         return
 
-    tree = ET.parse(str(rss_path))
-    root = tree.getroot()
-    channel = root.find("channel")
-    if channel is None:
-        print("[DONE] invalid rss: missing channel")
-        return
-
     now_dt = datetime.now(timezone.utc)
     if args.now:
-        now_dt = datetime.strptime(args.now.strip(), "%a, %d %b %Y %H:%M:%S %z").astimezone(timezone.utc)
+        now_dt = parsedate_to_datetime(args.now.strip()).astimezone(timezone.utc)
 
     time_limit = now_dt - timedelta(days=args.days)
 
-    items = list(channel.findall("item"))
+    # lxml（libxml2）解析整个文件；strip_cdata=False 让重写后的 <description> 仍是 CDATA
+    tree = ET.parse(str(rss_path), ET.XMLParser(strip_cdata=False))
+    channel = tree.getroot().find("channel")
+    if channel is None:
+        print("[DONE] invalid rss: missing channel")
+        return
+
     removed = 0
-    for item in items:
-        pub = item.findtext("pubDate") or ""
-        dt = _parse_pubdate(pub)
-        if dt is None:
-            continue
-        if dt.astimezone(timezone.utc) < time_limit:
+    for item in channel.findall("item"):
+        dt = _parse_pubdate(item.findtext("pubDate") or "")
+        # 解析不了的日期保留
+        if dt is not None and dt < time_limit:
             channel.remove(item)
             removed += 1
 
     # 更新 lastBuildDate
     last = channel.find("lastBuildDate")
     if last is not None:
-        last.text = now_dt.astimezone(timezone(timedelta(hours=8))).strftime("%a, %d %b %Y %H:%M:%S %z")
+        last.text = now_dt.astimezone(timezone(timedelta(hours=8))).strftime(PUBDATE_FMT)
 
-    tree.write(str(rss_path), encoding="utf-8", xml_declaration=True)
+    rss_path.write_bytes(ET.tostring(tree, encoding="utf-8", xml_declaration=True))
     print(f"[DONE] removed={removed} ; rss_updated={rss_path}")
 
 
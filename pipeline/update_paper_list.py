@@ -1,8 +1,9 @@
-import csv
 import argparse
 from pathlib import Path
 from datetime import datetime
 
+import pandas as pd
+
 
 MASTER_FIELDS = [
     "paperID",
@@ -26,38 +27,41 @@ def join_sources(ss: set) -> str:
     return ";".join(sorted(ss))
 
 
-def read_csv(path: Path) -> list[dict]:
+def read_df(path: Path) -> pd.DataFrame:
+    """C 解析器一次读完整表；全部按字符串读、空单元格保持 ""（与 csv.DictReader 一致）"""
     if not path.exists():
-        return []
-    with path.open("r", encoding="utf-8", newline="") as f:
-        return list(csv.DictReader(f))
+        return pd.DataFrame()
+    try:
+        return pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8")
+    except pd.errors.EmptyDataError:
+        return pd.DataFrame()
 
 
-def load_master(master_path: Path) -> dict[str, dict]:
-    master: dict[str, dict] = {}
-    for r in read_csv(master_path):
-        pid = (r.get("paperID") or "").strip()
-        if not pid:
-            continue
-
-        # 兼容旧字段名：analysis -> base_analysis
-        base_analysis = (r.get("base_analysis") or r.get("analysis") or DEFAULT_FALSE).strip() or DEFAULT_FALSE
-        deep_analysis = (r.get("deep_analysis") or DEFAULT_FALSE).strip() or DEFAULT_FALSE
-        download = (r.get("download") or DEFAULT_FALSE).strip() or DEFAULT_FALSE
-        publish = (r.get("publish") or DEFAULT_FALSE).strip() or DEFAULT_FALSE
-        relevance = (r.get("relevance") or DEFAULT_FALSE).strip() or DEFAULT_FALSE
+def read_csv(path: Path) -> list[dict]:
+    return read_df(path).to_dict("records")
 
-        master[pid] = {
-            "paperID": pid,
-            "sources": (r.get("sources") or "").strip(),
-            "createDate": (r.get("createDate") or "").strip(),
-            "base_analysis": base_analysis,
-            "relevance": relevance,
-            "download": download,
-            "deep_analysis": deep_analysis,
-            "publish": publish,
-        }
-    return master
+
+def load_master(master_path: Path) -> dict[str, dict]:
+    df = read_df(master_path)
+    if df.empty:
+        return {}
+    for k in MASTER_FIELDS + ["analysis"]:
+        if k not in df.columns:
+            df[k] = ""
+
+    # 各列整列去空白、补默认值，不再逐行逐格处理
+    df["paperID"] = df["paperID"].str.strip()
+    df = df[df["paperID"] != ""].copy()
+    # 兼容旧字段名：analysis -> base_analysis
+    df["base_analysis"] = df["base_analysis"].where(df["base_analysis"] != "", df["analysis"])
+    for k in ("base_analysis", "relevance", "download", "deep_analysis", "publish"):
+        df[k] = df[k].str.strip().replace("", DEFAULT_FALSE)
+    for k in ("sources", "createDate"):
+        df[k] = df[k].str.strip()
+
+    # paperID 重复时后出现的行覆盖前面的
+    df = df.drop_duplicates("paperID", keep="last")
+    return df.set_index("paperID", drop=False)[MASTER_FIELDS].to_dict("index")
 
 
 def upsert(master: dict[str, dict], pid: str, source: str, today: str):
@@ -85,13 +89,9 @@ def upsert(master: dict[str, dict], pid: str, source: str, today: str):
 
 def write_master(master_path: Path, master: dict[str, dict]):
     master_path.parent.mkdir(parents=True, exist_ok=True)
-    items = [master[k] for k in sorted(master.keys(), reverse=True)]
-
-    with master_path.open("w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=MASTER_FIELDS)
-        w.writeheader()
-        for row in items:
-            w.writerow({k: row.get(k, "") for k in MASTER_FIELDS})
+    # 整表交给 pandas 的 C 写出器；按 paperID 倒序，缺失字段写空串，行尾与 csv.DictWriter 一致
+    df = pd.DataFrame.from_dict(master, orient="index").reindex(columns=MASTER_FIELDS)
+    df.sort_index(ascending=False).to_csv(master_path, index=False, encoding="utf-8", lineterminator="\r\n")
 
 
 def main():
@@ -1,14 +1,17 @@
 from __future__ import annotations
 
 import argparse
+import contextlib
+import importlib
 import os
 import subprocess
 import sys
 import time
+import traceback
 from dataclasses import dataclass
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
-from typing import List, TextIO
+from typing import Iterator, List, TextIO
 
 
 @dataclass(frozen=True)
@@ -16,7 +19,6 @@ class ScheduleConfig:
     # 周一=1 ... 周日=7
     weekdays: set[int] = frozenset({1, 2, 3, 4, 5, 6})
     hhmm: str = "14:01"
-    poll_seconds: int = 10
 
 TZ_OFFSET = timezone(timedelta(hours=8))  # 与 RSS 一致
 
@@ -45,6 +47,48 @@ def _run_cmd(cmd: List[str], cwd: Path, logf: TextIO) -> None:
         raise RuntimeError(f"command failed (exit={p.returncode}): {' '.join(cmd)}")
 
 
+@contextlib.contextmanager
+def _patched_argv(argv: List[str]) -> Iterator[None]:
+    old = sys.argv
+    sys.argv = argv
+    try:
+        yield
+    finally:
+        sys.argv = old
+
+
+def _run_module(cmd: List[str], cwd: Path, logf: TextIO) -> None:
+    """
+    在当前进程内执行 pipeline 脚本的 main()：省掉每步重启解释器、重新 import 依赖的开销
+    脚本之间按模块名互相 import（如 from _parse_common import ...），所以按顶层模块导入 pipeline 目录下的文件
+    stdout/stderr 重定向到日志；异常与非零退出码按子进程失败同样处理
+    """
+    script = Path(cmd[0])
+    print(f"\n[RUN] {' '.join(cmd)}")
+    logf.write(f"\n[RUN] {datetime.now().isoformat(timespec='seconds')} {' '.join(cmd)}\n")
+    logf.flush()
+
+    pipeline_dir = str(script.parent)
+    if pipeline_dir not in sys.path:
+        sys.path.insert(0, pipeline_dir)
+    os.chdir(cwd)
+
+    code: object = 0
+    try:
+        with contextlib.redirect_stdout(logf), contextlib.redirect_stderr(logf), _patched_argv(cmd):
+            try:
+                importlib.import_module(script.stem).main()
+            except SystemExit as e:
+                code = e.code
+            except Exception:
+                traceback.print_exc()
+                code = 1
+    finally:
+        logf.flush()
+    if code not in (0, None):
+        raise RuntimeError(f"command failed (exit={code}): {' '.join(cmd)}")
+
+
 def _today_key(now: datetime) -> str:
     return now.strftime("%Y-%m-%d")
 
@@ -55,9 +99,29 @@ def _lock_path(root: Path) -> Path:
 
 
 def _state_path(root: Path) -> Path:
-    # 记录最近一次成功触发日期，避免在 14:01 这一分钟内重复触发
+    # 记录最近一次成功触发日期，避免同一天重复触发（如调度器重启）
     return root / "storage" / ".run_daily.last_run"
 
+def _next_scheduled_dt(now: datetime, cfg: ScheduleConfig) -> datetime:
+    """严格晚于 now 的下一个触发时刻（now 为东八区时间）"""
+    hh, mm = (int(x) for x in cfg.hhmm.split(":"))
+    candidate = now.replace(hour=hh, minute=mm, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    # 最多往后找一周
+    for _ in range(7):
+        if candidate.isoweekday() in cfg.weekdays:
+            return candidate
+        candidate += timedelta(days=1)
+    raise ValueError(f"no valid weekday in {sorted(cfg.weekdays)}")
+
+
+def _sleep_until(target: datetime) -> None:
+    # sleep 可能被信号提前唤醒：醒来后按剩余时间继续睡
+    while (delay := (target - datetime.now(TZ_OFFSET)).total_seconds()) > 0:
+        time.sleep(delay)
+
+
 def _logs_dir(root: Path) -> Path:
     return root / "storage" / "logs"
 
@@ -99,7 +163,7 @@ def _write_last_run(state_file: Path, date_str: str) -> None:
     state_file.write_text(date_str, encoding="utf-8")
 
 
-def run_pipeline_once(root: Path) -> None:
+def run_pipeline_once(root: Path, in_process: bool = False) -> None:
     """
     按顺序执行你当前工程的每日流程脚本：
     1) 抓取 arXiv/hf
@@ -109,6 +173,10 @@ def run_pipeline_once(root: Path) -> None:
     5) 深度解读
     6) 发布 RSS 新条目
     7) 清理 RSS 旧条目
+
+    in_process=True 时在当前进程内调用各脚本的 main()，只用于 --once：
+    常驻调度器里模块会一直留在 sys.modules，lru_cache 的 AI 配置/客户端、模块级 Session、
+    限速器状态都会被下一天沿用，.env/config 的修改也不会生效，所以调度模式每步仍起子进程
     """
     # 统一的“当日时间戳/日期”：一次触发内所有脚本都用它，避免前后不一致
     run_dt = datetime.now(TZ_OFFSET)
@@ -151,9 +219,11 @@ def run_pipeline_once(root: Path) -> None:
         logf.flush()
 
         for cmd_parts, _name in scripts:
-            # 如果 cmd_parts 以 bash 开头，就按 bash 执行；否则默认用 python 执行
+            # 如果 cmd_parts 以 bash 开头，就按 bash 执行；否则用 python 执行（in_process 时在当前进程内调用 main()）
             if str(cmd_parts[0]) == "bash":
                 _run_cmd([str(x) for x in cmd_parts], cwd=root, logf=logf)
+            elif in_process:
+                _run_module([str(x) for x in cmd_parts], cwd=root, logf=logf)
             else:
                 _run_cmd([_python(), *[str(x) for x in cmd_parts]], cwd=root, logf=logf)
 
@@ -163,9 +233,8 @@ def run_pipeline_once(root: Path) -> None:
 
 def main() -> None:
     ap = argparse.ArgumentParser()
-    ap.add_argument("--time", default="14:01", help="触发时间，格式 HH:MM（默认 14:01）")
+    ap.add_argument("--time", default="14:01", help="触发时间（东八区），格式 HH:MM（默认 14:01）")
     ap.add_argument("--weekdays", default="1,2,3,4,5,6", help="周几触发：1=周一...7=周日（默认周一到周六）")
-    ap.add_argument("--poll", type=int, default=10, help="轮询间隔秒数（默认 10）")
     ap.add_argument("--once", action="store_true", help="立刻跑一次后退出（不进入常驻调度）")
     args = ap.parse_args()
 
@@ -173,7 +242,6 @@ def main() -> None:
     cfg = ScheduleConfig(
         weekdays=set(int(x) for x in args.weekdays.split(",") if x.strip()),
         hhmm=args.time,
-        poll_seconds=max(1, args.poll),
     )
 
     lock_file = _lock_path(root)
@@ -182,38 +250,34 @@ def main() -> None:
     if args.once:
         _acquire_lock(lock_file)
         try:
-            run_pipeline_once(root)
-            _write_last_run(state_file, _today_key(datetime.now()))
+            run_pipeline_once(root, in_process=True)
+            _write_last_run(state_file, _today_key(datetime.now(TZ_OFFSET)))
         finally:
             _release_lock(lock_file)
         return
 
     print(f"[SCHED] root={root}")
-    print(f"[SCHED] weekdays={sorted(cfg.weekdays)} time={cfg.hhmm} poll={cfg.poll_seconds}s")
+    print(f"[SCHED] weekdays={sorted(cfg.weekdays)} time={cfg.hhmm}")
 
+    # 直接睡到下一个触发时刻，不再每隔几秒醒来比对 HH:MM
     while True:
-        now = datetime.now()
-        # 周一=1...周日=7
-        if now.isoweekday() in cfg.weekdays and now.strftime("%H:%M") == cfg.hhmm:
-            today = _today_key(now)
-            last = _read_last_run(state_file)
-            if last != today:
-                print(f"\n[TRIGGER] {today} {cfg.hhmm}")
-                _acquire_lock(lock_file)
-                try:
-                    run_pipeline_once(root)
-                    _write_last_run(state_file, today)
-                except Exception as e:
-                    print(f"[ERROR] pipeline failed: {e}")
-                finally:
-                    _release_lock(lock_file)
-
-            # 避免在同一分钟内多次触发
-            time.sleep(65)
-            continue
-
-        time.sleep(cfg.poll_seconds)
+        next_run = _next_scheduled_dt(datetime.now(TZ_OFFSET), cfg)
+        print(f"[SCHED] next run at {next_run.isoformat(timespec='minutes')}")
+        _sleep_until(next_run)
 
+        today = _today_key(next_run)
+        last = _read_last_run(state_file)
+        if last == today:
+            continue
+        print(f"\n[TRIGGER] {today} {cfg.hhmm}")
+        _acquire_lock(lock_file)
+        try:
+            run_pipeline_once(root)
+            _write_last_run(state_file, today)
+        except Exception as e:
+            print(f"[ERROR] pipeline failed: {e}")
+        finally:
+            _release_lock(lock_file)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
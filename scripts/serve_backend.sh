@@ -0,0 +1,24 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+# 用 gunicorn + gevent 托管 backend.py：
+# /logs/stream、/wait_ready 等长连接跑在协程上，不会占满工作线程
+#
+# 只开 1 个 worker：backend 在进程内记录自己拉起的子进程（用于 wait/回收）和端口探测缓存，
+# 多 worker 之间不共享这些状态；并发由 gevent 协程提供
+#
+# 依赖：pip install gunicorn gevent
+
+ROOT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")/.." && pwd)"
+cd "${ROOT_DIR}"
+
+BIND="${BACKEND_BIND:-0.0.0.0:5050}"
+WORKER_CONNECTIONS="${BACKEND_WORKER_CONNECTIONS:-1000}"
+
+echo "[STEP] gunicorn backend:app bind=${BIND} worker_connections=${WORKER_CONNECTIONS}"
+exec gunicorn \
+  -k gevent \
+  -w 1 \
+  --worker-connections "${WORKER_CONNECTIONS}" \
+  -b "${BIND}" \
+  backend:app
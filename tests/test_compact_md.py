@@ -0,0 +1,84 @@
+"""
+analyze_03_deep._compact_md：OCR 解析结果压缩后再按 max_chars 截断
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(_ROOT / "pipeline"))
+
+from analyze_03_deep import _compact_md, _load_parsed_md  # noqa: E402
+
+PID = "2501.00001"
+
+MD = """# A Small Paper
+
+## 1 Introduction
+We study compact prompts.
+
+
+
+![Figure 1: overview](images/fig1.png)
+
+## 2 Method
+The method keeps section headings.
+
+
+
+
+## 3 Conclusion
+Compact prompts keep the conclusion.
+
+## 4 References
+[1] Someone. Some paper. 2020.
+
+## Appendix A
+Extra tables.
+"""
+
+
+@pytest.fixture
+def parse_json(tmp_path: Path) -> Path:
+    """analyze_02_parse 落盘的格式：{"results": {pid: {"md_content": ...}}}"""
+    p = tmp_path / f"{PID}.json"
+    p.write_text(json.dumps({"results": {PID: {"md_content": MD}}}, ensure_ascii=False), encoding="utf-8")
+    return p
+
+
+def test_keeps_headings(parse_json: Path) -> None:
+    title, md = _load_parsed_md(parse_json, PID)
+    assert title == "A Small Paper"
+    for heading in ("# A Small Paper", "## 1 Introduction", "## 2 Method", "## 3 Conclusion"):
+        assert heading in md
+
+
+def test_drops_boilerplate_and_collapses_blank_lines(parse_json: Path) -> None:
+    _title, md = _load_parsed_md(parse_json, PID)
+    assert "References" not in md
+    assert "Someone. Some paper." not in md
+    assert "Appendix" not in md
+    assert "![" not in md and "fig1.png" not in md
+    assert "\n\n\n" not in md
+    assert md == md.strip()
+
+
+def test_max_chars_keeps_conclusion(parse_json: Path) -> None:
+    _title, md = _load_parsed_md(parse_json, PID)
+    # main 里按 md[: args.max_chars] 截断；原文截断到同样长度会丢掉结论，压缩后结论完整保留
+    max_chars = len(md)
+    assert "keep the conclusion" not in MD[:max_chars]
+    assert md[:max_chars].endswith("Compact prompts keep the conclusion.")
+    assert len(md[:40]) == 40
+
+
+def test_no_references_heading_keeps_everything() -> None:
+    assert _compact_md("# T\n\nbody text\n") == "# T\n\nbody text"
+
+
+def test_references_only_document_is_not_emptied() -> None:
+    # 整篇都在参考文献标题之后时不丢正文
+    assert _compact_md("## References\n[1] x") == "## References\n[1] x"